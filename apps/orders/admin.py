@@ -10,7 +10,7 @@ from .models import (
     OrderItem,
     PercentCashback,
     Report,
-    PromoCode, Warehouse
+    PromoCode, Warehouse, OutboxMessage
 )
 from apps.services.generate_message import generate_order_message
 
@@ -50,13 +50,16 @@ class OrderAdmin(ModelAdmin):
     list_filter = ('order_time', 'order_status', 'is_pickup', 'is_read')
     list_display_links = ('id',)
     list_editable = ('order_status',)
-    readonly_fields = ('user', 'order_source', 'id', "is_read",)
+    readonly_fields = ('user', 'order_source', 'id', "is_read", 'subtotal', 'discount_amount', 'bonus_amount',
+                       'total_amount')
+    list_select_related = ('user',)
     inlines = [OrderItemInline]
 
-    def total_amount(self, obj):
-        return obj.get_total_amount()
-
-    total_amount.short_description = 'Общая сумма'
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Суммы хранятся в заказе: пересчитываем, только если поменялись позиции или промокод
+        if 'promo_code' in form.changed_data or any(formset.has_changed() for formset in formsets):
+            form.instance.update_totals()
 
     def link_to_user(self, obj):
         return format_html('<a href="{}">{}</a>', obj.user.get_admin_url() if obj.user else '', obj.user)
@@ -80,7 +83,8 @@ class OrderAdmin(ModelAdmin):
         obj = self.get_object(request, object_id)
         if obj and not obj.is_read:
             obj.is_read = True
-            obj.save()
+            # Один UPDATE колонки is_read: ни сигналов, ни уведомлений о статусе
+            obj.save(update_fields=['is_read'])
             messages.info(request, "Заказ отмечен как прочитанный.")
         return super().change_view(
             request,
@@ -120,3 +124,12 @@ class WarehouseAdmin(ModelAdmin):
                'comment']
     list_per_page = 10
     ordering = ('city',)
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(ModelAdmin):
+    list_display = ['id', 'topic', 'status', 'attempts', 'available_at', 'created_at']
+    list_filter = ['status', 'topic']
+    readonly_fields = ['topic', 'payload', 'attempts', 'last_error', 'created_at', 'processed_at']
+    ordering = ('-id',)
+    list_per_page = 20
@@ -1,7 +1,4 @@
-from decimal import Decimal
-
 import pytz
-from django.db import transaction
 from django.conf import settings
 from rest_framework import serializers
 
@@ -15,7 +12,8 @@ from apps.orders.models import (
 from apps.product.models import ProductSize, Product, Size, Topping, Color, ProductImage
 from django.utils.translation import gettext_lazy as _
 
-from apps.services.bonuces import calculate_bonus_points
+from apps.services.bonuces import calculate_bonus_points, get_percent_cashback
+from apps.services.order_pipeline import assemble_order
 
 
 class ToppingSerializer(serializers.ModelSerializer):
@@ -39,24 +37,6 @@ class ProductOrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['product_size_id', 'quantity', 'is_bonus', 'product', 'color', 'size', 'images']
 
-    def validate(self, data):
-        product_size_id = data.get('product_size_id')
-
-        product_size = ProductSize.objects.filter(id=product_size_id).first()
-        if not product_size:
-            raise serializers.ValidationError(f"ProductSize with id {product_size_id} does not exist.")
-
-        return data
-
-    def create(self, validated_data):
-        # Добавляем логику для сохранения color_name и size_name
-        product_size = ProductSize.objects.get(id=validated_data['product_size_id'])
-        validated_data['color_name'] = product_size.color.name
-        validated_data['size_name'] = product_size.size.name
-        validated_data['is_ordered'] = True
-
-        return super().create(validated_data)
-
     def get_product(self, obj):
         product_size = obj.product_size
         product = product_size.product
@@ -101,14 +81,15 @@ class ProductOrderItemSerializer(serializers.ModelSerializer):
         }
 
     def get_images(self, obj):
+        # Фото продукта из prefetch, если позиции загружены с ним (OrderAssembler, apply_order_history_plan)
         product = obj.product_size.product
-        images = ProductImage.objects.filter(product=product)
+        images = product.product_images.all()
 
         request = self.context.get('request')
         return [
             {
                 'image_url': request.build_absolute_uri(image.image.url) if request else image.image.url,
-                'color_id': image.color.id
+                'color_id': image.color_id
             }
             for image in images if image.image
         ]
@@ -116,7 +97,6 @@ class ProductOrderItemSerializer(serializers.ModelSerializer):
 
 class OrderListSerializer(serializers.ModelSerializer):
     order_items = ProductOrderItemSerializer(many=True, required=False)
-    total_amount = serializers.SerializerMethodField()
     order_time = serializers.SerializerMethodField()
     user_address = serializers.SerializerMethodField()
     app_download_url = serializers.SerializerMethodField()
@@ -128,11 +108,14 @@ class OrderListSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Order
-        fields = ['id', 'total_amount', 'order_time', 'order_items', 'total_bonus_amount', 'payment_method',
+        fields = ['id', 'subtotal', 'discount_amount', 'bonus_amount', 'total_amount', 'order_time', 'order_items',
+                  'total_bonus_amount', 'payment_method',
                   'is_pickup', 'user_address', 'app_download_url', 'order_status', 'warehouse_info', 'order_source']
-
-    def get_total_amount(self, obj):
-        return obj.get_total_amount()
+        # Суммы хранятся в заказе; числами, как и раньше отдавалась total_amount
+        extra_kwargs = {
+            field: {'coerce_to_string': False}
+            for field in ('subtotal', 'discount_amount', 'bonus_amount', 'total_amount')
+        }
 
     def get_order_time(self, obj):
         local_tz = pytz.timezone(settings.TIME_ZONE)
@@ -186,8 +169,11 @@ class OrderListSerializer(serializers.ModelSerializer):
         if obj.total_bonus_amount:
             return obj.total_bonus_amount
 
-        # Если бонусы еще не начислены, вычисляем потенциальное количество бонусов
-        bonus_points = calculate_bonus_points(obj.total_amount, 0, obj.order_source)
+        # Если бонусы еще не начислены, вычисляем потенциальное количество бонусов;
+        # настройки кэшбэка загружаются один раз на запрос — контекст общий для всех заказов списка
+        if 'percent_cashback' not in self.context:
+            self.context['percent_cashback'] = get_percent_cashback()
+        bonus_points = calculate_bonus_points(obj.total_amount, 0, obj.order_source, self.context['percent_cashback'])
         return bonus_points
 
     def get_warehouse_info(self, obj):
@@ -248,7 +234,8 @@ class OrderSerializer(serializers.ModelSerializer):
         products_data = validated_data.pop('order_items', [])
         promo_code_data = validated_data.pop('promo_code', None)
         warehouse_id = validated_data.pop('warehouse_id', None)
-        if validated_data.get('is_pickup') and warehouse_id:
+        # CreateOrderView уже проверил склад и адрес и передаёт их в save()
+        if validated_data.get('is_pickup') and warehouse_id and 'warehouse' not in validated_data:
             try:
                 warehouse = Warehouse.objects.get(id=warehouse_id)
                 validated_data['warehouse'] = warehouse  # Attach warehouse to the order
@@ -257,59 +244,16 @@ class OrderSerializer(serializers.ModelSerializer):
 
         # Handle user_address_id for courier orders
         user_address_id = validated_data.pop('user_address_id', None)
-        if not validated_data.get('is_pickup') and user_address_id:
+        if not validated_data.get('is_pickup') and user_address_id and 'user_address' not in validated_data:
             user_address = UserAddress.objects.get(id=user_address_id, user=self.context['request'].user)
             validated_data['user_address'] = user_address
+        elif user_address_id and 'user_address' not in validated_data:
+            validated_data['user_address_id'] = user_address_id
 
-        with transaction.atomic():
-            # Создаем заказ без финальной суммы
-            order = Order.objects.create(**validated_data)
-
-            if user_address_id:
-                order.user_address_id = user_address_id
-                order.save()
-
-            total_amount = Decimal(0)
-
-            # Добавляем продукты в заказ
-            for product_data in products_data:
-                product_size = ProductSize.objects.filter(id=product_data['product_size_id']).first()
-                if not product_size:
-                    raise serializers.ValidationError(
-                        f"ProductSize with id {product_data['product_size_id']} does not exist.")
-
-                order_item = OrderItem(
-                    order=order,
-                    product_size=product_size,
-                    quantity=product_data['quantity'],
-                    is_bonus=product_data.get('is_bonus', False)
-                )
-                order_item.save()  # Сохраняем элемент заказа
-
-                # Добавляем к общей сумме заказа стоимость текущего продукта
-                total_amount += order_item.total_amount
-                print(
-                    f"Added item to order: {order_item.product_size.product.name} - {order_item.size_name} - {order_item.quantity} шт.. Total so far: {total_amount}")
-
-            order.total_amount = total_amount
-            print(f"Order total amount before promo: {order.total_amount}")
-
-            if promo_code_data:
-                promo_code_instance = PromoCode.objects.filter(code=promo_code_data).first()
-                if not promo_code_instance or not promo_code_instance.is_valid():
-                    raise serializers.ValidationError({"promo_code": "Промокод недействителен или его срок истек."})
-                order.promo_code = promo_code_instance
-                order.total_amount = order.apply_promo_code()
-                print(f"Order total amount after promo: {order.total_amount}")
-
-            order.save()
-
-            for product_data in products_data:
-                product_size = ProductSize.objects.filter(id=product_data['product_size_id']).first()
-                product_size.product.is_ordered = True
-                product_size.product.save()
-
-        return order
+        # Позиции, остатки, промокод и бонусы — одним проходом, заказ сохраняется один раз
+        return assemble_order(
+            validated_data.pop('user', None), products_data, promo_code=promo_code_data, **validated_data
+        )
 
 
 class ProductOrderItemPreviewSerializer(serializers.Serializer):
@@ -6,10 +6,8 @@ from datetime import datetime
 from decouple import config
 
 from django.http import JsonResponse
-from django.core.mail import send_mail
 from django.conf import settings
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from django.db import transaction
 from django.utils.timezone import localtime
 from django.shortcuts import get_object_or_404
 
@@ -29,11 +27,15 @@ from .serializers import (
 )
 from ..freedompay import generate_signature
 from ...services.bonuces import calculate_bonus_points, apply_bonus_points
+from ...services.order_history import apply_order_history_plan
+from ...services.order_notifications import enqueue_confirmation_email
+from ...services.pagination import KeysetPagination
 
 PAYBOX_URL = config('PAYBOX_URL')
 PAYBOX_MERCHANT_ID = config('PAYBOX_MERCHANT_ID')
 PAYBOX_MERCHANT_SECRET = config('PAYBOX_MERCHANT_SECRET')
 PAYBOX_MERCHANT_SECRET_PAYOUT = config('PAYBOX_MERCHANT_SECRET_PAYOUT')
+PAYBOX_TIMEOUT = 10
 
 
 
@@ -42,12 +44,13 @@ logger = logging.getLogger(__name__)
 
 class ListOrderView(generics.ListAPIView):
     serializer_class = OrderListSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         user = self.request.user
         if user.is_anonymous:
             return Order.objects.none()
-        return Order.objects.filter(user=user).order_by('-id')
+        return apply_order_history_plan(Order.objects.filter(user=user).order_by('-id'))
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -59,12 +62,14 @@ class ListOrderView(generics.ListAPIView):
 
 def get_user_orders(request):
     user_id = request.GET.get('user_id')
+    # Один запрос по хранимым полям: ни позиции, ни связи заказа не нужны
     orders = Order.objects.filter(user_id=user_id).values(
         'id', 'order_time', 'total_amount', 'order_status'
     ).order_by('-id')
+    statuses = dict(Order._meta.get_field('order_status').choices)
     for order in orders:
         order['order_time'] = localtime(order['order_time']).strftime('%d/%m/%Y, %H:%M')
-        order['order_status'] = dict(Order._meta.get_field('order_status').choices)[order['order_status']]
+        order['order_status'] = statuses[order['order_status']]
 
     return JsonResponse({'orders': list(orders)}, safe=False)
 
@@ -72,7 +77,7 @@ def get_user_orders(request):
 def get_order_details(request):
     order_id = request.GET.get('order_id')
     try:
-        order = get_object_or_404(Order, id=order_id)
+        order = get_object_or_404(apply_order_history_plan(Order.objects.all()), id=order_id)
 
         # Используем сериализатор для преобразования данных заказа
         serializer = OrderListSerializer(order, context={'request': request})
@@ -119,56 +124,17 @@ class CreateOrderView(generics.CreateAPIView):
                     return Response({"error": "Некорректный адрес или адрес не принадлежит пользователю."},
                                     status=status.HTTP_400_BAD_REQUEST)
 
-            # Create order and process items
+            # Заказ собирается одним проходом: позиции, списание остатков и бонусов — в одной транзакции,
+            # в ней же пишутся сообщения outbox (пуш, письмо, веб-сокет); отправляет их воркер run_outbox_worker
             serializer = self.get_serializer(data=request.data)
             serializer.is_valid(raise_exception=True)
-            order = serializer.save(user=request.user)
-
-            # Attach warehouse or address to the order
-            if is_pickup:
-                order.warehouse = warehouse
-            elif user_address:
-                order.user_address = user_address
-            order.save()
-
-            # Уменьшаем количество продуктов на складе и рассчитываем стоимость заказа
-            total_order_amount = 0
-            total_bonus_amount = 0  # Инициализируем сумму бонусов
-            for item in order.order_items.all():
-                product_size = item.product_size
-                if product_size.quantity >= item.quantity:
-                    product_size.quantity -= item.quantity
-                    product_size.save()
-                    item.is_ordered = True
-                    item.save()
-
-                    # Рассчитываем цену на основе скидок и бонусов
-                    if item.is_bonus and product_size.bonus_price is not None:
-                        item_price = product_size.bonus_price
-                        total_bonus_amount += item_price * item.quantity
-                    elif product_size.discounted_price is not None:
-                        item_price = product_size.discounted_price
-                    else:
-                        item_price = product_size.price
-
-                    # Добавляем стоимость каждого товара в итоговую сумму заказа
-                    total_order_amount += item_price * item.quantity
-
+            with transaction.atomic():
+                if is_pickup:
+                    order = serializer.save(user=request.user, warehouse=warehouse)
                 else:
-                    return Response({"error": f"Недостаточно товара на складе для {item.product_size.product.name}."},
-                                    status=status.HTTP_400_BAD_REQUEST)
-
-            # Обрабатываем оплату бонусами
-            if total_bonus_amount > 0:
-                if request.user.bonus is None or request.user.bonus < total_bonus_amount:
-                    return Response({"error": "Недостаточно бонусов для оплаты."}, status=status.HTTP_400_BAD_REQUEST)
-
-                request.user.bonus -= total_bonus_amount
-                request.user.save()
-
-            # Обновляем итоговую сумму заказа
-            order.total_amount = total_order_amount
-            order.save()
+                    order = serializer.save(user=request.user, user_address=user_address)
+                if request.user.email:
+                    enqueue_confirmation_email(order, request.user.email)
 
             # Формируем ответ на заказ
             order_serializer = OrderSerializer(order, context={'request': request})
@@ -192,11 +158,6 @@ class CreateOrderView(generics.CreateAPIView):
                 # Добавляем redirect_url в ответ
                 response_data["redirect_url"] = payment_url
 
-            # Отправляем подтверждение по email, если указано
-            email = request.user.email
-            if email:
-                self.send_order_confirmation_email(email, order_serializer.data)
-
             return Response(response_data, status=status.HTTP_201_CREATED)
 
         return Response({"error": "Требуется аутентификация для создания заказа."}, status=status.HTTP_401_UNAUTHORIZED)
@@ -224,7 +185,8 @@ class CreateOrderView(generics.CreateAPIView):
         params['pg_sig'] = generate_signature(params, 'init_payment.php')
 
         try:
-            response = requests.post(url, data=params)
+            # Ссылка на оплату нужна в ответе, поэтому инициализация остаётся в запросе, но не дольше таймаута
+            response = requests.post(url, data=params, timeout=PAYBOX_TIMEOUT)
             response.raise_for_status()  # Raise an error for bad responses
 
             # Log the response for debugging
@@ -251,20 +213,6 @@ class CreateOrderView(generics.CreateAPIView):
             print(f"Error during request to Paybox: {e}")
             return Response({"error": "Failed to initiate payment."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-    def send_order_confirmation_email(self, email, order_data):
-        subject = 'Ваш заказ успешно создан'
-        html_message = render_to_string('order_confirmation_email.html', {'order': order_data})
-        plain_message = strip_tags(html_message)
-
-        send_mail(
-            subject=subject,
-            message=plain_message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[email],
-            fail_silently=False,
-            html_message=html_message
-        )
-
 
 class OrderPreviewView(generics.GenericAPIView):
     serializer_class = OrderPreviewSerializer
@@ -0,0 +1,85 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.test import APIClient
+
+from apps.authentication.models import User, UserAddress
+from apps.product.models import Category, Color, Product, ProductSize, Size
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Считает запросы и время оформления заказа с корзиной из N позиций через create-order/. "
+        "Данные откатываются после замера."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=50, help="Позиций в корзине")
+        parser.add_argument('--verbose-queries', action='store_true', help="Вывести запросы по таблицам")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                user, address, variants = self.create_data(options['items'])
+                client = APIClient()
+                client.force_authenticate(user)
+                payload = {
+                    'is_pickup': False,
+                    'user_address_id': address.id,
+                    'payment_method': 'cash',
+                    'order_source': 'mobile',
+                    'products': [{'product_size_id': variant.id, 'quantity': 1} for variant in variants],
+                }
+                queries = Counter()
+
+                def count(execute, sql, params, many, context):
+                    queries[self.query_kind(sql)] += 1
+                    return execute(sql, params, many, context)
+
+                started = time.perf_counter()
+                with connection.execute_wrapper(count):
+                    response = client.post('/api/v1/orders/create-order/', payload, format='json')
+                elapsed = (time.perf_counter() - started) * 1000
+                if response.status_code != 201:
+                    self.stderr.write(f"Ответ {response.status_code}: {response.content[:500]!r}")
+                self.stdout.write(self.style.SUCCESS(
+                    f"Корзина из {options['items']} позиций: {sum(queries.values())} запросов, {elapsed:.0f} мс"
+                ))
+                if options['verbose_queries']:
+                    for kind, number in queries.most_common():
+                        self.stdout.write(f"{number:>6}  {kind}")
+                raise Rollback
+        except Rollback:
+            pass
+
+    def query_kind(self, sql):
+        # Оператор и первая таблица: SELECT "product_productsize", UPDATE "orders_order"...
+        statement = sql.split()[0]
+        if statement in ('SAVEPOINT', 'RELEASE', 'ROLLBACK'):
+            return 'SAVEPOINT'
+        table = sql.split('"')[1] if '"' in sql else ''
+        return f'{statement} {table}'
+
+    def create_data(self, count):
+        # bulk_create пользователя — без синхронизации с Firestore в post_save
+        user = User.objects.bulk_create([User(phone_number='+996700999999', bonus=0)])[0]
+        address = UserAddress.objects.create(user=user, city='Бишкек', apartment_number='1')
+        category = Category.objects.create(name='Бенчмарк заказов', slug='benchmark-orders')
+        color = Color.objects.create(name='Бенчмарк')
+        size, _ = Size.objects.get_or_create(name='42')
+        products = Product.objects.bulk_create(
+            Product(name=f'Заказ {index}', slug=f'benchmark-orders-{index}', category=category,
+                    photo='product_photos/product.webp', price=1000 + index, article=f'{index:09d}')
+            for index in range(count)
+        )
+        variants = ProductSize.objects.bulk_create(
+            ProductSize(product=product, size=size, color=color, quantity=10, price=product.price)
+            for product in products
+        )
+        return user, address, variants
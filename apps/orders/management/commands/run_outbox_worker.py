@@ -0,0 +1,43 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.services.order_notifications import has_shared_channel_layer
+from apps.services.outbox import MAX_ATTEMPTS, process_outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Выполняет побочные эффекты заказов из outbox: пуши, письма, веб-сокет и Telegram. "
+        "Можно запускать несколько воркеров — строки делятся через SELECT ... FOR UPDATE SKIP LOCKED."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help="Сообщений за один проход")
+        parser.add_argument('--concurrency', type=int, default=8, help="Параллельных обработчиков")
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS)
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Пауза, когда очередь пуста, с")
+        parser.add_argument('--once', action='store_true', help="Обработать то, что есть, и выйти")
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        if not has_shared_channel_layer():
+            self.stderr.write("Слой каналов в памяти процесса: сообщения 'websocket' не выполняются, задайте REDIS_URL")
+
+        while not self.stopping:
+            close_old_connections()
+            claimed, done = process_outbox(options['batch_size'], options['concurrency'], options['max_attempts'])
+            if claimed:
+                self.stdout.write(f"Выполнено {done} из {claimed}")
+            elif options['once']:
+                break
+            else:
+                time.sleep(options['poll_interval'])
+
+    def stop(self, signum, frame):
+        # Текущая пачка дорабатывается; недоделанное вернётся в очередь по окончании аренды
+        self.stopping = True
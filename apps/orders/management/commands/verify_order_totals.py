@@ -0,0 +1,48 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q, Sum
+
+from apps.orders.models import TOTAL_FIELDS, Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверяет хранимые суммы заказов (subtotal, скидка, бонусы, итог) с позициями и промокодом. "
+        "С --fix пересчитывает расходящиеся заказы."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Пересчитать суммы расходящихся заказов")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        # Суммы позиций считаются одним агрегатом на весь проход, а не запросом на заказ
+        orders = Order.objects.select_related('promo_code').annotate(
+            items_subtotal=Sum('order_items__total_amount', default=Decimal(0)),
+            items_bonus_amount=Sum('order_items__total_amount', filter=Q(order_items__is_bonus=True),
+                                   default=Decimal(0)),
+        ).order_by('id')
+
+        drifted = []
+        for order in orders.iterator(chunk_size=options['chunk_size']):
+            stored = [getattr(order, field) for field in TOTAL_FIELDS]
+            order.apply_totals(order.items_subtotal, order.items_bonus_amount)
+            expected = [getattr(order, field) for field in TOTAL_FIELDS]
+            if stored != expected:
+                drifted.append(order)
+                self.stdout.write(
+                    f"Заказ #{order.id}: " + ", ".join(
+                        f"{field} {old} → {new}"
+                        for field, old, new in zip(TOTAL_FIELDS, stored, expected) if old != new
+                    )
+                )
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS("Суммы всех заказов совпадают с позициями"))
+            return
+        if not options['fix']:
+            raise CommandError(f"Расхождения в {len(drifted)} заказах; запустите с --fix для пересчёта")
+        # apply_totals уже выставил ожидаемые значения
+        Order.objects.bulk_update(drifted, TOTAL_FIELDS, batch_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f"Пересчитано заказов: {len(drifted)}"))
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.7 on 2026-10-18 21:30
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+
+def fill_order_totals(apps, schema_editor):
+    # Сумма позиций и её бонусная часть — из сохранённых позиций; скидка — то, что промокод уже снял с итога
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+
+    def items_sum(condition=Q()):
+        items = OrderItem.objects.filter(condition, order=OuterRef('pk')).order_by().values('order')
+        return Coalesce(Subquery(items.annotate(total=Sum('total_amount')).values('total')), Value(Decimal(0)))
+
+    Order.objects.update(subtotal=items_sum(), bonus_amount=items_sum(Q(is_bonus=True)))
+    Order.objects.update(
+        discount_amount=Greatest(F('subtotal') - Coalesce(F('total_amount'), F('subtotal')), Value(Decimal(0)))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_percentcashback_delivery_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='bonus_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Оплачено бонусами'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='discount_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Скидка по промокоду'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='subtotal',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Сумма позиций'),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
@@ -2,18 +2,40 @@ import random
 import string
 from decimal import Decimal
 
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Q, Sum
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from apps.pages.models import SingletonModel
+from apps.services.change_tracking import ChangeTrackingMixin
 from apps.product.models import ProductSize, Topping, Size
 
 
-class Order(models.Model):
+# Поля сумм заказа, которые пишет Order.update_totals
+TOTAL_FIELDS = ['subtotal', 'discount_amount', 'bonus_amount', 'total_amount']
+
+
+def variant_unit_price(product_size, is_bonus):
+    """Цена единицы позиции: бонусная для бонусной позиции, иначе цена варианта со скидкой, иначе обычная."""
+    if is_bonus and product_size.bonus_price is not None:
+        return product_size.bonus_price
+    if product_size.discounted_price is not None:
+        return product_size.discounted_price
+    return product_size.price
+
+
+class Order(ChangeTrackingMixin, models.Model):
     order_time = models.DateTimeField(auto_now_add=True, verbose_name=_('Время заказа'))
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name=_('Общая сумма'), blank=True,
                                        null=True)
     total_bonus_amount = models.IntegerField(verbose_name=_('Общая сумма бонусов'), blank=True, null=True)
+    subtotal = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name=_('Сумма позиций'))
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0,
+                                          verbose_name=_('Скидка по промокоду'))
+    bonus_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0,
+                                       verbose_name=_('Оплачено бонусами'))
 
     user = models.ForeignKey('authentication.User', on_delete=models.CASCADE, related_name='orders', verbose_name=_('Пользователь')
                              , blank=True, null=True)
@@ -56,6 +78,9 @@ class Order(models.Model):
     warehouse = models.ForeignKey('Warehouse', null=True, blank=True, on_delete=models.SET_NULL, related_name='orders')
     is_read = models.BooleanField(default=False, verbose_name=_("Прочитано"))
 
+    # Служебные поля: их сохранение — один UPDATE без сигналов (отметка о прочтении, пересчёт сумм)
+    bookkeeping_fields = frozenset(['is_read', *TOTAL_FIELDS])
+
     class Meta:
         verbose_name = _("Заказ")
         verbose_name_plural = _("Заказы")
@@ -63,58 +88,26 @@ class Order(models.Model):
     def __str__(self):
         return f"Заказ #{self.id}"
 
-    def apply_promo_code(self):
-        discount_amount = Decimal(0)  # Инициализируем переменную
-        print(f"Applying promo code, current total amount: {self.total_amount}")
-
-        # Убедимся, что сумма заказа не None
-        if self.total_amount is None:
-            self.total_amount = Decimal(0)
-
-        if self.promo_code and self.promo_code.is_valid():
-            print(f"Promo code: {self.promo_code.code}")
-
-            # Применение процентного промо-кода
-            if self.promo_code.type == '%':
-                discount_rate = Decimal(self.promo_code.discount) / Decimal(100)
-                discount_amount = discount_rate * self.total_amount
-                print(f"Discount rate: {discount_rate}, Discount amount: {discount_amount}")
-
-            # Применение фиксированного промо-кода (сом)
-            elif self.promo_code.type == 'сом':
-                discount_amount = Decimal(self.promo_code.discount)
-                print(f"Fixed discount amount: {discount_amount}")
-
-            # Убедимся, что сумма скидки не превышает общую сумму заказа
-            discount_amount = min(discount_amount, self.total_amount)
-            print(f"Final discount amount applied: {discount_amount}")
-
-        # Вычитаем скидку из общей суммы
-        new_total_amount = self.total_amount - discount_amount
-        print(f"Total amount after applying promo code: {new_total_amount}")
-
-        return new_total_amount
-
-    def get_total_amount(self):
-        total_amount = Decimal(0)
-        # Calculate total amount based on ProductSize prices
-        for order_item in self.order_items.all():
-            product_size = order_item.product_size
-            if order_item.is_bonus and product_size.bonus_price is not None:
-                total_amount += product_size.bonus_price * order_item.quantity
-            elif product_size.discounted_price is not None:
-                total_amount += product_size.discounted_price * order_item.quantity
-            else:
-                total_amount += product_size.price * order_item.quantity
-        return total_amount
-
-    def get_total_bonus_amount(self):
-        total_bonus_amount = self.total_bonus_amount or 0
-        # Calculate total bonus amount based on ProductSize bonus_price
-        for order_item in self.order_items.filter(is_bonus=True):
-            product_size = order_item.product_size
-            total_bonus_amount += product_size.bonus_price * order_item.quantity
-        return total_bonus_amount
+    def apply_totals(self, subtotal, bonus_amount):
+        """
+        Шаг расчёта сумм: subtotal — сумма позиций (включая бонусные), bonus_amount — её часть, оплаченная
+        бонусами; скидка по промокоду считается от subtotal, итог — subtotal без скидки. Ничего не сохраняет.
+        """
+        self.subtotal = subtotal
+        self.bonus_amount = bonus_amount
+        discount = self.promo_code.discount_for(subtotal) if self.promo_code else Decimal(0)
+        # Округляем, как хранит поле: иначе сверка увидит расхождение в тысячных
+        self.discount_amount = discount.quantize(Decimal('0.01'))
+        self.total_amount = subtotal - self.discount_amount
+
+    def update_totals(self):
+        """Пересчитывает и сохраняет суммы по сохранённым позициям одним агрегатом — только при изменении позиций."""
+        totals = self.order_items.aggregate(
+            subtotal=Sum('total_amount', default=Decimal(0)),
+            bonus_amount=Sum('total_amount', filter=Q(is_bonus=True), default=Decimal(0)),
+        )
+        self.apply_totals(totals['subtotal'], totals['bonus_amount'])
+        self.save(update_fields=TOTAL_FIELDS)
 
     def apply_bonuses(self):
         from apps.services.bonuces import calculate_bonus_points, apply_bonus_points
@@ -123,16 +116,7 @@ class Order(models.Model):
             bonus_points = calculate_bonus_points(self.total_amount, 0, self.order_source)
             self.total_bonus_amount = bonus_points  # Сохраняем бонусы в заказе
             apply_bonus_points(self.user, bonus_points)
-            self.save()
-
-    def save(self, *args, **kwargs):
-        # Применяем промо-код только если общая сумма не была ранее уменьшена
-        if not self.total_amount or self.total_amount == self.get_total_amount():
-            print(f"Applying promo code, current total amount: {self.total_amount}")
-            self.total_amount = self.apply_promo_code()
-            print(f"Total amount after applying promo code: {self.total_amount}")
-
-        super().save(*args, **kwargs)
+            self.save(update_fields=['total_bonus_amount'])
 
 
 class OrderItem(models.Model):
@@ -159,16 +143,7 @@ class OrderItem(models.Model):
         return f"Товар - {self.size_name if self.size_name else 'Размер не указан'} - {self.quantity} шт."
 
     def calculate_total_amount(self):
-        if not self.is_bonus:
-            product = self.product_size.product  # Получаем связанный продукт
-            # Используем discounted_price, если оно есть, иначе обычную цену
-            price = product.discounted_price if product.discounted_price else product.price
-            total = self.quantity * price
-            return total
-        else:
-            # Получаем бонусную цену из продукта
-            total = self.quantity * self.product_size.product.bonus_price
-            return total
+        return variant_unit_price(self.product_size, self.is_bonus) * self.quantity
 
     def save(self, *args, **kwargs):
         # Сохраняем названия размера и цвета, если есть product_size
@@ -179,21 +154,15 @@ class OrderItem(models.Model):
             self.color_name = self.product_size.color.name if self.product_size.color else "Цвет не указан"
             self.color_id = self.product_size.color.id if self.product_size.color else None
 
-        # Рассчитываем общую сумму
-        self.total_amount = self.calculate_total_amount()
+            # Рассчитываем общую сумму
+            self.total_amount = self.calculate_total_amount()
 
         # Сохраняем элемент заказа
         super().save(*args, **kwargs)
 
-        # Обновляем общую сумму заказа
-        self.order.total_amount = self.order.get_total_amount()
+        # Позиции изменились — пересчитываем суммы заказа
+        self.order.update_totals()
 
-        # Если товар оплачивается бонусами, обновляем общую сумму бонусов заказа
-        if self.is_bonus:
-            self.order.total_bonus_amount = self.order.get_total_bonus_amount()
-
-        # Сохраняем изменения в заказе
-        self.order.save()
 
 class PercentCashback(SingletonModel):
     mobile_percent = models.IntegerField(verbose_name=_("Процент за мобильное приложение"))
@@ -244,6 +213,16 @@ class PromoCode(models.Model):
         from django.utils import timezone
         return self.active and self.valid_from <= timezone.now() <= self.valid_to
 
+    def discount_for(self, amount):
+        """Скидка на сумму amount, не больше самой суммы. Срок действия проверяется при оформлении заказа."""
+        if self.type == '%':
+            discount = Decimal(self.discount) / Decimal(100) * amount
+        elif self.type == 'сом':
+            discount = Decimal(self.discount)
+        else:
+            discount = Decimal(0)
+        return min(discount, amount)
+
 
 class Warehouse(models.Model):
     city = models.CharField(max_length=100, verbose_name=_("Адрес"), null=True, blank=True)
@@ -262,3 +241,36 @@ class Warehouse(models.Model):
 
         verbose_name = _("Склад")
         verbose_name_plural = _("Склады")
+
+
+class OutboxMessage(models.Model):
+    """
+    Побочный эффект заказа (пуш, письмо, сообщение в веб-сокет или Telegram): строка пишется в той же
+    транзакции, что и заказ, а выполняет её воркер run_outbox_worker — запрос не ждёт внешних сервисов.
+    """
+    STATUS_CHOICES = [
+        ('pending', _('В очереди')),
+        ('done', _('Выполнено')),
+        ('failed', _('Ошибка')),
+    ]
+
+    topic = models.CharField(max_length=50, verbose_name=_('Обработчик'))
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder, verbose_name=_('Данные'))
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', verbose_name=_('Статус'))
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name=_('Попыток'))
+    # Когда строку можно взять: время следующей попытки или конец аренды взявшего её воркера
+    available_at = models.DateTimeField(default=timezone.now, verbose_name=_('Доступно с'))
+    last_error = models.TextField(blank=True, verbose_name=_('Последняя ошибка'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Создано'))
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Выполнено'))
+
+    class Meta:
+        verbose_name = _("Сообщение outbox")
+        verbose_name_plural = _("Outbox")
+        indexes = [
+            models.Index(fields=['available_at', 'id'], condition=models.Q(status='pending'),
+                         name='outbox_pending'),
+        ]
+
+    def __str__(self):
+        return f"{self.topic} #{self.id} ({self.status})"
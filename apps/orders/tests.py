@@ -1,3 +1,521 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import close_old_connections, connection
+from django.db.models.signals import post_save, pre_save
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from apps.authentication.models import User, UserAddress
+from apps.orders.models import Order, OrderItem, OutboxMessage, PercentCashback, PromoCode
+from apps.product.models import ProductImage, ProductListing, ProductSize
+from apps.product.tests import ProductFixturesMixin
+from apps.services.inventory import InsufficientStock, reserve_stock
+from apps.services.order_pipeline import assemble_order
+from apps.services.outbox import HANDLERS, claim_messages, enqueue, process_outbox
+
+
+def run_in_parallel(function, count):
+    """Запускает function(index) в count потоках одновременно; у каждого потока своё соединение с базой."""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+
+    def worker(index):
+        try:
+            barrier.wait()
+            results[index] = function(index)
+        except Exception as error:
+            results[index] = error
+        finally:
+            close_old_connections()
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class OrderFixturesMixin(ProductFixturesMixin):
+    url = '/api/v1/orders/create-order/'
+
+    @classmethod
+    def create_variants(cls, count, quantity=5):
+        products = cls.create_catalog(count)
+        ProductSize.objects.filter(product__in=products).update(quantity=quantity)
+        return list(ProductSize.objects.filter(product__in=products).select_related('product').order_by('id'))
+
+    def place_order(self, lines, **data):
+        payload = {
+            'is_pickup': False,
+            'user_address_id': self.address.id,
+            'payment_method': 'cash',
+            'order_source': 'mobile',
+            'products': [
+                {'product_size_id': variant.id, 'quantity': quantity, 'is_bonus': is_bonus}
+                for variant, quantity, is_bonus in lines
+            ],
+            **data,
+        }
+        return self.client.post(self.url, payload, format='json')
+
+
+class OrderCreationTests(OrderFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('+996700000101')
+        cls.address = UserAddress.objects.create(user=cls.user, city='Бишкек', apartment_number='1')
+        cls.variants = cls.create_variants(20)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def count_queries(self, size):
+        with CaptureQueriesContext(connection) as context:
+            response = self.place_order([(variant, 1, False) for variant in self.variants[:size]])
+        self.assertEqual(response.status_code, 201, response.data)
+        return len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        self.assertEqual(self.count_queries(3), self.count_queries(20))
+
+    def test_items_totals_and_stock_are_written_once(self):
+        first, second = self.variants[:2]
+        saved = []
+
+        def remember(sender, instance, created, **kwargs):
+            saved.append(created)
+
+        post_save.connect(remember, sender=Order)
+        self.addCleanup(post_save.disconnect, remember, sender=Order)
+        response = self.place_order([(first, 2, False), (second, 1, False)])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(saved, [True])
+
+        order = Order.objects.get(id=response.data['order']['id'])
+        self.assertEqual(order.user_address, self.address)
+        self.assertEqual(order.total_amount, first.price * 2 + second.price)
+        items = {item.product_size_id: item for item in order.order_items.all()}
+        self.assertEqual(items[first.id].total_amount, first.price * 2)
+        self.assertEqual((items[first.id].size_name, items[first.id].color_name), ('42', 'Черный'))
+        self.assertTrue(items[first.id].is_ordered)
+        first.refresh_from_db()
+        self.assertEqual(first.quantity, 3)
+        self.assertEqual(ProductListing.objects.get(product=first.product).stock_quantity, 3)
+        self.assertEqual(len(response.data['order']['products']), 2)
+
+    def test_promo_code_is_applied_once(self):
+        now = timezone.now()
+        PromoCode.objects.create(code='SALE10', valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1),
+                                 discount=10, active=True, type='%')
+        variant = self.variants[0]
+        response = self.place_order([(variant, 1, False)], promo_code='SALE10')
+        self.assertEqual(response.status_code, 201, response.data)
+        order = Order.objects.get(id=response.data['order']['id'])
+        self.assertEqual(order.total_amount, variant.price * Decimal('0.9'))
+        order.is_read = True
+        order.save()
+        order.refresh_from_db()
+        self.assertEqual(order.total_amount, variant.price * Decimal('0.9'))
+
+    def test_failed_check_leaves_nothing_behind(self):
+        first, second = self.variants[:2]
+        response = self.place_order([(first, 1, False), (second, 6, False)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(second.product.name, response.data['error'])
+        self.assertFalse(Order.objects.exists())
+        first.refresh_from_db()
+        self.assertEqual(first.quantity, 5)
+
+        ProductSize.objects.filter(id=first.id).update(bonus_price=100)
+        response = self.place_order([(first, 1, True)])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], "Недостаточно бонусов для оплаты.")
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_bonus_items_are_paid_with_bonuses(self):
+        variant = self.variants[0]
+        ProductSize.objects.filter(id=variant.id).update(bonus_price=100)
+        User.objects.filter(id=self.user.id).update(bonus=250)
+        response = self.place_order([(variant, 2, True)])
+        self.assertEqual(response.status_code, 201, response.data)
+        order = Order.objects.get(id=response.data['order']['id'])
+        self.assertEqual(order.total_bonus_amount, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.bonus, 50)
+
+
+class OrderTotalsTests(OrderFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('+996700000103')
+        cls.address = UserAddress.objects.create(user=cls.user, city='Бишкек', apartment_number='1')
+        cls.variants = cls.create_variants(3)
+        now = timezone.now()
+        cls.promo_code = PromoCode.objects.create(code='SALE20', valid_from=now - timedelta(days=1),
+                                                  valid_to=now + timedelta(days=1), discount=20, active=True, type='%')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def create_order(self, **data):
+        first, second = self.variants[:2]
+        ProductSize.objects.filter(id=second.id).update(bonus_price=100)
+        User.objects.filter(id=self.user.id).update(bonus=1000)
+        response = self.place_order([(first, 2, False), (second, 1, True)], **data)
+        self.assertEqual(response.status_code, 201, response.data)
+        return Order.objects.get(id=response.data['order']['id'])
+
+    def test_pricing_step_stores_all_totals(self):
+        order = self.create_order(promo_code='SALE20')
+        subtotal = self.variants[0].price * 2 + 100
+        self.assertEqual(order.subtotal, subtotal)
+        self.assertEqual(order.bonus_amount, 100)
+        self.assertEqual(order.discount_amount, subtotal * Decimal('0.2'))
+        self.assertEqual(order.total_amount, subtotal * Decimal('0.8'))
+
+    def test_totals_follow_item_changes_only(self):
+        order = self.create_order()
+        item = order.order_items.get(is_bonus=False)
+        item.quantity = 3
+        item.save()
+        order.refresh_from_db()
+        self.assertEqual(order.subtotal, self.variants[0].price * 3 + 100)
+
+        item.delete()
+        order.refresh_from_db()
+        self.assertEqual((order.subtotal, order.total_amount), (Decimal(100), Decimal(100)))
+
+        # Смена статуса и отметка о прочтении суммы не трогают
+        with CaptureQueriesContext(connection) as context:
+            order.is_read = True
+            order.save(update_fields=['is_read'])
+        self.assertFalse(any('order_items' in query['sql'] for query in context.captured_queries))
+
+    def test_lists_read_stored_totals(self):
+        order = self.create_order(promo_code='SALE20')
+        response = self.client.get('/api/v1/orders/orders/')
+        self.assertEqual(response.status_code, 200)
+        data = next(row for row in response.data['results'] if row['id'] == order.id)
+        self.assertEqual(data['total_amount'], float(order.total_amount))
+        self.assertEqual(data['discount_amount'], float(order.discount_amount))
+
+        self.create_order()
+        admin = self.create_user('+996700000104')
+        User.objects.filter(id=admin.id).update(is_staff=True, is_superuser=True)
+        # Вход сохраняет last_login, а post_save пользователя синхронизирует его с Firestore
+        with mock.patch('apps.chat.signals.firestore'):
+            self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/admin/orders/order/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('orders_orderitem' in query['sql'] for query in context.captured_queries))
+
+    def test_verify_command_reports_and_fixes_drift(self):
+        order = self.create_order()
+        call_command('verify_order_totals', stdout=StringIO())
+        Order.objects.filter(id=order.id).update(total_amount=1, subtotal=1)
+        with self.assertRaises(CommandError):
+            call_command('verify_order_totals', stdout=StringIO())
+        output = StringIO()
+        call_command('verify_order_totals', '--fix', stdout=output)
+        self.assertIn(f"#{order.id}", output.getvalue())
+        order.refresh_from_db()
+        self.assertEqual(order.total_amount, self.variants[0].price * 2 + 100)
+
+
+class OutboxTests(OrderFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('+996700000105')
+        User.objects.filter(id=cls.user.id).update(email='buyer@example.com', fcm_token='token')
+        cls.user.refresh_from_db()
+        cls.address = UserAddress.objects.create(user=cls.user, city='Бишкек', apartment_number='1')
+        cls.variants = cls.create_variants(2)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def topics(self):
+        return sorted(OutboxMessage.objects.values_list('topic', flat=True))
+
+    def test_order_side_effects_are_left_to_the_worker(self):
+        with mock.patch('apps.services.order_notifications.send_firebase_notification') as push, \
+                mock.patch('apps.services.order_notifications.has_shared_channel_layer', return_value=True):
+            response = self.place_order([(self.variants[0], 1, False)])
+            self.assertEqual(response.status_code, 201, response.data)
+            self.assertEqual(mail.outbox, [])
+            self.assertEqual(self.topics(), ['email', 'websocket'])
+
+            order = Order.objects.get(id=response.data['order']['id'])
+            order.is_read = True
+            order.save(update_fields=['is_read'])
+            self.assertEqual(self.topics(), ['email', 'websocket'])
+            order.order_status = 'delivery'
+            order.save()
+            self.assertEqual(self.topics(), ['email', 'push', 'websocket'])
+            push.assert_not_called()
+
+            self.assertEqual(process_outbox(concurrency=1), (3, 3))
+        push.assert_called_once()
+        self.assertIn('delivery', push.call_args.args[2])
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['buyer@example.com'])
+        self.assertFalse(OutboxMessage.objects.exclude(status='done').exists())
+
+    def test_websocket_stays_in_process_without_shared_channel_layer(self):
+        with mock.patch('apps.services.order_notifications.async_to_sync') as async_to_sync, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.place_order([(self.variants[0], 1, False)])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(self.topics(), ['email'])
+        self.assertIn(str(response.data['order']['id']), async_to_sync.return_value.call_args.args[1]['message'])
+
+        # Сообщение, оставшееся в outbox, воркер со слоем в памяти не отмечает выполненным (письмо уходит)
+        message = enqueue('websocket', {'order_id': response.data['order']['id']})
+        self.assertEqual(process_outbox(), (2, 1))
+        message.refresh_from_db()
+        self.assertEqual(message.status, 'pending')
+        self.assertIn('REDIS_URL', message.last_error)
+
+    def test_failed_order_writes_nothing(self):
+        response = self.place_order([(self.variants[0], 6, False)])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_failures_are_retried_with_backoff_until_the_limit(self):
+        handler = mock.Mock(side_effect=[ConnectionError('timeout'), None])
+        with mock.patch.dict(HANDLERS, {'test': handler}):
+            message = enqueue('test', {'value': 1})
+            self.assertEqual(process_outbox(), (1, 0))
+            message.refresh_from_db()
+            self.assertEqual((message.status, message.attempts), ('pending', 1))
+            self.assertIn('timeout', message.last_error)
+            self.assertGreater(message.available_at, timezone.now())
+            # До конца задержки сообщение не берётся
+            self.assertEqual(process_outbox(), (0, 0))
+
+            OutboxMessage.objects.update(available_at=timezone.now())
+            self.assertEqual(process_outbox(), (1, 1))
+            message.refresh_from_db()
+            self.assertEqual((message.status, message.attempts), ('done', 2))
+            handler.assert_called_with({'value': 1})
+
+            handler.side_effect = ConnectionError('down')
+            message = enqueue('test', {})
+            self.assertEqual(process_outbox(max_attempts=1), (1, 0))
+            message.refresh_from_db()
+            self.assertEqual(message.status, 'failed')
+
+    def test_claimed_messages_are_leased(self):
+        for index in range(3):
+            enqueue('test', {'index': index})
+        self.assertEqual(len(claim_messages(2)), 2)
+        self.assertEqual(len(claim_messages(5)), 1)
+        self.assertEqual(claim_messages(5), [])
+
+
+class OrderChangeTrackingTests(OrderFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('+996700000106')
+        cls.address = UserAddress.objects.create(user=cls.user, city='Бишкек', apartment_number='1')
+        cls.variants = cls.create_variants(1)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+        response = self.place_order([(self.variants[0], 1, False)])
+        self.assertEqual(response.status_code, 201, response.data)
+        self.order = Order.objects.get(id=response.data['order']['id'])
+        OutboxMessage.objects.all().delete()
+
+    def pushes(self):
+        return list(OutboxMessage.objects.filter(topic='push').values_list('payload__order_status', flat=True))
+
+    def test_bookkeeping_save_is_a_single_update_without_signals(self):
+        fired = []
+
+        def remember(sender, **kwargs):
+            fired.append(sender)
+
+        for signal in (pre_save, post_save):
+            signal.connect(remember, sender=Order)
+            self.addCleanup(signal.disconnect, remember, sender=Order)
+        order = Order.objects.get(id=self.order.id)
+        order.is_read = True
+        with CaptureQueriesContext(connection) as context:
+            order.save()
+        self.assertEqual(len(context.captured_queries), 1)
+        sql = context.captured_queries[0]['sql']
+        self.assertTrue(sql.startswith('UPDATE'))
+        self.assertNotIn('order_status', sql)
+        self.assertEqual(fired, [])
+        self.assertTrue(Order.objects.get(id=order.id).is_read)
+
+    def test_admin_change_view_only_marks_the_order_read(self):
+        admin = self.create_user('+996700000107')
+        User.objects.filter(id=admin.id).update(is_staff=True, is_superuser=True)
+        with mock.patch('apps.chat.signals.firestore'):
+            self.client.force_login(admin)
+        response = self.client.get(f'/admin/orders/order/{self.order.id}/change/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Order.objects.get(id=self.order.id).is_read)
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_handlers_run_only_on_real_transitions(self):
+        order = Order.objects.get(id=self.order.id)
+        with mock.patch.object(Order, 'apply_bonuses') as apply_bonuses:
+            order.comment = 'Позвонить заранее'
+            order.save()
+            self.assertEqual(self.pushes(), [])
+
+            order.order_status = 'completed'
+            order.save()
+            order.save()
+            self.assertEqual(self.pushes(), ['completed'])
+            apply_bonuses.assert_called_once_with()
+
+    def test_update_fields_are_honoured(self):
+        order = Order.objects.get(id=self.order.id)
+        order.order_status = 'delivery'
+        order.comment = 'Домофон не работает'
+        order.save(update_fields=['comment'])
+        self.assertEqual(self.pushes(), [])
+        self.assertEqual(Order.objects.get(id=order.id).order_status, 'pending')
+
+        order.save(update_fields=['order_status'])
+        self.assertEqual(self.pushes(), ['delivery'])
+        # Статус уже сохранён — повторное сохранение не переход
+        order.save(update_fields=['order_status'])
+        self.assertEqual(self.pushes(), ['delivery'])
+
+
+class OrderHistoryQueryCountTests(OrderFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('+996700000108')
+        cls.address = UserAddress.objects.create(user=cls.user, city='Бишкек', apartment_number='1')
+        cls.variants = cls.create_variants(6, quantity=100)
+        PercentCashback.objects.create(mobile_percent=5, web_percent=3, min_order_price=0)
+        for variant in cls.variants:
+            for _ in range(2):
+                ProductImage.objects.create(product=variant.product, color=variant.color,
+                                            image='product_images/product.webp')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.user)
+
+    def place_orders(self, count, lines):
+        for _ in range(count):
+            response = self.place_order([(variant, 1, False) for variant in self.variants[:lines]])
+            self.assertEqual(response.status_code, 201, response.data)
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response
+
+    def test_order_history_costs_a_fixed_number_of_queries(self):
+        self.place_orders(1, 1)
+        few, response = self.count_queries('/api/v1/orders/orders/')
+        self.assertEqual(len(response.data['results']), 1)
+
+        self.place_orders(5, 6)
+        many, response = self.count_queries('/api/v1/orders/orders/')
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(few, many)
+        latest = response.data['results'][0]
+        self.assertEqual(len(latest['order_items']), 6)
+        self.assertEqual(len(latest['order_items'][0]['images']), 2)
+        self.assertEqual(latest['user_address'], 'Бишкек, 1')
+
+    def test_order_details_cost_does_not_depend_on_items(self):
+        self.place_orders(1, 1)
+        self.place_orders(1, 6)
+        small, large = Order.objects.order_by('id')
+        few, _ = self.count_queries('/api/v1/orders/details/', {'order_id': small.id})
+        many, response = self.count_queries('/api/v1/orders/details/', {'order_id': large.id})
+        self.assertEqual(few, many)
+        self.assertEqual(len(response.json()['order_items']), 6)
+
+
+class StockReservationTests(OrderFixturesMixin, TransactionTestCase):
+    # Параллельные покупатели работают в своих потоках и соединениях — нужны настоящие коммиты
+    buyers = 24
+
+    def setUp(self):
+        cache.clear()
+        # Фоновые задачи после коммита (документы, варианты фото) здесь не нужны и не должны пережить очистку базы
+        for target in ('apps.services.product_documents._enqueue', 'apps.services.category_facets._enqueue',
+                       'apps.product.signals.schedule_image_processing'):
+            patcher = mock.patch(target)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = self.create_user('+996700000102')
+        self.address = UserAddress.objects.create(user=self.user, city='Бишкек', apartment_number='1')
+        self.scarce, self.plenty = self.create_variants(2, quantity=10)
+        ProductSize.objects.filter(id=self.plenty.id).update(quantity=1000)
+
+    def test_failed_line_rolls_back_the_whole_reservation(self):
+        with self.assertRaises(InsufficientStock) as context:
+            reserve_stock({self.plenty.id: 5, self.scarce.id: 11})
+        self.assertEqual(context.exception.shortages, {self.scarce.id: 10})
+        self.assertEqual(ProductSize.objects.get(id=self.plenty.id).quantity, 1000)
+        self.assertEqual(reserve_stock({self.plenty.id: 5, self.scarce.id: 10}), {self.plenty.id: 995, self.scarce.id: 0})
+
+    def test_parallel_buyers_never_oversell(self):
+        # Варианты в разном порядке у разных покупателей — проверка и на взаимоблокировки
+        def buy(index):
+            lines = [(self.plenty.id, 1), (self.scarce.id, 1 + index % 2)]
+            return reserve_stock(dict(lines if index % 3 else lines[::-1]))
+
+        results = run_in_parallel(buy, self.buyers)
+        succeeded = [index for index, result in enumerate(results) if isinstance(result, dict)]
+        failed = [result for result in results if isinstance(result, InsufficientStock)]
+        self.assertEqual(len(succeeded) + len(failed), self.buyers, results)
+        sold = sum(1 + index % 2 for index in succeeded)
+        self.assertLessEqual(sold, 10)
+        self.assertEqual(ProductSize.objects.get(id=self.scarce.id).quantity, 10 - sold)
+        self.assertEqual(ProductSize.objects.get(id=self.plenty.id).quantity, 1000 - len(succeeded))
+
+    def test_parallel_orders_create_only_what_is_in_stock(self):
+        def order(index):
+            return assemble_order(
+                self.user,
+                [{'product_size_id': self.scarce.id, 'quantity': 1}, {'product_size_id': self.plenty.id, 'quantity': 2}],
+                user_address=self.address,
+            ).id
+
+        results = run_in_parallel(order, self.buyers)
+        self.assertEqual(sum(isinstance(result, int) for result in results), 10, results)
+        self.assertEqual(Order.objects.count(), 10)
+        self.assertEqual(OrderItem.objects.count(), 20)
+        self.assertEqual(ProductSize.objects.get(id=self.scarce.id).quantity, 0)
+        self.assertEqual(ProductSize.objects.get(id=self.plenty.id).quantity, 980)
+        listing = ProductListing.objects.get(product=self.scarce.product)
+        self.assertFalse(listing.in_stock)
+
+
+class OutboxClaimTests(TransactionTestCase):
+    def test_parallel_workers_claim_disjoint_messages(self):
+        OutboxMessage.objects.bulk_create(OutboxMessage(topic='test', payload={}) for _ in range(40))
+        results = run_in_parallel(lambda index: [message.id for message in claim_messages(5)], 8)
+        claimed = [message_id for result in results for message_id in result]
+        self.assertEqual(len(claimed), 40, results)
+        self.assertEqual(len(set(claimed)), 40)
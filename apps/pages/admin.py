@@ -27,12 +27,12 @@ from apps.pages.models import (
     News,
     Redirection
 )
-from apps.product.forms import MethodsOfPaymentAdminForm
+from apps.product.forms import CategoryTreeChoicesMixin, MethodsOfPaymentAdminForm
 from apps.services.firebase_notification import send_firebase_notification
 
 
 @admin.register(Banner)
-class BannerAdmin(ModelAdmin):
+class BannerAdmin(CategoryTreeChoicesMixin, ModelAdmin):
     list_display = ["title", "type", 'object_link', "is_active", "created_at"]
     list_filter = ["title", "is_active", "created_at"]
     ordering = ('title',)
@@ -139,7 +139,7 @@ class MainPageAdmin(ModelAdmin):
     exclude = ('phone',)
 
 
-class StoryInline(TabularInline):
+class StoryInline(CategoryTreeChoicesMixin, TabularInline):
     extra = 0
     model = Story
     formset = StoryInlineFormSet
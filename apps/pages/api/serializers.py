@@ -96,7 +96,8 @@ class MainPageSerializer(serializers.ModelSerializer):
 
 
 class HomePageSerializer(serializers.Serializer):
-    categories = CategorySerializer(many=True)
+    # Уже готовые узлы дерева категорий (apps.services.category_tree) с полями CategorySerializer
+    categories = serializers.ListField(child=serializers.DictField(), read_only=True)
     banners = BannerSerializer(many=True)
     main_page = MainPageSerializer()
     cash_back = serializers.SerializerMethodField()
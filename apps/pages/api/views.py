@@ -1,4 +1,5 @@
 from django import forms
+from django.db.models import Count, Max
 from django.forms import Form
 from rest_framework import generics, status
 from rest_framework.generics import ListAPIView, CreateAPIView
@@ -6,7 +7,10 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from apps.orders.models import Warehouse
-from apps.product.models import Category
+from apps.pages.signals import CONTENT_MODELS
+from apps.services.category_tree import iter_category_nodes, render_category_nodes
+from apps.services.content_versions import ContentVersionMixin
+from apps.services.response_cache import ResponseCacheMixin
 from apps.pages.models import (
     Banner,
     MainPage,
@@ -14,6 +18,7 @@ from apps.pages.models import (
     StaticPage, Stories, StoriesUserCheck, BonusPage, News, MethodsOfPayment
 )
 from apps.pages.api.serializers import (
+    CategorySerializer,
     HomePageSerializer,
     ContactsSerializer,
     StaticPageSerializer,
@@ -27,11 +32,26 @@ from apps.pages.api.serializers import (
 )
 
 
-class HomePageView(generics.GenericAPIView):
+class ContentCacheMixin(ResponseCacheMixin, ContentVersionMixin):
+    """Условный GET и кэш ответа; теги ответа — модели разделов content_domains."""
+
+    @property
+    def user_dependent(self):
+        return self.per_user_content
+
+    @property
+    def cache_models(self):
+        return {model for domain in self.content_domains for model in CONTENT_MODELS[domain]}
+
+
+class HomePageView(ContentCacheMixin, generics.GenericAPIView):
+    content_domains = ('categories', 'banners', 'products', 'settings')
     serializer_class = HomePageSerializer
 
     def get(self, request, *args, **kwargs):
-        categories = Category.objects.all()
+        # Все категории плоским списком по полю order, как прежде, — из кэшированного дерева
+        nodes = sorted(iter_category_nodes(), key=lambda node: node['order'])
+        categories = render_category_nodes(nodes, request, fields=CategorySerializer.Meta.fields, recursive=False)
         banners = Banner.objects.filter(is_active=True)
         main_page = MainPage.objects.first()
 
@@ -39,7 +59,8 @@ class HomePageView(generics.GenericAPIView):
         return Response(serializer.data)
 
 
-class MetaDataView(generics.GenericAPIView):
+class MetaDataView(ContentCacheMixin, generics.GenericAPIView):
+    content_domains = ('settings',)
     serializer_class = MetaDataSerializer
 
     def get(self, request, *args, **kwargs):
@@ -49,7 +70,8 @@ class MetaDataView(generics.GenericAPIView):
         return Response(serializer.data)
 
 
-class ContactsView(generics.GenericAPIView):
+class ContactsView(ContentCacheMixin, generics.GenericAPIView):
+    content_domains = ('settings', 'pages')
     serializer_class = ContactsSerializer
 
     def get(self, request, *args, **kwargs):
@@ -58,7 +80,8 @@ class ContactsView(generics.GenericAPIView):
         return Response(serializer.data)
 
 
-class StaticPageDetailView(generics.RetrieveAPIView):
+class StaticPageDetailView(ContentCacheMixin, generics.RetrieveAPIView):
+    content_domains = ('pages',)
     queryset = StaticPage.objects.all()
     serializer_class = StaticPageSerializer
     lookup_field = 'slug'
@@ -104,7 +127,8 @@ class StaticPageDetailView(generics.RetrieveAPIView):
         return Response(serializer.data)
 
 
-class MethodsOfPaymentView(generics.ListAPIView):
+class MethodsOfPaymentView(ContentCacheMixin, generics.ListAPIView):
+    content_domains = ('settings',)
     queryset = MethodsOfPayment.objects.all()
     serializer_class = MethodOfPaymentSerializer
 
@@ -116,12 +140,14 @@ class MethodsOfPaymentView(generics.ListAPIView):
         return queryset
 
 
-class LayOutView(generics.ListAPIView):
+class LayOutView(ContentCacheMixin, generics.ListAPIView):
+    content_domains = ('settings',)
     queryset = MainPage.objects.all()
     serializer_class = LayOutSerializer
 
 
-class BannersView(ListAPIView):
+class BannersView(ContentCacheMixin, ListAPIView):
+    content_domains = ('banners', 'products', 'categories')
     queryset = Banner.objects.filter(is_active=True).order_by('-created_at')
 
     def get_serializer(self, *args, **kwargs):
@@ -135,9 +161,17 @@ class BannersView(ListAPIView):
         return queryset
 
 
-class StoriesView(ListAPIView):
+class StoriesView(ContentCacheMixin, ListAPIView):
+    # is_viewed зависит от пользователя, поэтому ETag у каждого свой
+    content_domains = ('stories', 'products', 'categories')
+    per_user_content = True
     queryset = Stories.objects.filter(is_active=True)
 
+    def user_content_version(self, request):
+        # Просмотры меняют ETag только своему пользователю, а не версию раздела для всех
+        seen = StoriesUserCheck.objects.filter(user=request.user).aggregate(count=Count('id'), last=Max('id'))
+        return f"s{seen['count']}.{seen['last'] or 0}"
+
     def get_queryset(self):
         # Получаем базовый queryset
         queryset = super().get_queryset()
@@ -162,7 +196,8 @@ class StoriesViewedView(CreateAPIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class BonusPageView(APIView):
+class BonusPageView(ContentCacheMixin, APIView):
+    content_domains = ('settings',)
     def get(self, request, *args, **kwargs):
 
         page = BonusPage.objects.first()
@@ -170,11 +205,13 @@ class BonusPageView(APIView):
         return Response(serializer.data)
 
 
-class NewsListView(generics.ListCreateAPIView):
+class NewsListView(ContentCacheMixin, generics.ListCreateAPIView):
+    content_domains = ('pages',)
     queryset = News.objects.all()
     serializer_class = NewsSerializer
 
 
-class NewsDetailView(generics.RetrieveUpdateDestroyAPIView):
+class NewsDetailView(ContentCacheMixin, generics.RetrieveUpdateDestroyAPIView):
+    content_domains = ('pages',)
     queryset = News.objects.all()
     serializer_class = NewsSerializer
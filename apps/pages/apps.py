@@ -5,6 +5,9 @@ class PagesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.pages'
 
+    def ready(self):
+        import apps.pages.signals
+
     class Meta:
         verbose_name = "Страница"
         verbose_name_plural = "Страницы"
\ No newline at end of file
@@ -408,3 +408,16 @@ class News(models.Model):
 
     def __str__(self):
         return self.title
+
+
+class ContentVersion(models.Model):
+    domain = models.CharField(max_length=50, primary_key=True, verbose_name="Раздел")
+    version = models.PositiveBigIntegerField(default=0, verbose_name="Версия")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата изменения")
+
+    class Meta:
+        verbose_name = "Версия контента"
+        verbose_name_plural = "Версии контента"
+
+    def __str__(self):
+        return f"{self.domain}: {self.version}"
@@ -0,0 +1,90 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from apps.orders.models import PercentCashback, Warehouse
+from apps.pages.models import (
+    Address,
+    Advertisement,
+    Banner,
+    BonusPage,
+    Contacts,
+    DeliveryConditions,
+    Email,
+    MainPage,
+    MethodsOfPayment,
+    News,
+    OrderTypes,
+    PaymentMethod,
+    Phone,
+    Redirection,
+    SiteSettings,
+    SocialLink,
+    StaticPage,
+    Stories,
+    Story,
+)
+from apps.product.models import (
+    Category,
+    Characteristic,
+    Color,
+    Country,
+    Gender,
+    Product,
+    ProductImage,
+    ProductSize,
+    Review,
+    ReviewImage,
+    Size,
+    SizeChart,
+    Tag,
+)
+from apps.services.content_versions import bump_content_version
+from apps.services.response_cache import invalidate_model
+
+# Раздел контента -> модели, изменение которых меняет ответы этого раздела
+CONTENT_MODELS = {
+    'products': (Product, ProductSize, ProductImage, Characteristic, Tag, Color, Size, Country, Gender, SizeChart),
+    'categories': (Category,),
+    'banners': (Banner,),
+    'stories': (Stories, Story),
+    'pages': (StaticPage, News, Advertisement),
+    'settings': (
+        MainPage, Contacts, Phone, Email, SocialLink, Address, PaymentMethod, SiteSettings, BonusPage,
+        OrderTypes, DeliveryConditions, MethodsOfPayment, Redirection, Warehouse, PercentCashback,
+    ),
+}
+
+
+def _bump_receiver(domain):
+    def receiver(sender, **kwargs):
+        bump_content_version(domain)
+    return receiver
+
+
+for _domain, _models in CONTENT_MODELS.items():
+    _receiver = _bump_receiver(_domain)
+    for _model in _models:
+        post_save.connect(_receiver, sender=_model, weak=False, dispatch_uid=f'content_version_{_domain}_{_model.__name__}')
+        post_delete.connect(_receiver, sender=_model, weak=False,
+                            dispatch_uid=f'content_version_delete_{_domain}_{_model.__name__}')
+
+# Модели, от которых зависят закэшированные ответы публичных вьюх (ResponseCacheMixin.cache_models)
+RESPONSE_CACHE_MODELS = {model for models in CONTENT_MODELS.values() for model in models} | {Review, ReviewImage}
+
+
+def _invalidate_response_cache(sender, **kwargs):
+    invalidate_model(sender)
+
+
+def _invalidate_response_cache_m2m(sender, instance, **kwargs):
+    # Связи many-to-many (теги, похожие продукты) меняются без сохранения самого объекта
+    if kwargs['action'] in ('post_add', 'post_remove', 'post_clear'):
+        invalidate_model(type(instance))
+
+
+for _model in RESPONSE_CACHE_MODELS:
+    post_save.connect(_invalidate_response_cache, sender=_model, dispatch_uid=f'response_cache_{_model._meta.label}')
+    post_delete.connect(_invalidate_response_cache, sender=_model,
+                        dispatch_uid=f'response_cache_delete_{_model._meta.label}')
+    for _field in _model._meta.local_many_to_many:
+        m2m_changed.connect(_invalidate_response_cache_m2m, sender=_field.remote_field.through,
+                            dispatch_uid=f'response_cache_m2m_{_model._meta.label}_{_field.name}')
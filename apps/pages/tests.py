@@ -1,3 +1,94 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from apps.authentication.models import User
+from apps.pages.models import ContentVersion, StaticPage, Stories, StoriesUserCheck, Story
+from apps.product.models import Category
+
+
+class ContentVersionTests(APITestCase):
+    url = '/api/v1/products/categories/only/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Обувь', name_en='Shoes')
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url=None, language='ru', **headers):
+        return self.client.get(url or self.url, HTTP_ACCEPT_LANGUAGE=language, **headers)
+
+    def test_matching_etag_returns_304_without_queries(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        self.assertIn('Accept-Language', response['Vary'])
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(context.captured_queries), 0)
+
+        response = self.get(HTTP_IF_MODIFIED_SINCE=self.get()['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_depends_on_language(self):
+        ru, en = self.get(language='ru'), self.get(language='en')
+        self.assertNotEqual(ru['ETag'], en['ETag'])
+        self.assertEqual(en.data[0]['name'], 'Shoes')
+        self.assertEqual(self.get(language='en', HTTP_IF_NONE_MATCH=ru['ETag']).status_code, 200)
+
+    def test_save_bumps_version_after_commit(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Кроссовки'
+            self.category.save()
+        self.assertEqual(ContentVersion.objects.get(domain='categories').version, 1)
+
+        response = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_unrelated_domain_keeps_etag(self):
+        etag = self.get()['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            StaticPage.objects.create(title='О нас', description='О нас', slug='about-us')
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class StoriesETagTests(APITestCase):
+    url = '/api/v1/pages/stories/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.stories = Stories.objects.create(title='Новинки', image='images/stories/new.jpg')
+        Story.objects.create(stories=cls.stories, image='images/stories/1.jpg', type='link')
+        with mock.patch('apps.chat.signals.firestore'):
+            cls.viewer = User.objects.create_user(phone_number='+996700000201', password='secret')
+            cls.other = User.objects.create_user(phone_number='+996700000202', password='secret')
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, user, **headers):
+        self.client.force_authenticate(user)
+        return self.client.get(self.url, **headers)
+
+    def test_seen_story_changes_only_own_etag(self):
+        viewer_etag, other_etag = self.get(self.viewer)['ETag'], self.get(self.other)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            StoriesUserCheck.objects.create(stories=self.stories, user=self.viewer)
+        self.assertFalse(ContentVersion.objects.filter(domain='stories', version__gt=0).exists())
+
+        self.assertEqual(self.get(self.other, HTTP_IF_NONE_MATCH=other_etag).status_code, 304)
+        response = self.get(self.viewer, HTTP_IF_NONE_MATCH=viewer_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'][0]['viewed'])
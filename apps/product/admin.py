@@ -26,7 +26,7 @@ from .models import (
     SizeChart
 )
 from .forms import ProductSizeForm, ProductAdminForm, CharacteristicInlineForm, CategoryAdminForm, ColorAdminForm, \
-    TagAdminForm, ProductImageInlineForm
+    TagAdminForm, ProductImageInlineForm, CategoryTreeChoicesMixin
 
 
 class ExcludeBaseFieldsMixin(ModelAdmin):
@@ -115,7 +115,7 @@ class ReviewInline(TabularInline):
 
 
 @admin.register(Category)
-class CategoryAdmin(ModelAdmin, DraggableMPTTAdmin, TabbedTranslationAdmin):
+class CategoryAdmin(CategoryTreeChoicesMixin, ModelAdmin, DraggableMPTTAdmin, TabbedTranslationAdmin):
     form = CategoryAdminForm
     search_fields = ('name',)
     ordering = ('name',)
@@ -1,16 +1,38 @@
 from decimal import Decimal
 
 import django_filters
+from modeltranslation.utils import get_language
+from rest_framework.filters import OrderingFilter
 
 from apps.product.models import Product
-
-from django.db.models import Q, Avg
+from apps.services.facet_engine import (
+    FACETS,
+    FILTER_FACETS,
+    bitset_filter,
+    leaf_category_ids,
+    load_labels,
+    match_filter_values,
+    match_products,
+    parse_selection,
+)
+from apps.services.product_search import search_products
+
+# Фильтры, которые считаются по битовым множествам индекса фасетов, а не join'ами в SQL
+FACET_FILTERS = ('country', 'category', 'gender', 'size', 'color', 'price_min', 'price_max', 'rating_min')
 
 
 class ProductFilter(django_filters.FilterSet):
+    """
+    Фильтры по атрибутам (FACET_FILTERS) вместе дают одно множество id из индекса фасетов
+    (apps.services.facet_engine), которое накладывается на queryset одним условием. Методы filter_by_*
+    ниже — SQL-вариант тех же фильтров, он используется при use_facet_engine = False.
+    Индекс содержит только активные продукты.
+    """
+    use_facet_engine = True
+
     id = django_filters.CharFilter(field_name='id')
     name = django_filters.CharFilter(method='filter_by_name_or_article')
-    country = django_filters.CharFilter(field_name='country__name', lookup_expr='icontains')
+    country = django_filters.CharFilter(method='filter_by_country')
     category = django_filters.CharFilter(method='filter_final_category')
 
     # Фильтрация по полу
@@ -34,36 +56,70 @@ class ProductFilter(django_filters.FilterSet):
         model = Product
         fields = ['id', 'name', 'country', 'category', 'gender', 'size', 'color', 'price_min', 'price_max', 'rating_min']
 
+    def filter_queryset(self, queryset):
+        if not self.use_facet_engine:
+            return super().filter_queryset(queryset)
+        facet_params = {
+            name: value for name, value in self.form.cleaned_data.items()
+            if name in FACET_FILTERS and value not in (None, '')
+        }
+        if facet_params:
+            queryset = bitset_filter(queryset, match_products(parse_selection(facet_params)))
+        for name, value in self.form.cleaned_data.items():
+            if name not in facet_params:
+                queryset = self.filters[name].filter(queryset, value)
+        return queryset
+
     def filter_by_name_or_article(self, queryset, name, value):
-        return queryset.filter(Q(name__icontains=value) | Q(article__icontains=value))
+        return search_products(queryset, value)
+
+    def _matched_ids(self, param, value):
+        # Названия сопоставляются теми же правилами, что и в индексе фасетов (apps.services.facet_engine)
+        model, _ = FACETS[FILTER_FACETS[param]]
+        return list(match_filter_values(param, value, load_labels(model, get_language())))
+
+    def filter_by_country(self, queryset, name, value):
+        return queryset.filter(country_id__in=self._matched_ids('country', value))
 
     def filter_final_category(self, queryset, name, value):
-        return queryset.filter(category__name=value, category__subcategories__isnull=True)
+        return queryset.filter(category_id__in=leaf_category_ids(value))
 
+    # Размеры и цвета вариантов лежат массивами id в ProductListing: пересечение массивов по GIN-индексу
+    # вместо join'а с вариантами и DISTINCT
     def filter_by_size(self, queryset, name, value):
-        size_values = [s.strip() for s in value.split(',')]
-        return queryset.filter(product_sizes__size__name__in=size_values).distinct()
+        return queryset.filter(listing__size_ids__overlap=self._matched_ids('size', value))
 
     def filter_by_color(self, queryset, name, value):
-        color_values = [c.strip() for c in value.split(',')]
-        return queryset.filter(product_sizes__color__name__in=color_values).distinct()
+        return queryset.filter(listing__color_ids__overlap=self._matched_ids('color', value))
 
     def filter_by_gender(self, queryset, name, value):
-        gender_values = [g.strip() for g in value.split(',')]
-        return queryset.filter(gender__name__in=gender_values).distinct()
+        return queryset.filter(gender_id__in=self._matched_ids('gender', value))
 
     # Фильтрация по минимальному рейтингу, принимая массив значений через запятую
     def filter_by_minimum_rating(self, queryset, name, value):
         rating_values = [float(r.strip()) for r in value.split(',')]  # Преобразуем строковые значения в float
         min_rating = min(rating_values)  # Находим минимальное значение рейтинга из массива
-        return queryset.annotate(average_rating=Avg('product_reviews__rating')).filter(average_rating__gte=min_rating)
+        return queryset.filter(rating_stats__average_rating__gte=min_rating)
 
     def filter_by_min_price(self, queryset, name, value):
-        return queryset.filter(
-            Q(discounted_price__gte=value) | (Q(discounted_price__isnull=True) & Q(price__gte=value))
-        )
+        return queryset.filter(listing__effective_price__gte=value)
 
     def filter_by_max_price(self, queryset, name, value):
-        return queryset.filter(
-            Q(discounted_price__lte=value) | (Q(discounted_price__isnull=True) & Q(price__lte=value))
-        )
+        return queryset.filter(listing__effective_price__lte=value)
+
+
+class ProductOrderingFilter(OrderingFilter):
+    """
+    ?ordering=discounted_price сортирует по итоговой цене из ProductListing: у товаров без скидки
+    discounted_price пуст, и они оказывались в конце списка.
+    """
+    aliases = {'discounted_price': 'effective_price'}
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not ordering:
+            return ordering
+        return [
+            ('-' if term.startswith('-') else '') + self.aliases.get(term.lstrip('-'), term.lstrip('-'))
+            for term in ordering
+        ]
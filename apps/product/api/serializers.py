@@ -1,9 +1,14 @@
 from rest_framework import serializers, status
 from rest_framework.response import Response
 
-from django.db.models import Min, Max, Avg
+from django.db.models import Avg
+from django.urls import reverse
 
 from apps.orders.models import OrderItem
+from apps.services.category_facets import load_category_facets
+from apps.services.image_pipeline import image_srcset, preferred_image_url
+from apps.services.product_listing import DETAIL_REVIEWS_LIMIT, apply_listing_plan, reviews_queryset
+from apps.services.product_sampling import hydrate, similar_ids
 from apps.product.models import (
     Product,
     ProductSize,
@@ -18,7 +23,7 @@ from apps.product.models import (
     Size,
     Country,
     Gender,
-    ReviewImage, SizeChart
+    ReviewImage, SizeChart, ProductRatingStats
 )
 
 
@@ -52,16 +57,17 @@ class TagSerializer(serializers.ModelSerializer):
 
 class ProductImageSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductImage
-        fields = ['image', 'color']
+        fields = ['image', 'srcset', 'color']
 
     def get_image(self, obj):
-        request = self.context.get('request')
-        if request is not None:
-            return request.build_absolute_uri(obj.image.url)
-        return obj.image.url
+        return preferred_image_url(obj.image, obj.image_variants, self.context.get('request'))
+
+    def get_srcset(self, obj):
+        return image_srcset(obj.image, obj.image_variants, self.context.get('request'))
 
 
 class SizeSerializer(serializers.ModelSerializer):
@@ -76,7 +82,7 @@ class ProductSizeSerializer(serializers.ModelSerializer):
     color_name = serializers.CharField(source='color.name')
     color_hex_code = serializers.CharField(source='color.hex_code')
     size = serializers.CharField(source='size.name')  # Один размер
-    images = ProductImageSerializer(many=True, read_only=True, source='color_images')  # Извлечение изображений
+    images = serializers.SerializerMethodField()
 
     class Meta:
         model = ProductSize
@@ -84,8 +90,9 @@ class ProductSizeSerializer(serializers.ModelSerializer):
                   'quantity', 'price', 'discounted_price', 'bonus_price']  # Добавляем поле images
 
     def get_images(self, obj):
-        # Теперь изображения получаются напрямую от ProductSize
-        return ProductImageSerializer(obj.color_images.all(), many=True, context=self.context).data
+        # Изображения продукта того же цвета; в карточке они уже загружены prefetch'ем у продукта
+        images = [image for image in obj.product.product_images.all() if image.color_id == obj.color_id]
+        return ProductImageSerializer(images, many=True, context=self.context).data
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -134,7 +141,62 @@ class GenderSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductPhotoMixin:
+    """Фото продукта: вариант 800px (как раньше отдавалось фото) и srcset всех ширин для клиентов."""
+
+    def get_photo(self, obj):
+        request = self.context.get('request')
+        if obj.photo and request:
+            return preferred_image_url(obj.photo, obj.photo_variants, request)
+        return None
+
+    def get_photo_srcset(self, obj):
+        return image_srcset(obj.photo, obj.photo_variants, self.context.get('request'))
+
+
+class ProductListingMixin:
+    """
+    Читает аннотации из apps.services.product_listing.apply_listing_plan.
+    Если queryset собран без плана, рейтинг берётся из ProductRatingStats, а при её отсутствии
+    считается отдельными запросами, как раньше.
+    """
+
+    def get_is_favorite(self, obj):
+        if hasattr(obj, 'is_favorite'):
+            return obj.is_favorite
+        request = self.context.get('request', None)
+        if request is None or not hasattr(request, 'user'):
+            return False
+        user = request.user
+        if user.is_authenticated:
+            return FavoriteProduct.objects.filter(user=user, product=obj).exists()
+        return False
+
+    def get_rating_stats(self, obj):
+        try:
+            return obj.rating_stats
+        except ProductRatingStats.DoesNotExist:
+            return None
+
+    def get_review_count(self, obj):
+        if getattr(obj, 'review_count', None) is not None:
+            return obj.review_count
+        stats = self.get_rating_stats(obj)
+        if stats is not None:
+            return stats.commented_review_count
+        # Подсчитываем количество комментариев, игнорируя пустые строки
+        return obj.product_reviews.exclude(comment='').count()
+
+    def get_average_rating(self, obj):
+        if getattr(obj, 'average_rating', None) is not None:
+            return round(obj.average_rating)
+        stats = self.get_rating_stats(obj)
+        if stats is not None:
+            return round(stats.average_rating)
+        return round(obj.product_reviews.aggregate(Avg('rating'))['rating__avg'] or 0)
+
+
+class ProductSerializer(ProductListingMixin, ProductPhotoMixin, serializers.ModelSerializer):
     tags = TagSerializer(many=True)
     category_slug = serializers.SerializerMethodField()
     category_name = serializers.SerializerMethodField()
@@ -142,6 +204,7 @@ class ProductSerializer(serializers.ModelSerializer):
     review_count = serializers.SerializerMethodField()
     average_rating = serializers.SerializerMethodField()
     photo = serializers.SerializerMethodField()
+    photo_srcset = serializers.SerializerMethodField()
     is_ordered = serializers.BooleanField(read_only=True)
     is_active = serializers.BooleanField()
     country = CountrySerializer(read_only=True)
@@ -149,17 +212,11 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = ['id', 'name', 'meta_name', 'slug', 'description',
-                  'meta_description', 'photo', 'meta_photo', 'tags',
+                  'meta_description', 'photo', 'photo_srcset', 'meta_photo', 'tags',
                   'price', 'discounted_price', 'country', 'bonus_price',
                   'category_slug', 'category_name', 'is_favorite',
                   'average_rating', 'review_count', 'is_ordered', 'is_active']
 
-    def get_photo(self, obj):
-        request = self.context.get('request')
-        if obj.photo and request:
-            return request.build_absolute_uri(obj.photo.url)
-        return None
-
     def get_category_slug(self, obj):
         if obj.category:
             return obj.category.slug
@@ -170,22 +227,6 @@ class ProductSerializer(serializers.ModelSerializer):
             return obj.category.name
         return None
 
-    def get_is_favorite(self, obj):
-        request = self.context.get('request', None)
-        if request is None or not hasattr(request, 'user'):
-            return False
-        user = request.user
-        if user.is_authenticated:
-            return FavoriteProduct.objects.filter(user=user, product=obj).exists()
-        return False
-
-    def get_review_count(self, obj):
-        # Подсчитываем количество комментариев, игнорируя пустые строки
-        return obj.product_reviews.exclude(comment='').count()
-
-    def get_average_rating(self, obj):
-        return round(obj.product_reviews.aggregate(Avg('rating'))['rating__avg'] or 0)
-
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         representation['price'] = float(representation['price']) if representation['price'] else None
@@ -194,7 +235,7 @@ class ProductSerializer(serializers.ModelSerializer):
         return representation
 
 
-class ProductSimpleSerializer(serializers.ModelSerializer):
+class ProductSimpleSerializer(ProductListingMixin, ProductPhotoMixin, serializers.ModelSerializer):
     tags = TagSerializer(many=True)
     category_slug = serializers.SerializerMethodField()
     category_name = serializers.SerializerMethodField()
@@ -202,23 +243,18 @@ class ProductSimpleSerializer(serializers.ModelSerializer):
     review_count = serializers.SerializerMethodField()
     average_rating = serializers.SerializerMethodField()
     photo = serializers.SerializerMethodField()
+    photo_srcset = serializers.SerializerMethodField()
     is_ordered = serializers.BooleanField(read_only=True)
     is_active = serializers.BooleanField()
     country = CountrySerializer(read_only=True)
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'slug', 'description', 'photo', 'tags',
+        fields = ['id', 'name', 'slug', 'description', 'photo', 'photo_srcset', 'tags',
                   'price', 'discounted_price', 'country', 'bonus_price',
                   'category_slug', 'category_name', 'is_favorite',
                   'average_rating', 'review_count', 'is_ordered', 'is_active']
 
-    def get_photo(self, obj):
-        request = self.context.get('request')
-        if obj.photo and request:
-            return request.build_absolute_uri(obj.photo.url)
-        return None
-
     def get_category_slug(self, obj):
         if obj.category:
             return obj.category.slug
@@ -229,22 +265,6 @@ class ProductSimpleSerializer(serializers.ModelSerializer):
             return obj.category.name
         return None
 
-    def get_is_favorite(self, obj):
-        request = self.context.get('request', None)
-        if request is None or not hasattr(request, 'user'):
-            return False
-        user = request.user
-        if user.is_authenticated:
-            return FavoriteProduct.objects.filter(user=user, product=obj).exists()
-        return False
-
-    def get_review_count(self, obj):
-        # Подсчитываем количество комментариев, игнорируя пустые строки
-        return obj.product_reviews.exclude(comment='').count()
-
-    def get_average_rating(self, obj):
-        return round(obj.product_reviews.aggregate(Avg('rating'))['rating__avg'] or 0)
-
     def to_representation(self, instance):
         representation = super().to_representation(instance)
         representation['price'] = float(representation['price']) if representation['price'] else None
@@ -260,7 +280,7 @@ class SizeChartSerializer(serializers.ModelSerializer):
         fields = ['image']
 
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductDetailSerializer(ProductListingMixin, ProductPhotoMixin, serializers.ModelSerializer):
     tags = TagSerializer(many=True)
     product_sizes = ProductSizeSerializer(many=True, read_only=True)
     category_slug = serializers.SerializerMethodField()
@@ -268,29 +288,33 @@ class ProductDetailSerializer(serializers.ModelSerializer):
     is_favorite = serializers.SerializerMethodField()
     average_rating = serializers.SerializerMethodField()
     review_count = serializers.SerializerMethodField()
-    reviews = ReviewSerializer(many=True, read_only=True, source='product_reviews')
+    reviews = serializers.SerializerMethodField()
+    reviews_url = serializers.SerializerMethodField()
     characteristics = CharacteristicSerializer(many=True, read_only=True, source='product_characteristics')
     gender = GenderSerializer(read_only=True)
     country = CountrySerializer(read_only=True)
     is_ordered = serializers.SerializerMethodField()
     is_active = serializers.BooleanField()
     images = ProductImageSerializer(source='product_images' ,many=True, read_only=True)
+    photo = serializers.SerializerMethodField()
+    photo_srcset = serializers.SerializerMethodField()
     similar_products = serializers.SerializerMethodField()
     size_chart = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'slug', 'description', 'photo', 'images', 'tags',
+        fields = ['id', 'name', 'slug', 'description', 'photo', 'photo_srcset', 'images', 'tags',
                   'price', 'discounted_price', 'bonus_price', 'product_sizes',
                   'category_slug', 'category_name', 'is_favorite',
-                  'reviews', 'characteristics', 'average_rating',
+                  'reviews', 'reviews_url', 'characteristics', 'average_rating',
                   'review_count', 'gender', 'country', 'is_ordered', 'is_active', 'similar_products', 'size_chart']
 
     def get_size_chart(self, obj):
         request = self.context.get('request')
         if obj.size_chart:
+            url = obj.size_chart.image.url
             return {
-                "image": request.build_absolute_uri(obj.size_chart.image.url)  # Формируем полный URL
+                "image": request.build_absolute_uri(url) if request else url  # Формируем полный URL
             }
         return None
 
@@ -304,27 +328,30 @@ class ProductDetailSerializer(serializers.ModelSerializer):
             return obj.category.name
         return None
 
-    def get_is_favorite(self, obj):
-        request = self.context.get('request', None)
-        if request is None or not hasattr(request, 'user'):
-            return False
-        user = request.user
-        if user.is_authenticated:
-            return FavoriteProduct.objects.filter(user=user, product=obj).exists()
-        return False
-
-    def get_average_rating(self, obj):
-        return round(obj.product_reviews.aggregate(Avg('rating'))['rating__avg'] or 0)
+    def get_reviews(self, obj):
+        # Только последние отзывы: план карточки загружает их в latest_reviews
+        if hasattr(obj, 'latest_reviews'):
+            reviews = obj.latest_reviews
+        else:
+            reviews = reviews_queryset().filter(product=obj)[:DETAIL_REVIEWS_LIMIT]
+        return ReviewSerializer(reviews, many=True, context=self.context).data
 
-    def get_review_count(self, obj):
-        return obj.product_reviews.exclude(comment='').count()
+    def get_reviews_url(self, obj):
+        # Полный список отзывов постранично
+        request = self.context.get('request')
+        url = reverse('product-reviews', kwargs={'product_id': obj.id})
+        return request.build_absolute_uri(url) if request else url
 
     def get_similar_products(self, obj):
-        # Получаем не более 10 случайных похожих товаров
-        similar_products = obj.similar_products.order_by('?')[:10]
+        # Не более 10 похожих товаров: id из кэшированного пула и одна загрузка по id__in
+        request = self.context.get('request')
+        queryset = apply_listing_plan(Product.objects.all(), request.user if request else None)
+        similar_products = hydrate(queryset, similar_ids(obj))
         return ProductSimpleSerializer(similar_products, many=True, context=self.context).data
 
     def get_is_ordered(self, obj):
+        if hasattr(obj, 'is_ordered'):
+            return obj.is_ordered
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             # Check if the current user has an order item for this product
@@ -340,6 +367,21 @@ class ProductDetailSerializer(serializers.ModelSerializer):
         return representation
 
 
+class ProductDocumentSerializer(ProductDetailSerializer):
+    """
+    Документ продукта (apps.services.product_documents): поля ProductSerializer и ProductDetailSerializer,
+    кроме зависящих от пользователя и случайных похожих продуктов.
+    """
+
+    class Meta:
+        model = Product
+        fields = ['id', 'name', 'meta_name', 'slug', 'description', 'meta_description',
+                  'photo', 'photo_srcset', 'meta_photo', 'images', 'tags',
+                  'price', 'discounted_price', 'bonus_price', 'product_sizes', 'country',
+                  'category_slug', 'category_name', 'reviews', 'reviews_url', 'characteristics',
+                  'average_rating', 'review_count', 'gender', 'is_active', 'size_chart']
+
+
 class SizeProductSerializer(serializers.ModelSerializer):
     product = ProductSerializer()
     size = serializers.StringRelatedField()
@@ -388,16 +430,15 @@ class ComboProductSerializer(serializers.ModelSerializer):
 #     return representation
 
 
-class CategoryProductSerializer(serializers.ModelSerializer):
-    products = ProductSerializer(many=True, read_only=True)
-    subcategories = serializers.SerializerMethodField()
+class CategoryTreeSerializer(serializers.ModelSerializer):
+    """Узел дерева категорий без продуктов и подкатегорий — их собирает вью."""
     image = serializers.SerializerMethodField()
     filters = serializers.SerializerMethodField()
     parent_category = serializers.SerializerMethodField()  # Новое поле для родительской категории
 
     class Meta:
         model = Category
-        fields = ['id', 'name', 'description', 'slug', 'image', 'parent_category', 'products', 'subcategories', 'filters']
+        fields = ['id', 'name', 'description', 'slug', 'image', 'parent_category', 'filters']
 
     def get_image(self, obj):
         request = self.context.get('request')
@@ -405,44 +446,12 @@ class CategoryProductSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.image.url)
         return None
 
-    def get_subcategories(self, obj):
-        # Рекурсивно сериализуем подкатегории
-        subcategories = obj.subcategories.all()
-        serializer = CategoryProductSerializer(subcategories, many=True, context=self.context)
-        return serializer.data
-
     def get_filters(self, obj):
-        # Получаем все продукты в категории
-        products = Product.objects.filter(category=obj, is_active=True)
-
-        # Минимальная и максимальная цена
-        price_min = products.aggregate(Min('discounted_price'))['discounted_price__min'] or \
-                    products.aggregate(Min('price'))['price__min']
-        price_max = products.aggregate(Max('discounted_price'))['discounted_price__max'] or \
-                    products.aggregate(Max('price'))['price__max']
-
-        # Список доступных размеров, убираем None
-        sizes = list(filter(None, set(products.values_list('product_sizes__size__name', flat=True))))
-        countries = list(filter(None, set(products.values_list('country__name', flat=True))))
-        genders = list(filter(None, set(products.values_list('gender__name', flat=True))))
-        colors = list(filter(None, set(products.values_list('product_sizes__color__name', flat=True))))
-
-        # Получаем все средние рейтинги для всех продуктов
-        average_ratings = list(
-            products.annotate(average_rating=Avg('product_reviews__rating')).values_list('average_rating', flat=True))
-
-        # Убираем None и создаем уникальные значения
-        unique_ratings = set(filter(None, average_ratings))
-
-        return {
-            'price_min': price_min,
-            'price_max': price_max,
-            'sizes': sizes,  # Список размеров без None
-            'countries': countries,  # Список стран без None
-            'genders': genders,  # Список полов без None
-            'colors': colors,  # Список цветов без None
-            'average_ratings': list(unique_ratings)  # Возвращаем список уникальных рейтингов без None
-        }
+        # Фильтры берутся из индекса по поддереву; вью подгружают его для всего дерева через контекст
+        facets = self.context.get('category_facets')
+        if facets is None or obj.id not in facets:
+            facets = load_category_facets([obj])
+        return facets.get(obj.id)
 
     def get_parent_category(self, obj):
         # Возвращаем данные родительской категории, если она существует
@@ -455,6 +464,21 @@ class CategoryProductSerializer(serializers.ModelSerializer):
         return None
 
 
+class CategoryProductSerializer(CategoryTreeSerializer):
+    products = ProductSerializer(many=True, read_only=True)
+    subcategories = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Category
+        fields = ['id', 'name', 'description', 'slug', 'image', 'parent_category', 'products', 'subcategories', 'filters']
+
+    def get_subcategories(self, obj):
+        # Рекурсивно сериализуем подкатегории
+        subcategories = obj.subcategories.all()
+        serializer = CategoryProductSerializer(subcategories, many=True, context=self.context)
+        return serializer.data
+
+
 class CategoryOnlySerializer(serializers.ModelSerializer):
     subcategories = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()  # Обрабатываем URL для изображения
@@ -465,10 +489,7 @@ class CategoryOnlySerializer(serializers.ModelSerializer):
 
     def get_subcategories(self, obj):
         # Рекурсивно сериализуем подкатегории
-        subcategories = obj.subcategories.all()
-        if subcategories.exists():
-            return CategoryOnlySerializer(subcategories, many=True, context=self.context).data
-        return []
+        return CategoryOnlySerializer(obj.subcategories.all(), many=True, context=self.context).data
 
     def get_image(self, obj):
         request = self.context.get('request')
@@ -518,7 +539,7 @@ class FavoriteProductSerializer(serializers.ModelSerializer):
         return True
 
 
-class ProductShortSerializer(serializers.ModelSerializer):
+class ProductShortSerializer(ProductListingMixin, ProductPhotoMixin, serializers.ModelSerializer):
     review_count = serializers.SerializerMethodField()
     average_rating = serializers.SerializerMethodField()
     photo = serializers.SerializerMethodField()
@@ -527,18 +548,6 @@ class ProductShortSerializer(serializers.ModelSerializer):
         model = Product
         fields = ['id', 'name', 'description', 'photo', 'average_rating', 'review_count']
 
-    def get_photo(self, obj):
-        request = self.context.get('request')
-        if obj.photo and request:
-            return request.build_absolute_uri(obj.photo.url)
-        return None
-
-    def get_review_count(self, obj):
-        # Подсчитываем количество комментариев, игнорируя пустые строки
-        return obj.product_reviews.exclude(comment='').count()
-
-    def get_average_rating(self, obj):
-        return round(obj.product_reviews.aggregate(Avg('rating'))['rating__avg'] or 0)
 
 
 class ReviewCreateSerializer(serializers.ModelSerializer):
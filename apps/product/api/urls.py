@@ -4,6 +4,8 @@ from apps.product.api.views import (
     ProductListByCategorySlugView,
     CategoryListView,
     ProductSearchView,
+    ProductSuggestView,
+    ProductFacetsView,
     ProductBonusView,
     CategoryOnlyListView,
     PopularProducts,
@@ -17,11 +19,14 @@ from apps.product.api.views import (
     ProductDetailBySlugView,
     PromotedCategoryListView,
     UserReviewListView,
-    ProductReviewsView
+    ProductReviewsView,
+    ViewCounterStatsView,
 )
 
 urlpatterns = [
           path('product/search/', ProductSearchView.as_view(), name='product-search'),
+          path('suggest/', ProductSuggestView.as_view(), name='product-suggest'),
+          path('product/facets/', ProductFacetsView.as_view(), name='product-facets'),
           path('bonus/', ProductBonusView.as_view(), name='bonus-list'),
           path('category/<slug:slug>/', ProductListByCategorySlugView.as_view(), name='category'),
           path('categories/', CategoryListView.as_view(), name='category-list'),
@@ -38,4 +43,5 @@ urlpatterns = [
           path('reviews/<int:pk>/', ReviewDeleteView.as_view(), name='review-delete'),
           path('my-reviews/', UserReviewListView.as_view(), name='user-reviews'),
           path('<int:product_id>/reviews/', ProductReviewsView.as_view(), name='product-reviews'),
+          path('view-counter/stats/', ViewCounterStatsView.as_view(), name='view-counter-stats'),
 ]
@@ -1,21 +1,22 @@
-from itertools import product
+from collections import defaultdict
 
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics, status, permissions
 from rest_framework.exceptions import NotFound
-from django.db.models import Avg, F, ExpressionWrapper, DecimalField, Q
 from django.shortcuts import get_object_or_404
 
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.filters import OrderingFilter
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
 
 from .serializers import FavoriteProductSerializer, ReviewSerializer, ReviewsGetSerializer
 
-from apps.product.api.filters import ProductFilter
+from apps.product.api.filters import ProductFilter, ProductOrderingFilter
 from apps.product.api.serializers import (
     ProductSerializer,
     CategoryProductSerializer,
+    CategoryTreeSerializer,
     CategoryOnlySerializer,
     ProductSizeWithBonusSerializer,
     ProductSizeSerializer,
@@ -26,54 +27,127 @@ from apps.product.api.serializers import (
 )
 from apps.product.models import (
     Category,
+    Characteristic,
+    Color,
+    Country,
+    Gender,
     Product,
+    ProductDocument,
+    ProductImage,
+    ProductRecommendation,
     ProductSize,
     Review,
+    ReviewImage,
+    Size,
+    SizeChart,
+    Tag,
+)
+from apps.services.category_facets import load_category_facets
+from apps.services.category_tree import get_category_tree, iter_category_nodes, render_category_nodes
+from apps.services.content_versions import ContentVersionMixin
+from apps.services.facet_engine import facet_search, parse_selection
+from apps.services.pagination import KeysetPagination
+from apps.services.product_documents import ProductDocumentListMixin, render_product_detail, render_products
+from apps.services.product_listing import apply_listing_plan, reviews_queryset
+from apps.services.product_sampling import RandomSample, get_pool, new_seed
+from apps.services.product_suggest import suggest
+from apps.services.response_cache import ResponseCacheMixin
+from apps.services.view_counter import record_product_view, view_counter_stats
+
+# Модели, из которых собираются карточки продуктов в ответах каталога
+PRODUCT_CACHE_MODELS = (
+    Product, ProductSize, ProductImage, Characteristic, Category, Review, Tag, Color, Size, Country, Gender, SizeChart,
+    ProductDocument, ProductRecommendation,
 )
 
 
-class ProductSearchView(generics.ListAPIView):
+class ProductSearchView(ResponseCacheMixin, ProductDocumentListMixin, generics.ListAPIView):
+    # is_favorite зависит от пользователя: из кэша отвечаем только анонимным
+    cache_models = PRODUCT_CACHE_MODELS
+    cache_timeout = 60
+    user_dependent = True
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend]
+    filter_backends = [DjangoFilterBackend, ProductOrderingFilter]
     filterset_class = ProductFilter
+    ordering_fields = ['average_rating', 'views_count', 'datetime', 'discounted_price', 'effective_price']
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        # Base queryset for active products with available stock
-        queryset = Product.objects.filter(is_active=True, product_sizes__quantity__gt=0).distinct()
+        # Активные продукты в наличии — по индексу проекции (is_active, in_stock, effective_price)
+        queryset = Product.objects.filter(listing__is_active=True, listing__in_stock=True)
 
-        # Search by name or article
-        name_or_article = self.request.query_params.get('name')
-        if name_or_article:
-            queryset = queryset.filter(
-                Q(name__icontains=name_or_article) | Q(article__icontains=name_or_article)
-            )
+        # Поиск по ?name= (название или артикул) выполняет ProductFilter через apps.services.product_search,
+        # остальные фильтры применяются поверх результатов поиска
+        return apply_listing_plan(queryset, self.request.user)
 
-        return queryset
 
+class ProductFacetsView(ResponseCacheMixin, generics.GenericAPIView):
+    """
+    Счётчики значений фильтров для текущего выбора (параметры как у ProductFilter) из индекса фасетов:
+    у каждого значения — сколько продуктов останется, если его добавить. По умолчанию только в наличии,
+    как в поиске; ?in_stock=false — все активные.
+    """
+    cache_models = PRODUCT_CACHE_MODELS
+    cache_timeout = 60
 
-class ProductDetailView(generics.RetrieveAPIView):
-    queryset = Product.objects.all()
-    serializer_class = ProductDetailSerializer
-    lookup_field = 'id'
+    def get(self, request, *args, **kwargs):
+        params = request.query_params.dict()
+        params['in_stock'] = params.get('in_stock', 'true').lower() not in ('0', 'false')
+        try:
+            selection = parse_selection(params)
+        except (ArithmeticError, ValueError):
+            return Response({"error": "price_min, price_max и rating_min должны быть числами"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        matched, facets = facet_search(selection)
+        return Response({'count': matched.bit_count(), 'facets': facets})
 
+
+class ProductSuggestView(generics.GenericAPIView):
     def get(self, request, *args, **kwargs):
-        response = super().get(request, *args, **kwargs)
+        # Подсказки для строки поиска из индекса в памяти, язык выбирается LanguageMiddleware
+        try:
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response({"error": "limit должен быть числом"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(suggest(request.query_params.get('q', ''), limit))
+
+
+class ProductDetailMixin:
+    def get_queryset(self):
+        # Из базы нужны только строка продукта и флаги пользователя, остальное — в документе продукта
+        return apply_listing_plan(Product.objects.all(), self.request.user).prefetch_related(None)
+
+    def retrieve(self, request, *args, **kwargs):
+        # Запрос только читает продукт, просмотр записывается в базу пачкой из буфера
         product = self.get_object()
-        product.views_count += 1
-        product.save(update_fields=['views_count'])
-        return response
+        data = render_product_detail(product, request)
+        record_product_view(product.pk)
+        self.response_cache_meta = {'product_id': product.pk}
+        return Response(data)
+
+    def response_cache_hit(self, request, meta):
+        # Ответ из кэша — тоже просмотр
+        record_product_view(meta['product_id'])
+
+
+class ProductDetailView(ProductDetailMixin, ResponseCacheMixin, generics.RetrieveAPIView):
+    cache_models = PRODUCT_CACHE_MODELS
+    user_dependent = True
+    serializer_class = ProductDetailSerializer
+    lookup_field = 'id'
 
     def get_serializer_context(self):
         # Добавляем request в контекст для сериализатора
         return {'request': self.request}
 
 
-class ProductReviewsView(generics.ListAPIView):
+class ProductReviewsView(ResponseCacheMixin, generics.ListAPIView):
+    cache_models = (Review, ReviewImage)
     serializer_class = ReviewSerializer
 
     def get_queryset(self):
         product_id = self.kwargs['product_id']  # Получаем product_id из URL
-        return Review.objects.filter(product_id=product_id)  # Фильтруем отзывы по product_id
+        return reviews_queryset().filter(product_id=product_id)  # Фильтруем отзывы по product_id
 
     def get(self, request, *args, **kwargs):
         response = super().get(request, *args, **kwargs)
@@ -83,77 +157,80 @@ class ProductReviewsView(generics.ListAPIView):
         })
 
 
-class ProductDetailBySlugView(generics.RetrieveAPIView):
-    queryset = Product.objects.all()
+class ProductDetailBySlugView(ProductDetailMixin, ResponseCacheMixin, generics.RetrieveAPIView):
+    cache_models = PRODUCT_CACHE_MODELS
+    user_dependent = True
     serializer_class = ProductDetailSerializer
     lookup_field = 'slug'
 
-    def get(self, request, *args, **kwargs):
-        response = super().get(request, *args, **kwargs)
-        product = self.get_object()
-        product.views_count += 1
-        product.save(update_fields=['views_count'])
-        return response
-
     def get_serializer_context(self):
         # Добавляем request в контекст для сериализатора
         return {'request': self.request}
 
 
-class ProductBonusView(generics.ListAPIView):
-    queryset = Product.objects.filter(bonus_price__gt=0)
-    serializer_class =  ProductSerializer
+class ProductBonusView(ResponseCacheMixin, ProductDocumentListMixin, generics.ListAPIView):
+    cache_models = PRODUCT_CACHE_MODELS
+    user_dependent = True
+    serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return apply_listing_plan(Product.objects.filter(bonus_price__gt=0), self.request.user)
 
 
-class ProductListByCategorySlugView(generics.ListAPIView):
-    filter_backends = [DjangoFilterBackend, OrderingFilter]
+class ProductListByCategorySlugView(ResponseCacheMixin, generics.ListAPIView):
+    cache_models = PRODUCT_CACHE_MODELS
+    user_dependent = True
+    serializer_class = ProductSerializer
+    filter_backends = [DjangoFilterBackend, ProductOrderingFilter]
     filterset_class = ProductFilter
-    ordering_fields = ['average_rating', 'views_count', 'datetime', 'discounted_price']
+    ordering_fields = ['average_rating', 'views_count', 'datetime', 'discounted_price', 'effective_price']
+
+    def get_subtree(self):
+        # Категория и всё её поддерево (любой глубины) одним запросом, в порядке дерева
+        if not hasattr(self, '_subtree'):
+            try:
+                category = Category.objects.get(slug=self.kwargs['slug'])
+            except Category.DoesNotExist:
+                raise NotFound("Категория не найдена")
+            self._subtree = list(category.get_descendants(include_self=True).select_related('parent'))
+        return self._subtree
 
     def get_queryset(self):
-        slug = self.kwargs['slug']
-        try:
-            # Получаем категорию по slug
-            category = Category.objects.get(slug=slug)
-        except Category.DoesNotExist:
-            raise NotFound("Категория не найдена")
-
-        # Получаем все подкатегории, включая основную категорию
-        all_categories = list(category.subcategories.all()) + [category]
-
-        # Получаем все продукты из основной категории и подкатегорий
-        queryset = Product.objects.filter(category__in=all_categories, is_active=True, product_sizes__isnull=False).annotate(
-            average_rating=Avg('product_reviews__rating'),
-            final_price=ExpressionWrapper(
-                F('price') - F('discounted_price'), output_field=DecimalField(max_digits=10, decimal_places=2)
-            )
+        # Активные продукты поддерева, у которых есть варианты, — по индексу проекции (is_active, category, ...)
+        queryset = Product.objects.filter(
+            listing__is_active=True,
+            listing__category__in=[category.id for category in self.get_subtree()],
+            listing__variant_count__gt=0,
         )
 
-        # Применяем сортировку
-        return queryset
+        # average_rating из плана используется и для сортировки
+        return apply_listing_plan(queryset, self.request.user)
 
     def get(self, request, *args, **kwargs):
-        # Получаем отфильтрованные продукты, включая подкатегории
-        queryset = self.get_queryset()
-        filtered_queryset = self.filter_queryset(queryset)  # Применяем фильтры и сортировку
+        subtree = self.get_subtree()
 
-        # Получаем категорию, чтобы вернуть вложенную структуру
-        category = Category.objects.get(slug=self.kwargs['slug'])
-        serializer = CategoryProductSerializer(category, context={'request': request})
-        serializer_data = serializer.data
+        # Один отфильтрованный запрос на всё поддерево, продукты раскладываются по категориям в памяти
+        products = list(self.filter_queryset(self.get_queryset()).prefetch_related(None))
+        products_data = render_products(products, request)
+        products_by_category = defaultdict(list)
+        for product, product_data in zip(products, products_data):
+            products_by_category[product.category_id].append(product_data)
 
-        # Фильтруем продукты только для родительской категории (чтобы отразить структуру)
-        products_in_category = filtered_queryset.filter(category=category)
-        serializer_data['products'] = ProductSerializer(products_in_category, many=True,
-                                                        context={'request': request}).data
+        facets = load_category_facets(subtree)
+        nodes_data = CategoryTreeSerializer(subtree, many=True,
+                                            context={'request': request, 'category_facets': facets}).data
 
-        # Обновляем продукты подкатегорий, сохраняя исходную структуру
-        for subcategory in serializer_data['subcategories']:
-            subcategory_products = filtered_queryset.filter(category__slug=subcategory['slug'])
-            subcategory['products'] = ProductSerializer(subcategory_products, many=True,
-                                                        context={'request': request}).data
+        root = subtree[0]
+        nodes = {}
+        for category, node in zip(subtree, nodes_data):
+            node['products'] = products_by_category[category.id]
+            node['subcategories'] = []
+            nodes[category.id] = node
+            if category.id != root.id:
+                nodes[category.parent_id]['subcategories'].append(node)
 
-        return Response(serializer_data)
+        return Response(nodes[root.id])
 
 
 # class SetListView(generics.ListAPIView):
@@ -167,45 +244,82 @@ class ProductListByCategorySlugView(generics.ListAPIView):
 #         )
 
 
-class CategoryListView(generics.ListAPIView):
+class CategoryListView(ResponseCacheMixin, generics.ListAPIView):
+    cache_models = PRODUCT_CACHE_MODELS
+    user_dependent = True
     serializer_class = CategoryProductSerializer
 
     def get(self, request, *args, **kwargs):
         categories = Category.objects.prefetch_related('products', 'sets').all()
-        serializer = CategoryProductSerializer(categories, many=True, context={'request': request})
+        facets = load_category_facets(categories)
+        serializer = CategoryProductSerializer(categories, many=True,
+                                               context={'request': request, 'category_facets': facets})
         return Response(serializer.data)
 
 
-class CategoryOnlyListView(generics.ListAPIView):
+class CategoryOnlyListView(ResponseCacheMixin, ContentVersionMixin, generics.ListAPIView):
+    # product_count в узлах зависит от продуктов: их изменения тоже сбрасывают кэш и ETag
+    cache_models = (Category, Product)
+    content_domains = ('categories', 'products')
     serializer_class = CategoryOnlySerializer
 
     def get(self, request, *args, **kwargs):
-        # Получаем только родительские категории (категории верхнего уровня)
-        categories = Category.objects.filter(parent__isnull=True)
-        serializer = CategoryOnlySerializer(categories, many=True, context={'request': request})
-        return Response(serializer.data)
+        # Категории верхнего уровня с подкатегориями из кэшированного дерева
+        return Response(render_category_nodes(get_category_tree(), request))
 
 
-class PromotedCategoryListView(generics.ListAPIView):
+class PromotedCategoryListView(ResponseCacheMixin, ContentVersionMixin, generics.ListAPIView):
+    # product_count в узлах зависит от продуктов: их изменения тоже сбрасывают кэш и ETag
+    cache_models = (Category, Product)
+    content_domains = ('categories', 'products')
     serializer_class = CategoryOnlySerializer
 
-    def get_queryset(self):
-        # Получаем только категории, у которых is_promoted=True
-        return Category.objects.filter(is_promoted=True)
-
-
-class PopularProducts(generics.ListAPIView):
+    def list(self, request, *args, **kwargs):
+        # Только категории с is_promoted=True, по полю order, как прежде
+        nodes = sorted((node for node in iter_category_nodes() if node['is_promoted']), key=lambda node: node['order'])
+        page = self.paginate_queryset(nodes)
+        return self.get_paginated_response(render_category_nodes(page, request))
+
+
+class RandomProductFeedView(ResponseCacheMixin, generics.ListAPIView):
+    """
+    Случайная выдача из кэшированного пула id. Порядок задаётся ?seed=: с одним seed страницы
+    не пересекаются; если seed не передан, он генерируется и добавляется в ссылки next/previous.
+    Анонимный запрос без seed в пределах cache_timeout получает ту же выдачу вместе с её seed.
+    """
+    cache_models = PRODUCT_CACHE_MODELS
+    cache_timeout = 60
+    user_dependent = True
     serializer_class = ProductSerializer
+    pool_name = None
+
+    def get_seed(self):
+        try:
+            return int(self.request.query_params['seed'])
+        except (KeyError, ValueError):
+            return new_seed()
 
     def get_queryset(self):
-        return Product.objects.filter(is_popular=True, is_active=True).order_by('?')
+        return apply_listing_plan(Product.objects.all(), self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        self.seed = self.get_seed()
+        sample = RandomSample(self.get_queryset().prefetch_related(None), get_pool(self.pool_name), self.seed)
+        page = self.paginate_queryset(sample)
+        response = self.get_paginated_response(render_products(page, request))
+        for link in ('next', 'previous'):
+            if response.data.get(link):
+                response.data[link] = replace_query_param(response.data[link], 'seed', self.seed)
+        response.data['seed'] = self.seed
+        return response
 
 
-class NewProducts(generics.ListAPIView):
-    serializer_class = ProductSerializer
+class PopularProducts(RandomProductFeedView):
+    pool_name = 'popular'
 
-    def get_queryset(self):
-        return Product.objects.filter(is_new=True, is_active=True).order_by('?')
+
+class NewProducts(RandomProductFeedView):
+    pool_name = 'new'
 
 
 class CheckProductSizes(generics.GenericAPIView):
@@ -264,13 +378,15 @@ class ToggleFavoriteProductView(generics.GenericAPIView):
         }, status=status.HTTP_201_CREATED)
 
 
-class FavoriteProductsListView(generics.ListAPIView):
+class FavoriteProductsListView(ProductDocumentListMixin, generics.ListAPIView):
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
         # Получаем все избранные продукты текущего пользователя
-        return Product.objects.filter(favorited_by__user=self.request.user)
+        queryset = Product.objects.filter(favorited_by__user=self.request.user)
+        return apply_listing_plan(queryset, self.request.user)
 
 
 class CreateReviewView(generics.CreateAPIView):
@@ -306,3 +422,10 @@ class UserReviewListView(generics.ListAPIView):
         # Возвращаем только те отзывы, которые создал текущий пользователь
         return Review.objects.filter(user=self.request.user)
 
+
+class ViewCounterStatsView(APIView):
+    """Состояние буфера просмотров этого процесса: сколько ждёт записи, записано, отброшено и сбоев записи."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(view_counter_stats())
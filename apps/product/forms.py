@@ -2,12 +2,28 @@ from django import forms
 
 from apps.pages.models import MethodsOfPayment
 from apps.product.models import ProductSize, Product, Category, Characteristic, Color, Tag, ProductImage
+from apps.services.category_tree import category_choices
 
 from django.utils.translation import gettext_lazy as _
-from django.utils.html import format_html
 from django.core.exceptions import ValidationError
 
 
+def use_category_tree_choices(field):
+    """Варианты поля выбора категории берутся из кэшированного дерева: с отступами и без запроса к базе."""
+    blank = [('', field.empty_label)] if field.empty_label is not None else []
+    field.choices = blank + category_choices()
+
+
+class CategoryTreeChoicesMixin:
+    """Для ModelAdmin и инлайнов: все поля-ссылки на Category выбираются из кэшированного дерева."""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if field is not None and db_field.related_model is Category:
+            use_category_tree_choices(field)
+        return field
+
+
 class ProductSizeForm(forms.ModelForm):
     class Meta:
         model = ProductSize
@@ -30,11 +46,9 @@ class ProductAdminForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # Убираем фильтрацию категорий, чтобы отображать все доступные категории
+        # Все категории с отступами по уровню — из кэшированного дерева
         self.fields['category'].queryset = Category.objects.all()
-        self.fields['category'].label_from_instance = lambda obj: format_html(
-            '&nbsp;' * (obj.level * 4) + str(obj)
-        )
+        use_category_tree_choices(self.fields['category'])
 
         if self.instance and self.instance.pk:
             # Исключаем текущий продукт из списка выбора похожих продуктов
@@ -0,0 +1,143 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from apps.product.api.filters import ProductFilter
+from apps.product.models import Category, Color, Country, Gender, Product, ProductSize, Size
+from apps.services.facet_engine import FacetIndex, parse_selection, reset_facet_index
+from apps.services.listing_projection import rebuild_product_listings
+
+SIZES = ('36', '37', '38', '39', '40', '41', '42', '43')
+COLORS = ('Черный', 'Белый', 'Красный', 'Синий', 'Зеленый', 'Серый', 'Бежевый', 'Коричневый', 'Розовый', 'Желтый')
+GENDERS = ('Мужской', 'Женский', 'Унисекс')
+COUNTRIES = ('Кыргызстан', 'Турция', 'Китай', 'Италия', 'Вьетнам')
+
+FILTERS = (
+    {'size': '42'},
+    {'size': '41,42', 'color': 'Черный,Белый'},
+    {'size': '40', 'color': 'Синий', 'gender': 'Мужской', 'price_max': '3000'},
+    {'gender': 'Женский', 'country': 'Турция', 'price_min': '1500', 'price_max': '4000'},
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает фильтрацию по атрибутам через join'ы с вариантами и DISTINCT, через проекцию ProductListing "
+        "и через индекс фасетов в памяти на синтетическом каталоге. Данные откатываются после замера."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--variants', type=int, default=100000, help="Количество вариантов в каталоге")
+        parser.add_argument('--variants-per-product', type=int, default=4)
+        parser.add_argument('--repeat', type=int, default=5, help="Повторов каждого замера")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Бенчмарк требует PostgreSQL")
+        try:
+            with transaction.atomic():
+                self.create_catalog(options['variants'], options['variants_per_product'], options['batch_size'])
+                self.compare(options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            # Индекс этого процесса мог быть построен по откаченным данным
+            reset_facet_index()
+
+    def create_catalog(self, variants, per_product, batch_size):
+        started = time.perf_counter()
+        self.category = Category.objects.create(name='Бенчмарк фасетов', slug='benchmark-facets')
+        sizes = [Size.objects.get_or_create(name=name)[0] for name in SIZES]
+        colors = [Color.objects.create(name=name) for name in COLORS]
+        genders = [Gender.objects.create(name=name) for name in GENDERS]
+        countries = [Country.objects.create(name=name, logo='countries/benchmark.png') for name in COUNTRIES]
+        count = variants // per_product
+        for start in range(0, count, batch_size):
+            products = Product.objects.bulk_create(
+                Product(
+                    name=f'Фасет {index}', slug=f'benchmark-facets-{index}', category=self.category,
+                    photo='product_photos/product.webp', price=1000 + index % 5000, article=f'{index:09d}',
+                    gender=genders[index % len(genders)], country=countries[index % len(countries)],
+                )
+                for index in range(start, min(start + batch_size, count))
+            )
+            ProductSize.objects.bulk_create(
+                ProductSize(
+                    product=product,
+                    size=sizes[(product.id + offset) % len(sizes)],
+                    color=colors[(product.id * 3 + offset) % len(colors)],
+                    quantity=(product.id + offset) % 4,
+                    price=product.price,
+                )
+                for product in products for offset in range(per_product)
+            )
+        rebuild_product_listings()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write(f"Каталог из {count} продуктов и {count * per_product} вариантов создан "
+                          f"за {time.perf_counter() - started:.1f} с")
+
+    def base_queryset(self):
+        return Product.objects.filter(category=self.category, is_active=True)
+
+    def join_queryset(self, params):
+        # Прежний ProductFilter: join с вариантами и DISTINCT на каждый фильтр (варианты — только в наличии,
+        # чтобы результаты совпадали с остальными путями)
+        queryset = self.base_queryset()
+        if 'size' in params:
+            queryset = queryset.filter(
+                product_sizes__size__name__in=params['size'].split(','), product_sizes__quantity__gt=0
+            ).distinct()
+        if 'color' in params:
+            queryset = queryset.filter(
+                product_sizes__color__name__in=params['color'].split(','), product_sizes__quantity__gt=0
+            ).distinct()
+        if 'gender' in params:
+            queryset = queryset.filter(gender__name__in=params['gender'].split(',')).distinct()
+        if 'country' in params:
+            queryset = queryset.filter(country__name__icontains=params['country'])
+        if 'price_min' in params:
+            queryset = queryset.filter(price__gte=params['price_min'])
+        if 'price_max' in params:
+            queryset = queryset.filter(price__lte=params['price_max'])
+        return queryset
+
+    def filter_queryset(self, params, use_facet_engine):
+        filterset = ProductFilter(params, queryset=self.base_queryset())
+        filterset.use_facet_engine = use_facet_engine
+        return filterset.qs
+
+    def measure(self, repeat, function):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = function()
+            timings.append((time.perf_counter() - started) * 1000)
+        return result, min(timings)
+
+    def compare(self, repeat):
+        started = time.perf_counter()
+        index = FacetIndex(token=None).build()
+        self.stdout.write(f"Индекс фасетов построен за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+        for params in FILTERS:
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\nФильтры: {params}"))
+            selection = parse_selection(params)
+            selection['categories'] = {self.category.id}
+            paths = (
+                ('join + DISTINCT', lambda: self.join_queryset(params).count()),
+                ('проекция', lambda: self.filter_queryset(params, False).count()),
+                ('фасеты: id', lambda: index.search(selection, with_counts=False)[0].bit_count()),
+                ('фасеты: id и счётчики', lambda: index.search(selection)[0].bit_count()),
+                ('фасеты + страница из базы', lambda: len(self.filter_queryset(params, True)[:20])),
+            )
+            for label, function in paths:
+                found, elapsed = self.measure(repeat, function)
+                self.stdout.write(self.style.SUCCESS(f"{label}: {found} продуктов, {elapsed:.1f} мс"))
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+
+from apps.product.management.commands.benchmark_product_search import Command as SearchBenchmarkCommand, Rollback
+from apps.product.models import Product
+from apps.services.pagination import KeysetPagination
+
+
+class Command(SearchBenchmarkCommand):
+    help = (
+        "Сравнивает время страницы при OFFSET-пагинации и при курсоре на разной глубине "
+        "на синтетическом каталоге. Данные откатываются после замера."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000, help="Размер синтетического каталога")
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--depth', type=int, action='append', dest='depths', help="Номер страницы для замера")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Бенчмарк требует PostgreSQL")
+        page_size = options['page_size']
+        depths = options['depths'] or sorted({1, 10, 100, 1000, options['products'] // page_size})
+        try:
+            with transaction.atomic():
+                self.create_catalog(options['products'], options['batch_size'])
+                self.stdout.write(f"{'страница':>10} {'OFFSET, мс':>12} {'курсор, мс':>12}")
+                for depth in depths:
+                    offset_ms, cursor_ms = self.measure(depth, page_size)
+                    self.stdout.write(f"{depth:>10} {offset_ms:>12.2f} {cursor_ms:>12.2f}")
+                raise Rollback
+        except Rollback:
+            pass
+
+    def timed(self, queryset):
+        started = time.perf_counter()
+        rows = list(queryset)
+        return (time.perf_counter() - started) * 1000, rows
+
+    def measure(self, depth, page_size):
+        queryset = Product.objects.filter(is_active=True)
+        ordered = queryset.order_by('-views_count', '-id')
+        offset = (depth - 1) * page_size
+        offset_ms, _ = self.timed(ordered[offset:offset + page_size])
+
+        # Позиция предыдущей страницы в реальном клиенте приходит в курсоре — здесь её находим без замера
+        pagination = KeysetPagination()
+        pagination.field, pagination.nullable = 'views_count', False
+        if offset:
+            value, last_id = ordered.values_list('views_count', 'id')[offset - 1]
+            page = ordered.filter(pagination.after(value, last_id, descending=True, nulls_first=True))
+        else:
+            page = ordered
+        cursor_ms, _ = self.timed(page[:page_size])
+        return offset_ms, cursor_ms
@@ -0,0 +1,92 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+
+from apps.product.models import Category, Characteristic, Color, Product, ProductSize, Size
+from apps.services.product_search import search_enabled, search_products, update_search_vectors
+
+WORDS = (
+    'кроссовки', 'ботинки', 'туфли', 'сандалии', 'кеды', 'sneakers', 'boots', 'кожаные', 'замшевые', 'летние',
+    'зимние', 'беговые', 'классические', 'спортивные', 'детские', 'женские', 'мужские', 'черные', 'белые', 'синие',
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает планы и время прежнего поиска (icontains + join + distinct) и нового "
+        "(полнотекстовый вектор + триграммы) на синтетическом каталоге. Данные откатываются после замера."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000, help="Размер синтетического каталога")
+        parser.add_argument('--query', action='append', dest='queries',
+                            help="Строка поиска, можно указать несколько раз")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if not search_enabled():
+            raise CommandError("Бенчмарк требует PostgreSQL")
+        queries = options['queries'] or ['кроссовки', 'кросовки', 'sneak', '1234']
+        try:
+            with transaction.atomic():
+                self.create_catalog(options['products'], options['batch_size'])
+                for text in queries:
+                    self.compare(text)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def create_catalog(self, count, batch_size):
+        started = time.perf_counter()
+        category = Category.objects.create(name='Бенчмарк', slug='benchmark-search')
+        size, _ = Size.objects.get_or_create(name='42')
+        color = Color.objects.create(name='Черный', hex_code='#000000')
+        for start in range(0, count, batch_size):
+            products = []
+            for index in range(start, min(start + batch_size, count)):
+                name = ' '.join(WORDS[(index * step) % len(WORDS)] for step in (1, 3, 7))
+                products.append(Product(
+                    name=name, name_ru=name, name_en=name, slug=f'benchmark-search-{index}',
+                    description=f'{name} {WORDS[index % len(WORDS)]}', category=category,
+                    photo='product_photos/product.webp', price=1000, article=f'{index:09d}',
+                    views_count=index % 997,
+                ))
+            products = Product.objects.bulk_create(products)
+            ProductSize.objects.bulk_create(
+                ProductSize(product=product, size=size, color=color, quantity=index % 3) for index, product in enumerate(products)
+            )
+            Characteristic.objects.bulk_create(
+                Characteristic(product=product, name='Материал', value=WORDS[index % len(WORDS)])
+                for index, product in enumerate(products)
+            )
+        update_search_vectors(Product.objects.filter(category=category))
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.stdout.write(f"Каталог из {count} продуктов создан за {time.perf_counter() - started:.1f} с")
+
+    def old_queryset(self, text):
+        return Product.objects.filter(
+            is_active=True, product_sizes__quantity__gt=0
+        ).filter(Q(name__icontains=text) | Q(article__icontains=text)).distinct()
+
+    def new_queryset(self, text):
+        queryset = Product.objects.filter(
+            Exists(ProductSize.objects.filter(product=OuterRef('pk'), quantity__gt=0)), is_active=True
+        )
+        return search_products(queryset, text)
+
+    def compare(self, text):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\nЗапрос: {text!r}"))
+        for label, queryset in (('прежний', self.old_queryset(text)), ('новый', self.new_queryset(text))):
+            page = queryset[:20]
+            started = time.perf_counter()
+            found = len(page)
+            elapsed = (time.perf_counter() - started) * 1000
+            self.stdout.write(self.style.SUCCESS(f"{label}: {found} строк на странице, {elapsed:.1f} мс"))
+            self.stdout.write(page.explain(analyze=True))
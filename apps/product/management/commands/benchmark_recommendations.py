@@ -0,0 +1,108 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from apps.orders.models import Order, OrderItem
+from apps.product.models import Category, Color, Product, ProductSize, Size
+from apps.services.recommendations import compute_recommendations
+
+# Позиции ссылаются на варианты с перекосом популярности: random()^2 чаще выбирает начало каталога
+ORDERS_SQL = """
+    INSERT INTO {order} (order_time, subtotal, discount_amount, bonus_amount, is_pickup, payment_method, order_status,
+                         order_source, is_read)
+    SELECT now(), 0, 0, 0, false, 'card', 'completed', 'mobile', false FROM generate_series(1, %(orders)s)
+"""
+
+ITEMS_SQL = """
+    INSERT INTO {order_item} (order_id, product_size_id, quantity, total_amount, is_bonus, is_ordered)
+    SELECT picks.order_id, variants.id, 1, 0, false, true
+    FROM (
+        SELECT orders.id AS order_id, floor(%(variants)s * power(random(), 2))::integer AS position
+        FROM {order} orders CROSS JOIN generate_series(1, %(per_order)s)
+        WHERE orders.id > %(after)s
+    ) picks
+    JOIN (
+        SELECT id, (row_number() OVER (ORDER BY id) - 1)::integer AS position
+        FROM {product_size} WHERE product_id IN (SELECT id FROM {product} WHERE category_id = %(category)s)
+    ) variants ON variants.position = picks.position
+"""
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет полный и инкрементальный расчёт рекомендаций на синтетической истории заказов. "
+        "Данные откатываются после замера."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--order-items', type=int, default=1000000, help="Количество позиций заказов")
+        parser.add_argument('--items-per-order', type=int, default=3)
+        parser.add_argument('--products', type=int, default=20000, help="Размер синтетического каталога")
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Бенчмарк требует PostgreSQL")
+        try:
+            with transaction.atomic():
+                self.create_catalog(options['products'], options['batch_size'])
+                per_order = options['items_per_order']
+                orders = options['order_items'] // per_order
+                self.create_orders(orders, per_order)
+                self.measure("Полный пересчёт", full=True)
+                # Дневной прирост — 1% заказов
+                self.create_orders(max(orders // 100, 1), per_order)
+                self.measure("Инкрементальный пересчёт", full=False)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def tables(self):
+        return {
+            'order': connection.ops.quote_name(Order._meta.db_table),
+            'order_item': connection.ops.quote_name(OrderItem._meta.db_table),
+            'product_size': connection.ops.quote_name(ProductSize._meta.db_table),
+            'product': connection.ops.quote_name(Product._meta.db_table),
+        }
+
+    def create_catalog(self, count, batch_size):
+        self.category = Category.objects.create(name='Бенчмарк рекомендаций', slug='benchmark-recommendations')
+        size, _ = Size.objects.get_or_create(name='42')
+        color = Color.objects.create(name='Бенчмарк')
+        for start in range(0, count, batch_size):
+            products = Product.objects.bulk_create(
+                Product(
+                    name=f'Рекомендация {index}', slug=f'benchmark-recommendations-{index}', category=self.category,
+                    photo='product_photos/product.webp', price=1000, article=f'{index:09d}',
+                )
+                for index in range(start, min(start + batch_size, count))
+            )
+            ProductSize.objects.bulk_create(
+                ProductSize(product=product, size=size, color=color, quantity=10, price=product.price)
+                for product in products
+            )
+        self.variants = count
+
+    def create_orders(self, orders, per_order):
+        started = time.perf_counter()
+        tables = self.tables()
+        after = Order.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        with connection.cursor() as cursor:
+            cursor.execute(ORDERS_SQL.format(**tables), {'orders': orders})
+            cursor.execute(ITEMS_SQL.format(**tables), {
+                'variants': self.variants, 'per_order': per_order, 'after': after, 'category': self.category.id,
+            })
+            cursor.execute('ANALYZE')
+        self.stdout.write(f"{orders} заказов по {per_order} позиции созданы за {time.perf_counter() - started:.1f} с")
+
+    def measure(self, label, full):
+        started = time.perf_counter()
+        run = compute_recommendations(full=full)
+        self.stdout.write(self.style.SUCCESS(
+            f"{label}: {run.product_count} продуктов за {time.perf_counter() - started:.1f} с"
+        ))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.services.catalog_sync import BATCH_SIZE, CatalogRowError, detect_format, export_catalog
+
+
+class Command(BaseCommand):
+    help = "Потоковая выгрузка каталога в CSV, JSONL или XLSX (одна строка — один вариант продукта)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл выгрузки")
+        parser.add_argument('--format', choices=('csv', 'jsonl', 'xlsx'), help="По умолчанию — по расширению файла")
+        parser.add_argument('--chunk-size', type=int, default=BATCH_SIZE,
+                            help="Продуктов, читаемых из серверного курсора за раз")
+
+    def handle(self, *args, **options):
+        try:
+            fmt = options['format'] or detect_format(options['path'])
+            with open(options['path'], 'wb') as file:
+                count = export_catalog(file, fmt, chunk_size=options['chunk_size'])
+        except (OSError, CatalogRowError) as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(f"Выгружено строк: {count}"))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.services.catalog_sync import BATCH_SIZE, CatalogRowError, detect_format, import_catalog
+
+
+class Command(BaseCommand):
+    help = "Пакетная загрузка каталога из CSV, JSONL или XLSX (одна строка — один вариант продукта)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Файл выгрузки поставщика")
+        parser.add_argument('--format', choices=('csv', 'jsonl', 'xlsx'), help="По умолчанию — по расширению файла")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Продуктов в одной транзакции")
+
+    def handle(self, *args, **options):
+        def progress(stats):
+            self.stdout.write(
+                f"строк: {stats['rows']}, создано: {stats['products_created']}, "
+                f"обновлено: {stats['products_updated']}, вариантов: "
+                f"+{stats['variants_created']}/~{stats['variants_updated']}"
+            )
+
+        try:
+            fmt = options['format'] or detect_format(options['path'])
+            with open(options['path'], 'rb') as file:
+                stats = import_catalog(file, fmt, options['batch_size'], progress)
+        except (OSError, CatalogRowError) as error:
+            raise CommandError(error)
+
+        for message in stats['errors']:
+            self.stderr.write(message)
+        self.stdout.write(self.style.SUCCESS(
+            f"Загрузка завершена: создано {stats['products_created']}, обновлено {stats['products_updated']}, "
+            f"без изменений {stats['products_unchanged']}, ошибок {len(stats['errors'])}"
+        ))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from apps.product.models import Product, ProductImage
+from apps.services.image_pipeline import IMAGE_FIELDS, process_image_variants
+
+
+class Command(BaseCommand):
+    help = "Строит варианты изображений продуктов, у которых их ещё нет (или всех с --force)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Пересобрать варианты всех изображений")
+
+    def handle(self, *args, **options):
+        for model in (Product, ProductImage):
+            file_field, hash_field, _ = IMAGE_FIELDS[model]
+            queryset = model.objects.exclude(**{file_field: ''})
+            if not options['force']:
+                queryset = queryset.filter(**{hash_field: ''})
+            processed = 0
+            for instance in queryset.iterator(chunk_size=100):
+                try:
+                    processed += process_image_variants(instance, force=options['force'])
+                except (OSError, ValueError) as error:
+                    self.stderr.write(f"{model.__name__} #{instance.pk}: {error}")
+            self.stdout.write(self.style.SUCCESS(f"{model._meta.verbose_name_plural}: обработано {processed}"))
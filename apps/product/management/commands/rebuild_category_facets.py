@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from apps.services.category_facets import rebuild_all_category_facets, rebuild_stale_category_facets
+
+
+class Command(BaseCommand):
+    help = "Пересобирает индекс фильтров категорий (CategoryFacetIndex) для всех деревьев и языков"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale', action='store_true',
+                            help="Только деревья с устаревшими строками (например, после перезапуска)")
+
+    def handle(self, *args, **options):
+        total = rebuild_stale_category_facets() if options['stale'] else rebuild_all_category_facets()
+        self.stdout.write(self.style.SUCCESS(f"Индекс фильтров пересобран для {total} деревьев категорий"))
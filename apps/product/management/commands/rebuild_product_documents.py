@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from apps.services.product_documents import (
+    BATCH_SIZE,
+    rebuild_all_product_documents,
+    rebuild_stale_product_documents,
+)
+
+
+class Command(BaseCommand):
+    help = "Пересобирает документы всех продуктов на всех языках в пуле процессов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Число процессов (по умолчанию — по числу ядер, не больше 4; 0 — без пула)")
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Продуктов в одной пачке")
+        parser.add_argument('--stale', action='store_true',
+                            help="Только документы, помеченные устаревшими (например, после перезапуска)")
+
+    def handle(self, *args, **options):
+        def progress(built, total):
+            self.stdout.write(f"{built}/{total}")
+
+        if options['stale']:
+            total = rebuild_stale_product_documents(options['batch_size'])
+        else:
+            total = rebuild_all_product_documents(options['workers'], options['batch_size'], progress)
+        self.stdout.write(self.style.SUCCESS(f"Документы пересобраны для {total} продуктов"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.services.listing_projection import rebuild_product_listings
+
+
+class Command(BaseCommand):
+    help = "Пересобирает проекции продуктов для списков (ProductListing)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Количество продуктов в одной пачке")
+
+    def handle(self, *args, **options):
+        total = rebuild_product_listings(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Проекции пересобраны для {total} продуктов"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from apps.services.rating_stats import rebuild_rating_stats
+
+
+class Command(BaseCommand):
+    help = "Пересобирает статистику отзывов (ProductRatingStats) для всех продуктов"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Количество продуктов в одной пачке")
+
+    def handle(self, *args, **options):
+        total = rebuild_rating_stats(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Статистика пересчитана для {total} продуктов"))
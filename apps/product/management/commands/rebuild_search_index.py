@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.services.product_search import search_enabled, update_search_vectors
+
+
+class Command(BaseCommand):
+    help = "Пересобирает поисковые векторы (Product.search_vector) для всех продуктов"
+
+    def handle(self, *args, **options):
+        if not search_enabled():
+            raise CommandError("Полнотекстовый поиск доступен только на PostgreSQL")
+        total = update_search_vectors()
+        self.stdout.write(self.style.SUCCESS(f"Поисковый индекс пересобран для {total} продуктов"))
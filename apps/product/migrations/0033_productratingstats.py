@@ -0,0 +1,33 @@
+# Generated by Django 5.0.7 on 2026-10-18 20:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0032_product_created_by'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRatingStats',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_stats', serialize=False, to='product.product', verbose_name='Продукт')),
+                ('review_count', models.PositiveIntegerField(default=0, verbose_name='Количество отзывов')),
+                ('commented_review_count', models.PositiveIntegerField(default=0, verbose_name='Количество отзывов с комментарием')),
+                ('rating_sum', models.FloatField(default=0, verbose_name='Сумма оценок')),
+                ('average_rating', models.FloatField(db_index=True, default=0, verbose_name='Средний рейтинг')),
+                ('rating_1', models.PositiveIntegerField(default=0, verbose_name='Оценок 1')),
+                ('rating_2', models.PositiveIntegerField(default=0, verbose_name='Оценок 2')),
+                ('rating_3', models.PositiveIntegerField(default=0, verbose_name='Оценок 3')),
+                ('rating_4', models.PositiveIntegerField(default=0, verbose_name='Оценок 4')),
+                ('rating_5', models.PositiveIntegerField(default=0, verbose_name='Оценок 5')),
+            ],
+            options={
+                'verbose_name': 'Статистика отзывов',
+                'verbose_name_plural': 'Статистика отзывов',
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.7 on 2026-10-18 20:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0033_productratingstats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryFacetIndex',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(max_length=10, verbose_name='Язык')),
+                ('data', models.JSONField(default=dict, verbose_name='Фильтры')),
+                ('built_at', models.DateTimeField(auto_now=True, verbose_name='Дата построения')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_indexes', to='product.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Индекс фильтров категории',
+                'verbose_name_plural': 'Индексы фильтров категорий',
+                'unique_together': {('category', 'language')},
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.7 on 2026-10-18 20:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0036_image_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['views_count', 'id'], name='product_views_count_id'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['datetime', 'id'], name='product_datetime_id'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['discounted_price', 'id'], name='product_discounted_price_id'),
+        ),
+    ]
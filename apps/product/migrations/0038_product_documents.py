@@ -0,0 +1,29 @@
+# Generated by Django 5.0.7 on 2026-10-18 20:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0037_product_cursor_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('language', models.CharField(max_length=10, verbose_name='Язык')),
+                ('data', models.JSONField(default=dict, verbose_name='Документ')),
+                ('built_at', models.DateTimeField(auto_now=True, verbose_name='Дата построения')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='documents', to='product.product', verbose_name='Продукт')),
+            ],
+            options={
+                'verbose_name': 'Документ продукта',
+                'verbose_name_plural': 'Документы продуктов',
+                'unique_together': {('product', 'language')},
+            },
+        ),
+    ]
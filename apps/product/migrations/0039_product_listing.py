@@ -0,0 +1,48 @@
+# Generated by Django 5.0.7 on 2026-10-18 21:06
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_product_listings(apps, schema_editor):
+    from apps.services.listing_projection import rebuild_product_listings
+
+    rebuild_product_listings(
+        product_model=apps.get_model('product', 'Product'),
+        size_model=apps.get_model('product', 'ProductSize'),
+        listing_model=apps.get_model('product', 'ProductListing'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0038_product_documents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductListing',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='listing', serialize=False, to='product.product', verbose_name='Продукт')),
+                ('is_active', models.BooleanField(default=True, verbose_name='Активный')),
+                ('effective_price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Итоговая цена')),
+                ('min_variant_price', models.DecimalField(decimal_places=2, max_digits=10, null=True, verbose_name='Минимальная цена варианта')),
+                ('max_variant_price', models.DecimalField(decimal_places=2, max_digits=10, null=True, verbose_name='Максимальная цена варианта')),
+                ('variant_count', models.PositiveIntegerField(default=0, verbose_name='Количество вариантов')),
+                ('stock_quantity', models.PositiveIntegerField(default=0, verbose_name='Остаток')),
+                ('in_stock', models.BooleanField(default=False, verbose_name='В наличии')),
+                ('size_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None, verbose_name='Размеры в наличии')),
+                ('color_ids', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None, verbose_name='Цвета в наличии')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.category', verbose_name='Категория')),
+            ],
+            options={
+                'verbose_name': 'Проекция продукта',
+                'verbose_name_plural': 'Проекции продуктов',
+                'indexes': [models.Index(fields=['is_active', 'category', 'effective_price'], name='listing_category_price'), models.Index(fields=['is_active', 'in_stock', 'effective_price'], name='listing_stock_price'), django.contrib.postgres.indexes.GinIndex(fields=['size_ids'], name='listing_size_ids'), django.contrib.postgres.indexes.GinIndex(fields=['color_ids'], name='listing_color_ids')],
+            },
+        ),
+        migrations.RunPython(fill_product_listings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.7 on 2026-10-18 21:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0039_product_listing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(auto_now_add=True, verbose_name='Начало')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Окончание')),
+                ('is_full', models.BooleanField(default=True, verbose_name='Полный пересчёт')),
+                ('last_order_item_id', models.PositiveIntegerField(default=0, verbose_name='Последняя позиция заказа')),
+                ('last_favorite_id', models.PositiveIntegerField(default=0, verbose_name='Последнее избранное')),
+                ('product_count', models.PositiveIntegerField(default=0, verbose_name='Пересчитано продуктов')),
+            ],
+            options={
+                'verbose_name': 'Расчёт рекомендаций',
+                'verbose_name_plural': 'Расчёты рекомендаций',
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(verbose_name='Оценка')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='Место')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='product.product', verbose_name='Продукт')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product.product', verbose_name='Рекомендуемый продукт')),
+            ],
+            options={
+                'verbose_name': 'Рекомендация продукта',
+                'verbose_name_plural': 'Рекомендации продуктов',
+                'indexes': [models.Index(fields=['product', 'rank'], name='recommendation_product_rank')],
+                'unique_together': {('product', 'recommended')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def fill_rating_stats(apps, schema_editor):
+    # Статистика отзывов строится по уже существующим отзывам, чтобы рейтинг не обнулился после деплоя
+    from apps.services.rating_stats import rebuild_rating_stats
+
+    rebuild_rating_stats(
+        product_model=apps.get_model('product', 'Product'),
+        review_model=apps.get_model('product', 'Review'),
+        stats_model=apps.get_model('product', 'ProductRatingStats'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0040_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_rating_stats, migrations.RunPython.noop),
+    ]
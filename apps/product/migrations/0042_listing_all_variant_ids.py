@@ -0,0 +1,36 @@
+# Generated by Django 5.0.7 on 2026-10-18 21:53
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+def refill_variant_ids(apps, schema_editor):
+    # В size_ids и color_ids раньше попадали только варианты в наличии — пересчитываем по всем вариантам
+    from apps.services.listing_projection import rebuild_product_listings
+
+    rebuild_product_listings(
+        product_model=apps.get_model('product', 'Product'),
+        size_model=apps.get_model('product', 'ProductSize'),
+        listing_model=apps.get_model('product', 'ProductListing'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0041_fill_rating_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='productlisting',
+            name='color_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None, verbose_name='Цвета вариантов'),
+        ),
+        migrations.AlterField(
+            model_name='productlisting',
+            name='size_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, size=None, verbose_name='Размеры вариантов'),
+        ),
+        migrations.RunPython(refill_variant_ids, migrations.RunPython.noop),
+    ]
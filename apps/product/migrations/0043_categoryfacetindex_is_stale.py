@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 22:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0042_listing_all_variant_ids'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categoryfacetindex',
+            name='is_stale',
+            field=models.BooleanField(default=False, verbose_name='Устарел'),
+        ),
+    ]
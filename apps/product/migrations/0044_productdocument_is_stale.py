@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 22:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0043_categoryfacetindex_is_stale'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productdocument',
+            name='is_stale',
+            field=models.BooleanField(default=False, verbose_name='Устарел'),
+        ),
+    ]
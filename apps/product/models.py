@@ -1,13 +1,11 @@
-import os
 import random
 
-from io import BytesIO
-
 from mptt.models import MPTTModel, TreeForeignKey
 
-from PIL import Image
 from colorfield.fields import ColorField
-from django.core.files.base import ContentFile
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
@@ -118,11 +116,26 @@ class Product(models.Model):
     views_count = models.PositiveIntegerField(default=0, verbose_name=_('Количество просмотров'))
     article = models.CharField(max_length=9, verbose_name=_('Артикул'), blank=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_("Создатель продукта"))
+    search_vector = SearchVectorField(null=True, editable=False)
+    photo_hash = models.CharField(max_length=64, blank=True, editable=False)
+    photo_variants = models.JSONField(default=list, blank=True, editable=False)
 
     class Meta:
         verbose_name = "Продукт"
         verbose_name_plural = "Продукты"
         ordering = ['order']
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_gin'),
+            GinIndex(fields=['name_ru'], opclasses=['gin_trgm_ops'], name='product_name_ru_trgm'),
+            GinIndex(fields=['name_en'], opclasses=['gin_trgm_ops'], name='product_name_en_trgm'),
+            GinIndex(fields=['name_ky'], opclasses=['gin_trgm_ops'], name='product_name_ky_trgm'),
+            # varchar_pattern_ops обслуживает и точное совпадение, и поиск по префиксу артикула
+            models.Index(fields=['article'], opclasses=['varchar_pattern_ops'], name='product_article_pattern'),
+            # Курсорная пагинация по полям сортировки списков: (поле, id) читаются по индексу в обе стороны
+            models.Index(fields=['views_count', 'id'], name='product_views_count_id'),
+            models.Index(fields=['datetime', 'id'], name='product_datetime_id'),
+            models.Index(fields=['discounted_price', 'id'], name='product_discounted_price_id'),
+        ]
 
     def __str__(self):
         return self.name
@@ -130,50 +143,6 @@ class Product(models.Model):
     def get_absolute_url(self):
         return f"/admin/product/product/{self.id}/change/"
 
-    def process_and_save_image(self):
-        """ Обрабатывает и сохраняет изображение, преобразуя его в формат .webp и изменяя размер, и удаляет старое изображение если нужно """
-        if not self.photo:
-            return
-
-        # Путь к текущему файлу перед изменением
-        old_path = self.photo.path if self.photo.name else None
-
-        # Проверяем, нужно ли преобразование
-        if not self.photo.name.endswith(('.webp', '.avif')):
-            image = Image.open(self.photo)
-
-            max_width = 800
-            max_height = 800
-
-            original_width, original_height = image.size
-            ratio = min(max_width / original_width, max_height / original_height)
-            new_width = int(original_width * ratio)
-            new_height = int(original_height * ratio)
-
-            resized_image = image.resize((new_width, new_height), Image.LANCZOS)
-
-            image_io = BytesIO()
-
-            # Определяем формат для сохранения
-            if self.photo.name.endswith('.avif'):
-                # Сохраняем в формате .webp
-                resized_image.save(image_io, format='WEBP', quality=85)
-                new_name = f"{self.photo.name.rsplit('.', 1)[0]}.webp"
-            else:
-                # Сохраняем в формате .webp
-                resized_image.save(image_io, format='WEBP', quality=85)
-                new_name = f"{self.photo.name.rsplit('.', 1)[0]}.webp"
-
-            self.photo.save(new_name, ContentFile(image_io.getvalue()), save=False)
-
-        # Вызов родительского метода save
-        super().save()
-
-        # Удаление старого файла, если путь существует и файл был обновлён
-        if old_path and old_path != self.photo.path:
-            if os.path.isfile(old_path):
-                os.remove(old_path)
-
     def generate_unique_article(self):
         """Generates a unique 9-digit article number for the product."""
         while True:
@@ -197,7 +166,7 @@ class Product(models.Model):
 
             self.slug = slug
 
-        self.process_and_save_image()
+        # Варианты фото строит фоновый конвейер изображений (apps.services.image_pipeline)
         super().save(*args, **kwargs)
 
 
@@ -345,6 +314,8 @@ class ProductImage(models.Model):
     image = models.FileField(upload_to='product_images/', verbose_name=_("Изображение"))
     product = models.ForeignKey(Product, related_name='product_images', on_delete=models.CASCADE, null=True, blank=True)
     color = models.ForeignKey(Color, related_name='images', on_delete=models.PROTECT, verbose_name=_('Цвет'))
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
+    image_variants = models.JSONField(default=list, blank=True, editable=False)
 
     class Meta:
         verbose_name = "Изображение продукта"
@@ -353,45 +324,8 @@ class ProductImage(models.Model):
     # def __str__(self):
     #     return f"{self.product.name} - {self.color.name}"  # Исправлено отображение названия продукта и цвета
 
-    def process_and_save_image(self):
-        """Обрабатывает и сохраняет изображение, преобразуя его в формат .webp и изменяя размер."""
-        if not self.image:
-            return
-
-        # Путь к текущему файлу перед изменением
-        old_path = self.image.path if self.image.name else None
-
-        # Проверяем, нужно ли преобразование
-        if not self.image.name.endswith(('.webp', '.avif')):
-            image = Image.open(self.image)
-
-            max_width = 800
-            max_height = 800
-
-            original_width, original_height = image.size
-            ratio = min(max_width / original_width, max_height / original_height)
-            new_width = int(original_width * ratio)
-            new_height = int(original_height * ratio)
-
-            resized_image = image.resize((new_width, new_height), Image.LANCZOS)
-
-            # Сохранение изображения в памяти
-            image_io = BytesIO()
-            resized_image.save(image_io, format='WEBP', quality=85)
-
-            new_name = f"{self.image.name.rsplit('.', 1)[0]}.webp"
-            self.image.save(new_name, ContentFile(image_io.getvalue()), save=False)
-
-        # Вызов родительского метода save
-        super().save()
-
-        # Удаление старого файла, если путь существует и файл был обновлён
-        if old_path and old_path != self.image.path:
-            if os.path.isfile(old_path):
-                os.remove(old_path)
-
     def save(self, *args, **kwargs):
-        self.process_and_save_image()
+        # Варианты изображения строит фоновый конвейер изображений (apps.services.image_pipeline)
         super().save(*args, **kwargs)
 
 
@@ -424,6 +358,148 @@ class Review(models.Model):
         return f"{self.user.phone_number} - {self.product.name} - {self.rating}/5"
 
 
+class ProductRatingStats(models.Model):
+    """Денормализованная статистика отзывов продукта, обновляется сигналами Review."""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='rating_stats',
+                                   verbose_name=_('Продукт'))
+    review_count = models.PositiveIntegerField(default=0, verbose_name=_('Количество отзывов'))
+    commented_review_count = models.PositiveIntegerField(default=0, verbose_name=_('Количество отзывов с комментарием'))
+    rating_sum = models.FloatField(default=0, verbose_name=_('Сумма оценок'))
+    average_rating = models.FloatField(default=0, db_index=True, verbose_name=_('Средний рейтинг'))
+    rating_1 = models.PositiveIntegerField(default=0, verbose_name=_('Оценок 1'))
+    rating_2 = models.PositiveIntegerField(default=0, verbose_name=_('Оценок 2'))
+    rating_3 = models.PositiveIntegerField(default=0, verbose_name=_('Оценок 3'))
+    rating_4 = models.PositiveIntegerField(default=0, verbose_name=_('Оценок 4'))
+    rating_5 = models.PositiveIntegerField(default=0, verbose_name=_('Оценок 5'))
+
+    class Meta:
+        verbose_name = "Статистика отзывов"
+        verbose_name_plural = "Статистика отзывов"
+
+    def __str__(self):
+        return f"{self.product_id} - {self.average_rating:.2f} ({self.review_count})"
+
+
+class CategoryFacetIndex(models.Model):
+    """
+    Предрассчитанные фильтры по поддереву категории для одного языка. is_stale ставится в транзакции
+    изменения и снимается пересборкой: помеченная строка не читается, даже если пересборка не дошла.
+    """
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='facet_indexes',
+                                 verbose_name=_('Категория'))
+    language = models.CharField(max_length=10, verbose_name=_('Язык'))
+    data = models.JSONField(default=dict, verbose_name=_('Фильтры'))
+    is_stale = models.BooleanField(default=False, verbose_name=_('Устарел'))
+    built_at = models.DateTimeField(auto_now=True, verbose_name=_('Дата построения'))
+
+    class Meta:
+        verbose_name = "Индекс фильтров категории"
+        verbose_name_plural = "Индексы фильтров категорий"
+        unique_together = ('category', 'language')
+
+    def __str__(self):
+        return f"{self.category_id} [{self.language}]"
+
+
+class ProductDocument(models.Model):
+    """
+    Готовые данные продукта для ответов API на одном языке, без полей пользователя. is_stale ставится
+    в транзакции изменения и снимается пересборкой: помеченный документ не отдаётся.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='documents',
+                                verbose_name=_('Продукт'))
+    language = models.CharField(max_length=10, verbose_name=_('Язык'))
+    data = models.JSONField(default=dict, verbose_name=_('Документ'))
+    is_stale = models.BooleanField(default=False, verbose_name=_('Устарел'))
+    built_at = models.DateTimeField(auto_now=True, verbose_name=_('Дата построения'))
+
+    class Meta:
+        verbose_name = "Документ продукта"
+        verbose_name_plural = "Документы продуктов"
+        unique_together = ('product', 'language')
+
+    def __str__(self):
+        return f"{self.product_id} [{self.language}]"
+
+
+class ProductListing(models.Model):
+    """
+    Проекция продукта для списков и фильтров: итоговая цена, диапазон цен вариантов, остаток и id
+    размеров и цветов всех вариантов, включая распроданные (наличие — только stock_quantity и in_stock).
+    Обновляется сигналами Product и ProductSize, списки читают её без join'ов по вариантам и без DISTINCT.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='listing',
+                                   verbose_name=_('Продукт'))
+    is_active = models.BooleanField(default=True, verbose_name=_('Активный'))
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+', verbose_name=_('Категория'))
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name=_('Итоговая цена'))
+    min_variant_price = models.DecimalField(max_digits=10, decimal_places=2, null=True,
+                                            verbose_name=_('Минимальная цена варианта'))
+    max_variant_price = models.DecimalField(max_digits=10, decimal_places=2, null=True,
+                                            verbose_name=_('Максимальная цена варианта'))
+    variant_count = models.PositiveIntegerField(default=0, verbose_name=_('Количество вариантов'))
+    stock_quantity = models.PositiveIntegerField(default=0, verbose_name=_('Остаток'))
+    in_stock = models.BooleanField(default=False, verbose_name=_('В наличии'))
+    size_ids = ArrayField(models.IntegerField(), default=list, verbose_name=_('Размеры вариантов'))
+    color_ids = ArrayField(models.IntegerField(), default=list, verbose_name=_('Цвета вариантов'))
+
+    class Meta:
+        verbose_name = "Проекция продукта"
+        verbose_name_plural = "Проекции продуктов"
+        indexes = [
+            # Страница категории и фильтр по цене
+            models.Index(fields=['is_active', 'category', 'effective_price'], name='listing_category_price'),
+            # Поиск по всему каталогу: только активные в наличии, сортировка и фильтр по цене
+            models.Index(fields=['is_active', 'in_stock', 'effective_price'], name='listing_stock_price'),
+            GinIndex(fields=['size_ids'], name='listing_size_ids'),
+            GinIndex(fields=['color_ids'], name='listing_color_ids'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} - {self.effective_price}"
+
+
+class ProductRecommendation(models.Model):
+    """
+    Сосед продукта по совместным покупкам и избранному: строки пересчитывает задача
+    compute_recommendations, карточка продукта читает их по rank одним запросом.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations',
+                                verbose_name=_('Продукт'))
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+',
+                                    verbose_name=_('Рекомендуемый продукт'))
+    score = models.FloatField(verbose_name=_('Оценка'))
+    rank = models.PositiveSmallIntegerField(verbose_name=_('Место'))
+
+    class Meta:
+        verbose_name = "Рекомендация продукта"
+        verbose_name_plural = "Рекомендации продуктов"
+        unique_together = ('product', 'recommended')
+        indexes = [
+            models.Index(fields=['product', 'rank'], name='recommendation_product_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} ({self.score:.3f})"
+
+
+class RecommendationRun(models.Model):
+    """Запуск расчёта рекомендаций; последние id позиций заказов и избранного — граница для следующего запуска."""
+    started_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Начало'))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_('Окончание'))
+    is_full = models.BooleanField(default=True, verbose_name=_('Полный пересчёт'))
+    last_order_item_id = models.PositiveIntegerField(default=0, verbose_name=_('Последняя позиция заказа'))
+    last_favorite_id = models.PositiveIntegerField(default=0, verbose_name=_('Последнее избранное'))
+    product_count = models.PositiveIntegerField(default=0, verbose_name=_('Пересчитано продуктов'))
+
+    class Meta:
+        verbose_name = "Расчёт рекомендаций"
+        verbose_name_plural = "Расчёты рекомендаций"
+
+    def __str__(self):
+        return f"{self.started_at:%Y-%m-%d %H:%M} ({self.product_count})"
+
+
 class ReviewImage(models.Model):
     review = models.ForeignKey(Review, on_delete=models.CASCADE, related_name='images', verbose_name='Отзыв')
     image = models.ImageField(upload_to='review_images/', verbose_name='Изображение')
@@ -1,35 +1,274 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_save
 from django.dispatch import receiver
+from mptt.signals import node_moved
 
-from django.utils.translation import gettext_lazy as _
+from apps.product.models import (
+    Review, Product, ProductSize, ProductImage, Category, Color, Size, Country, Gender, Characteristic, ReviewImage,
+    SizeChart, Tag,
+)
+from apps.services.category_facets import (
+    PRODUCT_FACET_FIELDS,
+    invalidate_all_category_facets,
+    invalidate_category_facets,
+    invalidate_product_facets,
+)
+from apps.services.category_tree import invalidate_category_tree
+from apps.services.facet_engine import FACET_LISTING_FIELDS, facet_products_changed, invalidate_facet_index
+from apps.services.image_pipeline import schedule_image_processing, variants_ready
+from apps.services.listing_projection import LISTING_FIELDS, refresh_product_listings
+from apps.services.product_documents import schedule_document_rebuild
+from apps.services.product_sampling import POOL_FIELDS, invalidate_pools, invalidate_similar_pools
+from apps.services.product_search import SEARCH_FIELDS, update_search_vectors
+from apps.services.product_suggest import (
+    remove_category_suggestions,
+    remove_product_suggestions,
+    update_category_suggestions,
+    update_product_suggestions,
+)
+from apps.services.rating_stats import register_review, unregister_review, refresh_rating_stats
 
-from apps.product.models import Product
 
+def _touches_facets(update_fields):
+    return update_fields is None or bool(PRODUCT_FACET_FIELDS.intersection(update_fields))
+
+
+@receiver(post_save, sender=Review)
+def update_rating_stats_on_save(sender, instance, created, **kwargs):
+    if created:
+        register_review(instance)
+    else:
+        # Оценка или комментарий могли измениться — пересчитываем строку продукта целиком
+        refresh_rating_stats([instance.product_id])
+    invalidate_product_facets([instance.product_id])
 
-@receiver(post_save, sender=Product)
-def validate_product_images(sender, instance, **kwargs):
-    color_images = {}
 
-    for image in instance.product_images.all():
-        color = image.color
-        if color:
-            if color in color_images:
-                color_images[color].append(image)
-            else:
-                color_images[color] = [image]
+@receiver(post_delete, sender=Review)
+def update_rating_stats_on_delete(sender, instance, **kwargs):
+    unregister_review(instance)
+    invalidate_product_facets([instance.product_id])
 
-    missing_images = []
-    for product_size in instance.product_sizes.all():
-        color = product_size.color
-        if color not in color_images:
-            missing_images.append(color.name)
 
-    if missing_images:
-        # Сообщение об ошибке, которое будет отображено в админке
-        form.add_error(
-            None,
-            ValidationError(
-                _("Для следующих цветов должны быть загружены хотя бы одно изображение: %(colors)s."),
-                params={'colors': ', '.join(missing_images)}
-            )
+@receiver(pre_save, sender=Product)
+def remember_product_category(sender, instance, update_fields=None, **kwargs):
+    # Продукт может переехать в другую категорию — индекс старой тоже нужно сбросить
+    if instance.pk and _touches_facets(update_fields):
+        instance._previous_category_id = (
+            Product.objects.filter(pk=instance.pk).values_list('category_id', flat=True).first()
         )
+
+
+@receiver(post_save, sender=Product)
+def invalidate_facets_on_product_save(sender, instance, update_fields=None, **kwargs):
+    if _touches_facets(update_fields):
+        invalidate_category_facets({instance.category_id, getattr(instance, '_previous_category_id', None)})
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_facets_on_product_delete(sender, instance, **kwargs):
+    invalidate_category_facets([instance.category_id])
+
+
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+def invalidate_facets_on_variant_change(sender, instance, **kwargs):
+    invalidate_product_facets([instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+@receiver(post_save, sender=Color)
+@receiver(post_save, sender=Size)
+@receiver(post_save, sender=Country)
+@receiver(post_save, sender=Gender)
+def invalidate_facets_on_dictionary_change(sender, **kwargs):
+    # Структура дерева или названия значений фильтров меняются редко — сбрасываем весь индекс
+    invalidate_all_category_facets()
+
+
+@receiver(post_save, sender=Product)
+def update_search_vector_on_product_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or SEARCH_FIELDS.intersection(update_fields):
+        update_search_vectors(Product.objects.filter(pk=instance.pk))
+
+
+@receiver(post_save, sender=Characteristic)
+@receiver(post_delete, sender=Characteristic)
+def update_search_vector_on_characteristic_change(sender, instance, **kwargs):
+    update_search_vectors(Product.objects.filter(pk=instance.product_id))
+
+
+@receiver(post_save, sender=Product)
+def update_suggestions_on_product_save(sender, instance, **kwargs):
+    update_product_suggestions(instance)
+
+
+@receiver(post_delete, sender=Product)
+def update_suggestions_on_product_delete(sender, instance, **kwargs):
+    remove_product_suggestions(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def update_suggestions_on_category_save(sender, instance, **kwargs):
+    update_category_suggestions([instance.pk])
+
+
+@receiver(post_delete, sender=Category)
+def update_suggestions_on_category_delete(sender, instance, **kwargs):
+    remove_category_suggestions(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_pools_on_product_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or POOL_FIELDS.intersection(update_fields):
+        invalidate_pools()
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_pools_on_product_delete(sender, instance, **kwargs):
+    invalidate_pools()
+    invalidate_similar_pools([instance.pk])
+
+
+@receiver(m2m_changed, sender=Product.similar_products.through)
+def invalidate_similar_pools_on_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_similar_pools([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        # Изменение со стороны «на кого ссылаются»: затронуты пулы продуктов из pk_set
+        invalidate_similar_pools(pk_set)
+    elif action == 'pre_clear':
+        invalidate_similar_pools(list(Product.objects.filter(similar_products=instance).values_list('id', flat=True)))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+def schedule_image_variants(sender, instance, update_fields=None, **kwargs):
+    # Изменился ли файл на самом деле, конвейер проверит по хэшу содержимого
+    if update_fields is None or {'photo', 'image'}.intersection(update_fields):
+        schedule_image_processing(instance)
+
+
+# Справочник -> путь от продукта: изменение записи справочника меняет документы продуктов, которые на неё ссылаются
+DOCUMENT_DICTIONARIES = {
+    Category: 'category',
+    Country: 'country',
+    Gender: 'gender',
+    SizeChart: 'size_chart',
+    Tag: 'tags',
+    Color: 'product_sizes__color',
+    Size: 'product_sizes__size',
+}
+
+
+@receiver(post_save, sender=Product)
+def rebuild_document_on_product_save(sender, instance, update_fields=None, **kwargs):
+    # Счётчик просмотров в документ не входит
+    if update_fields is None or set(update_fields) - {'views_count'}:
+        schedule_document_rebuild([instance.pk])
+
+
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=Characteristic)
+@receiver(post_delete, sender=Characteristic)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def rebuild_document_on_related_change(sender, instance, **kwargs):
+    schedule_document_rebuild([instance.product_id])
+
+
+@receiver(post_save, sender=ReviewImage)
+@receiver(post_delete, sender=ReviewImage)
+def rebuild_document_on_review_image_change(sender, instance, **kwargs):
+    schedule_document_rebuild(Review.objects.filter(pk=instance.review_id).values_list('product_id', flat=True))
+
+
+@receiver(variants_ready, sender=Product)
+@receiver(variants_ready, sender=ProductImage)
+def rebuild_document_on_variants_ready(sender, instance, **kwargs):
+    schedule_document_rebuild([instance.pk if sender is Product else instance.product_id])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+def rebuild_document_on_tags_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        schedule_document_rebuild(pk_set if reverse else [instance.pk])
+    elif action == 'pre_clear' and reverse:
+        schedule_document_rebuild(instance.products.values_list('id', flat=True))
+    elif action == 'post_clear' and not reverse:
+        schedule_document_rebuild([instance.pk])
+
+
+def rebuild_documents_on_dictionary_change(sender, instance, **kwargs):
+    lookup = DOCUMENT_DICTIONARIES[sender]
+    schedule_document_rebuild(Product.objects.filter(**{lookup: instance}).values_list('id', flat=True).distinct())
+
+
+for _model in DOCUMENT_DICTIONARIES:
+    post_save.connect(rebuild_documents_on_dictionary_change, sender=_model,
+                      dispatch_uid=f'product_documents_{_model.__name__}')
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+def invalidate_category_tree_on_change(sender, **kwargs):
+    invalidate_category_tree()
+
+
+@receiver(post_save, sender=Product)
+def invalidate_category_tree_on_product_save(sender, instance, update_fields=None, **kwargs):
+    # В дереве есть только количество активных продуктов по категориям
+    if update_fields is None or {'category', 'is_active'}.intersection(update_fields):
+        invalidate_category_tree()
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_category_tree_on_product_delete(sender, instance, **kwargs):
+    invalidate_category_tree()
+
+
+@receiver(post_save, sender=Product)
+def refresh_listing_on_product_save(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is None or LISTING_FIELDS.intersection(update_fields):
+        facet_products_changed(refresh_product_listings([instance.pk], watch_fields=FACET_LISTING_FIELDS))
+
+
+@receiver(post_save, sender=ProductSize)
+@receiver(post_delete, sender=ProductSize)
+def refresh_listing_on_variant_change(sender, instance, origin=None, **kwargs):
+    # При каскадном удалении продукта (или его категории) проекция удаляется вместе с ним
+    if origin is None or getattr(origin, 'model', type(origin)) is ProductSize:
+        # Индекс фасетов меняется, только если продукт появился или закончился, а не при каждом изменении остатка
+        facet_products_changed(refresh_product_listings([instance.product_id], watch_fields=FACET_LISTING_FIELDS))
+
+
+@receiver(post_save, sender=Product)
+def update_facets_on_product_save(sender, instance, update_fields=None, **kwargs):
+    # Пол и страна не входят в проекцию
+    if update_fields is None or {'gender', 'country'}.intersection(update_fields):
+        facet_products_changed([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def update_facets_on_product_delete(sender, instance, **kwargs):
+    facet_products_changed([instance.pk])
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def update_facets_on_review_change(sender, instance, **kwargs):
+    facet_products_changed([instance.product_id])
+
+
+@receiver(post_save, sender=Color)
+@receiver(post_save, sender=Size)
+@receiver(post_save, sender=Country)
+@receiver(post_save, sender=Gender)
+def invalidate_facets_on_dictionary_rename(sender, **kwargs):
+    # Названия значений фасетов хранятся в индексе
+    invalidate_facet_index()
@@ -1,3 +1,1185 @@
-from django.test import TestCase
+import csv
+import json
+import shutil
+import tempfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import F, QuerySet
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from apps.authentication.models import User
+from apps.orders.models import Order, OrderItem
+from apps.pages.models import ContentVersion
+from apps.product.models import (
+    Category,
+    CategoryFacetIndex,
+    Characteristic,
+    Color,
+    Country,
+    FavoriteProduct,
+    Gender,
+    Product,
+    ProductDocument,
+    ProductImage,
+    ProductListing,
+    ProductRatingStats,
+    ProductRecommendation,
+    ProductSize,
+    Review,
+    ReviewImage,
+    Size,
+    Tag,
+)
+from apps.product.api.filters import ProductFilter
+from apps.services.catalog_sync import export_catalog, import_catalog
+from apps.services.category_facets import load_category_facets, rebuild_all_category_facets
+from apps.services.category_tree import category_choices, get_category_tree
+from apps.services.facet_engine import (
+    RangeIndex,
+    VERSION_DOMAIN,
+    facet_search,
+    get_facet_index,
+    iter_bitset,
+    match_products,
+    parse_selection,
+)
+from apps.services.image_encoding import available_formats
+from apps.services.image_pipeline import process_image_variants
+from apps.services import product_documents
+from apps.services.product_documents import build_product_documents
+from apps.services.product_listing import DETAIL_REVIEWS_LIMIT
+from apps.services.product_sampling import get_similar_pool
+from apps.services import product_suggest
+from apps.services.product_suggest import (
+    INDEX_TTL,
+    get_suggest_index,
+    remove_product_suggestions,
+    reset_suggest_indexes,
+)
+from apps.services.response_cache import response_cache_stats
+from apps.services.view_counter import flush_product_views, view_counter_stats
+from apps.services.rating_stats import STATS_FIELDS
+from apps.services.recommendations import compute_recommendations
+
+
+class ProductFixturesMixin:
+    @classmethod
+    def create_user(cls, phone_number):
+        # post_save пользователя синхронизирует его с Firestore
+        with mock.patch('apps.chat.signals.firestore'):
+            return User.objects.create_user(phone_number=phone_number, password='secret')
+
+    @classmethod
+    def create_catalog(cls, count, category=None, **product_kwargs):
+        category = category or Category.objects.create(name='Обувь')
+        country = Country.objects.create(name='Кыргызстан', logo='countries/kg.png')
+        color = Color.objects.create(name='Черный', hex_code='#000000')
+        size, _ = Size.objects.get_or_create(name='42')
+        tag = Tag.objects.create(name='Хит')
+        products = []
+        for index in range(count):
+            product = Product(
+                name=f'Товар {index}',
+                category=category,
+                country=country,
+                photo='product_photos/product.webp',
+                price=1000 + index,
+                **product_kwargs,
+            )
+            product.save()
+            product.tags.add(tag)
+            ProductSize.objects.create(product=product, color=color, size=size, quantity=5)
+            products.append(product)
+        return products
+
+
+class ProductListingQueryCountTests(ProductFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('+996700000001')
+        cls.products = cls.create_catalog(30, is_popular=True)
+        for product in cls.products[::2]:
+            Review.objects.create(user=cls.user, product=product, rating=4.0, comment='Отлично')
+            FavoriteProduct.objects.create(user=cls.user, product=product)
+
+    def count_queries(self, url, page_size):
+        # Оба замера — с пустым кэшем пулов случайной выдачи
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), page_size)
+        return len(context.captured_queries)
+
+    def test_popular_products_query_count_does_not_depend_on_page_size(self):
+        self.client.force_authenticate(self.user)
+        url = '/api/v1/products/popular/products/'
+        self.assertEqual(self.count_queries(url, 2), self.count_queries(url, 25))
+
+    def test_search_query_count_does_not_depend_on_page_size(self):
+        url = '/api/v1/products/product/search/'
+        self.assertEqual(self.count_queries(url, 2), self.count_queries(url, 25))
+
+    def test_listing_annotations_match_serializer_fallback(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.get('/api/v1/products/favorites/', {'page_size': 100})
+        self.assertEqual(response.status_code, 200)
+        for item in response.data['results']:
+            self.assertTrue(item['is_favorite'])
+            self.assertEqual(item['review_count'], 1)
+            self.assertEqual(item['average_rating'], 4)
+            self.assertFalse(item['is_ordered'])
+
+
+class ProductListingProjectionTests(ProductFixturesMixin, APITestCase):
+    url = '/api/v1/products/product/search/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cheap, cls.discounted, cls.sold_out = cls.create_catalog(3)
+        cls.discounted.discounted_price = 500
+        cls.discounted.save()
+        cls.black = Color.objects.get()
+        cls.white = Color.objects.create(name='Белый', hex_code='#FFFFFF')
+        cls.size_44 = Size.objects.create(name='44')
+        ProductSize.objects.create(product=cls.cheap, color=cls.white, size=cls.size_44, quantity=2, price=1200)
+        ProductSize.objects.filter(product=cls.sold_out).update(quantity=0)
+        cls.sold_out.product_sizes.get().save()
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url, {'page_size': 50, **params})
+        for query in context.captured_queries:
+            self.assertNotIn('DISTINCT', query['sql'])
+            self.assertNotIn('"product_productsize"', query['sql'])
+        return [item['id'] for item in response.data['results']]
+
+    def test_projection_follows_products_and_variants(self):
+        listing = ProductListing.objects.get(product=self.cheap)
+        self.assertEqual((listing.effective_price, listing.min_variant_price, listing.max_variant_price),
+                         (Decimal('1000.00'), Decimal('1000.00'), Decimal('1200.00')))
+        self.assertEqual((listing.variant_count, listing.stock_quantity, listing.in_stock), (2, 7, True))
+        self.assertEqual(sorted(listing.color_ids), sorted([self.black.id, self.white.id]))
+        self.assertEqual(ProductListing.objects.get(product=self.discounted).effective_price, Decimal('500.00'))
+        self.assertFalse(ProductListing.objects.get(product=self.sold_out).in_stock)
+
+        self.cheap.product_sizes.filter(size=self.size_44).get().delete()
+        listing.refresh_from_db()
+        self.assertEqual((listing.max_variant_price, listing.stock_quantity, listing.color_ids),
+                         (Decimal('1000.00'), 5, [self.black.id]))
+
+        self.sold_out.delete()
+        self.assertFalse(ProductListing.objects.filter(product_id=self.sold_out.id).exists())
+
+    def test_filters_and_ordering_read_the_projection(self):
+        self.assertCountEqual(self.search(), [self.cheap.id, self.discounted.id])
+        self.assertEqual(self.search(size='44'), [self.cheap.id])
+        self.assertCountEqual(self.search(color='Белый,Черный'), [self.cheap.id, self.discounted.id])
+        self.assertEqual(self.search(price_max=700), [self.discounted.id])
+        self.assertEqual(self.search(price_min=700), [self.cheap.id])
+        # Продукт без скидки сортируется по обычной цене, а не уходит в конец
+        self.assertEqual(self.search(ordering='discounted_price'), [self.discounted.id, self.cheap.id])
+        self.assertEqual(self.search(ordering='-discounted_price'), [self.cheap.id, self.discounted.id])
+
+    def test_sizes_and_colors_match_all_variants(self):
+        # Как прежний фильтр по product_sizes: распроданный вариант не убирает продукт из выдачи по размеру
+        variant = self.cheap.product_sizes.get(size=self.size_44)
+        variant.quantity = 0
+        variant.save()
+        listing = ProductListing.objects.get(product=self.cheap)
+        self.assertEqual((listing.stock_quantity, listing.in_stock), (5, True))
+        self.assertIn(self.size_44.id, listing.size_ids)
+        self.assertEqual(self.search(size='44'), [self.cheap.id])
+        self.assertEqual(self.search(color='Белый'), [self.cheap.id])
+
+
+class FacetEngineTests(ProductFixturesMixin, APITestCase):
+    url = '/api/v1/products/product/search/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = cls.create_catalog(6)
+        cls.black = Color.objects.get()
+        cls.white = Color.objects.create(name='Белый', hex_code='#FFFFFF')
+        cls.size_44 = Size.objects.create(name='44')
+        cls.men = Gender.objects.create(name='Мужской')
+        for product in cls.products[:3]:
+            ProductSize.objects.create(product=product, color=cls.white, size=cls.size_44, quantity=1)
+            product.gender = cls.men
+            product.save()
+        Review.objects.create(user=cls.create_user('+996700000009'), product=cls.products[0], rating=5, comment='')
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, use_facet_engine, language='ru', **params):
+        # Без ответов из кэша: оба пути должны выполниться
+        cache.clear()
+        with mock.patch.object(ProductFilter, 'use_facet_engine', use_facet_engine):
+            response = self.client.get(self.url, {'page_size': 50, **params}, HTTP_ACCEPT_LANGUAGE=language)
+        return sorted(item['id'] for item in response.data['results'])
+
+    def test_engine_matches_sql_filters(self):
+        ids = [product.id for product in self.products]
+        for params in ({'size': '44'}, {'size': '42,44', 'color': 'Белый'}, {'gender': 'Мужской', 'price_max': 1001},
+                       {'country': 'кыргыз', 'price_min': 1002}, {'rating_min': '4,5'}, {'category': 'Обувь'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.search(True, **params), self.search(False, **params))
+        self.assertEqual(self.search(True, size='44', color='Белый'), ids[:3])
+
+    def test_names_are_matched_by_the_same_rules_on_both_paths(self):
+        # Регистр, подстрока страны и пустой перевод (название языка по умолчанию) — одинаково в индексе и SQL
+        Color.objects.filter(id=self.white.id).update(name_en='White')
+        cases = [
+            ('ru', {'color': 'белый', 'gender': 'МУЖСКОЙ'}, 3),
+            ('ru', {'country': 'КЫРГЫЗ'}, 6),
+            ('ru', {'category': 'обувь'}, 0),
+            ('en', {'category': 'Обувь', 'color': 'white'}, 3),
+            ('en', {'country': 'кыргыз', 'size': '44'}, 3),
+        ]
+        for language, params, count in cases:
+            with self.subTest(language=language, params=params):
+                found = self.search(True, language, **params)
+                self.assertEqual(len(found), count)
+                self.assertEqual(found, self.search(False, language, **params))
+
+    def test_counts_exclude_own_facet(self):
+        matched, facets = facet_search(parse_selection({'size': '44', 'in_stock': True}))
+        self.assertEqual(matched.bit_count(), 3)
+        sizes = {item['name']: item['label'] for item in facets['sizes']}
+        self.assertEqual(sizes, {'42': '42 (6)', '44': '44 (3)'})
+        self.assertEqual({item['name']: item['count'] for item in facets['colors']}, {'Белый': 3, 'Черный': 3})
+
+        response = self.client.get('/api/v1/products/product/facets/', {'gender': 'Мужской'})
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual([item['label'] for item in response.data['facets']['genders']], ['Мужской (3)'])
+
+    def test_index_is_updated_incrementally(self):
+        index = get_facet_index()
+        variant = ProductSize.objects.get(product=self.products[0], size=self.size_44)
+        with self.captureOnCommitCallbacks(execute=True):
+            variant.delete()
+        self.assertIs(get_facet_index(), index)
+        self.assertEqual(list(iter_bitset(match_products(parse_selection({'size': '44'})))),
+                         [product.id for product in self.products[1:3]])
+
+        # Изменение остатка без перехода через ноль индекс не трогает
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            ProductSize.objects.filter(product=self.products[1], size=self.size_44).get().save()
+        self.assertFalse([callback for callback in callbacks if callback.__module__ == 'apps.services.facet_engine'])
+
+    def test_index_follows_version_from_other_processes(self):
+        index = get_facet_index()
+        # Другой процесс со своим кэшем меняет только строку версии в базе
+        ContentVersion.objects.filter(domain=VERSION_DOMAIN).update(version=F('version') + 1)
+        self.assertIs(get_facet_index(), index)
+        # Закэшированная версия истекла — индекс строится заново
+        cache.clear()
+        self.assertIsNot(get_facet_index(), index)
+
+    def test_range_index_blocks(self):
+        values = {product_id: Decimal(product_id % 7) for product_id in range(1, 200)}
+        with mock.patch('apps.services.facet_engine.RANGE_BLOCK', 8):
+            index = RangeIndex(values)
+        for low, high in ((None, Decimal(3)), (Decimal(2), Decimal(5)), (Decimal(6), None), (Decimal(8), None)):
+            expected = [key for key, value in values.items()
+                        if (low is None or value >= low) and (high is None or value <= high)]
+            self.assertEqual(list(iter_bitset(index.between(low, high))), expected)
+
+
+class ProductRatingStatsTests(ProductFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('+996700000002')
+        cls.product, = cls.create_catalog(1)
+
+    def assertStatsMatchRebuild(self):
+        stats = ProductRatingStats.objects.get(product=self.product)
+        incremental = {field: getattr(stats, field) for field in STATS_FIELDS}
+        call_command('rebuild_rating_stats', batch_size=1, stdout=StringIO())
+        stats.refresh_from_db()
+        self.assertEqual(incremental, {field: getattr(stats, field) for field in STATS_FIELDS})
+
+    def test_stats_follow_review_create_update_and_delete(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/v1/products/reviews/create/',
+                                    {'product': self.product.id, 'rating': 5.0, 'comment': 'Отлично'})
+        self.assertEqual(response.status_code, 201)
+        Review.objects.create(user=self.user, product=self.product, rating=2.0, comment='')
+        stats = ProductRatingStats.objects.get(product=self.product)
+        self.assertEqual((stats.review_count, stats.commented_review_count), (2, 1))
+        self.assertEqual((stats.rating_2, stats.rating_5, stats.average_rating), (1, 1, 3.5))
+        self.assertStatsMatchRebuild()
+
+        review = Review.objects.get(rating=2.0)
+        review.rating = 4.0
+        review.save()
+        self.assertStatsMatchRebuild()
+
+        response = self.client.delete(f'/api/v1/products/reviews/{review.id}/')
+        self.assertEqual(response.status_code, 200)
+        stats.refresh_from_db()
+        self.assertEqual((stats.review_count, stats.rating_4, stats.average_rating), (1, 0, 5.0))
+        self.assertStatsMatchRebuild()
+
+        Review.objects.filter(product=self.product).delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.review_count, stats.rating_sum, stats.average_rating), (0, 0.0, 0.0))
+
+
+class CategoryFacetIndexTests(ProductFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = Category.objects.create(name='Одежда')
+        cls.child = Category.objects.create(name='Куртки', parent=cls.root)
+        cls.grandchild = Category.objects.create(name='Парки', parent=cls.child)
+        cls.root_products = cls.create_catalog(2, category=cls.root)
+        cls.grandchild_products = cls.create_catalog(3, category=cls.grandchild, discounted_price=500)
+
+    def categories(self):
+        return Category.objects.get(pk=self.root.pk).get_descendants(include_self=True)
+
+    def test_facets_cover_whole_subtree(self):
+        facets = load_category_facets(self.categories())
+        self.assertEqual(facets[self.root.id]['product_count'], 5)
+        self.assertEqual(facets[self.child.id]['product_count'], 3)
+        self.assertEqual(facets[self.child.id]['counts']['sizes'], {'42': 3})
+        self.assertEqual(facets[self.child.id]['price_min'], 500.0)
+        self.assertEqual(facets[self.root.id]['price_max'], 500.0)
+
+    def test_stored_facets_are_read_in_one_query(self):
+        categories = list(self.categories())
+        # Чтение ничего не пишет — индекс строит пересборка на пути записи
+        load_category_facets(categories)
+        self.assertFalse(CategoryFacetIndex.objects.exists())
+        rebuild_all_category_facets()
+        with self.assertNumQueries(1):
+            facets = load_category_facets(categories)
+        self.assertEqual(facets[self.root.id]['product_count'], 5)
+
+    def test_variant_change_invalidates_ancestors_only(self):
+        sibling = Category.objects.create(name='Платья', parent=self.root)
+        new_size = Size.objects.create(name='44')
+        rebuild_all_category_facets()
+        variant = ProductSize.objects.filter(product=self.grandchild_products[0]).first()
+        variant.size = new_size
+        with mock.patch('apps.services.category_facets._enqueue') as enqueue:
+            with self.captureOnCommitCallbacks(execute=True):
+                variant.save()
+            enqueue.assert_called_with({self.root.tree_id})
+            self.assertEqual(
+                set(CategoryFacetIndex.objects.filter(is_stale=False).values_list('category_id', flat=True)),
+                {sibling.id}
+            )
+            facets = load_category_facets(self.categories())
+        self.assertEqual(facets[self.grandchild.id]['counts']['sizes'], {'42': 2, '44': 1})
+
+    def test_stale_rows_survive_lost_rebuild(self):
+        rebuild_all_category_facets()
+        # Пересборка из очереди процесса потеряна (перезапуск): пометка осталась в базе
+        with mock.patch('apps.services.category_facets._enqueue') as enqueue:
+            with self.captureOnCommitCallbacks(execute=False):
+                product = self.grandchild_products[0]
+                product.is_active = False
+                product.save()
+            facets = load_category_facets(self.categories())
+            self.assertEqual(facets[self.child.id]['product_count'], 2)
+            # Чтение не пишет, но ставит пересборку в фон
+            enqueue.assert_called_once_with({self.root.tree_id})
+
+        call_command('rebuild_category_facets', stale=True, stdout=StringIO())
+        self.assertFalse(CategoryFacetIndex.objects.filter(is_stale=True).exists())
+        categories = list(self.categories())
+        with self.assertNumQueries(1):
+            facets = load_category_facets(categories)
+        self.assertEqual(facets[self.child.id]['product_count'], 2)
+
+
+class CategoryProductListTests(ProductFixturesMixin, APITestCase):
+    def build_chain(self, root, depth):
+        parent = root
+        for level in range(depth):
+            parent = Category.objects.create(name=f'{root.name} {level}', parent=parent)
+            self.create_catalog(2, category=parent)
+        return parent
+
+    def fetch(self, category, **params):
+        response = self.client.get(f'/api/v1/products/category/{category.slug}/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def count_queries(self, category):
+        self.fetch(category)  # прогреваем индекс фильтров
+        cache.clear()  # считаем построение ответа, а не чтение готового из кэша
+        with CaptureQueriesContext(connection) as context:
+            self.fetch(category)
+        return len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_tree_size(self):
+        shallow = Category.objects.create(name='Сумки')
+        self.build_chain(shallow, 1)
+        deep = Category.objects.create(name='Обувь')
+        self.build_chain(deep, 5)
+        self.assertEqual(self.count_queries(shallow), self.count_queries(deep))
+
+    def test_products_are_grouped_through_the_whole_subtree(self):
+        root = Category.objects.create(name='Аксессуары')
+        leaf = self.build_chain(root, 3)
+        data = self.fetch(root, ordering='-views_count')
+        self.assertEqual(data['products'], [])
+        node, depth = data, 0
+        while node['subcategories']:
+            node, depth = node['subcategories'][0], depth + 1
+            self.assertEqual(len(node['products']), 2)
+        self.assertEqual((depth, node['id']), (3, leaf.id))
+        self.assertEqual(data['filters']['product_count'], 6)
+
+
+class ProductSearchTests(ProductFixturesMixin, APITestCase):
+    url = '/api/v1/products/product/search/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.boots, cls.sneakers, cls.sandals = cls.create_catalog(3)
+        cls.boots.name_ru, cls.boots.name_en, cls.boots.article = 'Ботинки зимние', 'Winter boots', '100200'
+        cls.boots.save()
+        cls.sneakers.name_ru, cls.sneakers.name_en, cls.sneakers.article = 'Кроссовки беговые', 'Running sneakers', '300400'
+        cls.sneakers.description_ru = 'Легкие кроссовки для бега'
+        cls.sneakers.save()
+        cls.sandals.name_ru, cls.sandals.name_en, cls.sandals.article = 'Сандалии', 'Sandals', '100900'
+        cls.sandals.description_ru = 'Подходят к кроссовкам'
+        cls.sandals.save()
+        Characteristic.objects.create(product=cls.boots, name='Материал', value='Замша')
+
+    def search(self, text, **params):
+        response = self.client.get(self.url, {'name': text, **params})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('кроссовки'), [self.sneakers.id, self.sandals.id])
+
+    def test_prefix_and_typo_tolerance(self):
+        self.assertEqual(self.search('крос'), [self.sneakers.id, self.sandals.id])
+        self.assertIn(self.sneakers.id, self.search('кросовки'))
+
+    def test_translated_names_and_characteristics_are_searchable(self):
+        self.assertEqual(self.search('sneakers'), [self.sneakers.id])
+        self.assertEqual(self.search('замша'), [self.boots.id])
+
+    def test_article_number_uses_prefix_lookup(self):
+        self.assertEqual(sorted(self.search('100')), [self.boots.id, self.sandals.id])
+        self.assertEqual(self.search('300400'), [self.sneakers.id])
+
+    def test_filters_apply_on_top_of_search(self):
+        self.assertEqual(self.search('кроссовки', price_max=self.sneakers.price), [self.sneakers.id])
+
+    def test_vector_follows_product_updates(self):
+        self.boots.name_ru = 'Туфли'
+        self.boots.save(update_fields=['name_ru'])
+        self.assertEqual(self.search('туфли'), [self.boots.id])
+        self.assertEqual(self.search('ботинки'), [])
+
+
+class ProductSuggestTests(ProductFixturesMixin, APITestCase):
+    url = '/api/v1/products/suggest/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Кроссовки', name_en='Sneakers')
+        cls.running, cls.casual, cls.boots = cls.create_catalog(3, category=cls.category)
+        for product, name_ru, name_en, article, views in (
+            (cls.running, 'Беговые кроссовки', 'Running sneakers', '555001', 10),
+            (cls.casual, 'Кроссовки городские', 'City sneakers', '555002', 50),
+            (cls.boots, 'Ботинки', 'Boots', '777001', 100),
+        ):
+            product.name_ru, product.name_en, product.article, product.views_count = name_ru, name_en, article, views
+            product.save()
+
+    def setUp(self):
+        reset_suggest_indexes()
+        self.addCleanup(reset_suggest_indexes)
+
+    def suggest(self, q, language='ru', **params):
+        response = self.client.get(self.url, {'q': q, **params}, HTTP_ACCEPT_LANGUAGE=language)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_prefix_of_any_word_ranked_by_views(self):
+        data = self.suggest('кро')
+        self.assertEqual([item['id'] for item in data['products']], [self.casual.id, self.running.id])
+        self.assertEqual([item['id'] for item in data['categories']], [self.category.id])
+        self.assertEqual(data['articles'], [])
+
+    def test_popularity_and_limit(self):
+        self.running.is_popular = True
+        self.running.save()
+        data = self.suggest('кро', limit=1)
+        self.assertEqual([item['name'] for item in data['products']], ['Беговые кроссовки'])
+
+    def test_articles_and_language(self):
+        data = self.suggest('555', language='en')
+        self.assertEqual([item['article'] for item in data['articles']], ['555002', '555001'])
+        data = self.suggest('sne', language='en')
+        self.assertEqual([item['name'] for item in data['products']], ['City sneakers', 'Running sneakers'])
+        self.assertEqual([item['name'] for item in data['categories']], ['Sneakers'])
+
+    def test_index_is_updated_incrementally(self):
+        self.suggest('кро')
+        self.casual.is_active = False
+        self.casual.save()
+        self.boots.name_ru = 'Кроссовки зимние'
+        self.boots.save()
+        with CaptureQueriesContext(connection) as context:
+            data = self.suggest('кро')
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual([item['id'] for item in data['products']], [self.boots.id, self.running.id])
+
+    def test_expired_index_is_refreshed_in_background(self):
+        index = get_suggest_index('ru')
+        index.built_at -= INDEX_TTL + 1
+        with mock.patch.object(product_suggest._refresher, 'submit') as submit:
+            with CaptureQueriesContext(connection) as context:
+                data = self.suggest('кро')
+                self.suggest('бот')
+            # Запросы отвечают из прежнего индекса и не ждут сборки; сборка запланирована один раз
+            self.assertEqual(len(context.captured_queries), 0)
+            self.assertEqual([item['id'] for item in data['products']], [self.casual.id, self.running.id])
+            submit.assert_called_once_with(product_suggest._refresh, 'ru')
+
+        # Изменение, пришедшее во время сборки, попадает и в новый индекс
+        remove_product_suggestions(self.casual.id)
+        with mock.patch.object(product_suggest, 'close_old_connections'):
+            product_suggest._refresh('ru')
+        self.assertIsNot(get_suggest_index('ru'), index)
+        self.assertEqual([item['id'] for item in self.suggest('кро')['products']], [self.running.id])
+
+
+class RandomProductFeedTests(ProductFixturesMixin, APITestCase):
+    url = '/api/v1/products/popular/products/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = cls.create_catalog(12, is_popular=True)
+        build_product_documents([product.id for product in cls.products])
+
+    def setUp(self):
+        cache.clear()
+
+    def fetch(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_pages_with_one_seed_are_stable_and_disjoint(self):
+        first = self.fetch(page_size=5)
+        self.assertIn(f"seed={first['seed']}", first['next'])
+        pages = [self.fetch(page_size=5, page=page, seed=first['seed'])['results'] for page in (1, 2, 3)]
+        ids = [item['id'] for page in pages for item in page]
+        self.assertEqual([item['id'] for item in first['results']], ids[:5])
+        self.assertEqual(sorted(ids), sorted(product.id for product in self.products))
+        self.assertEqual(first['count'], 12)
+
+    def test_page_is_loaded_by_id_without_sorting_the_table(self):
+        self.fetch(page_size=5, seed=1)
+        with CaptureQueriesContext(connection) as context:
+            # Другая страница: пул уже в кэше, а готового ответа для неё нет
+            self.fetch(page_size=5, seed=1, page=2)
+        product_queries = [query['sql'] for query in context.captured_queries if 'FROM "product_product"' in query['sql']]
+        self.assertEqual(len(product_queries), 1)
+        self.assertNotIn('RANDOM()', product_queries[0])
+
+    def test_pool_follows_product_changes(self):
+        self.fetch(seed=1)
+        product = self.products[0]
+        product.is_popular = False
+        product.save()
+        data = self.fetch(page_size=20, seed=1)
+        self.assertEqual(data['count'], 11)
+        self.assertNotIn(product.id, [item['id'] for item in data['results']])
+
+    def test_similar_products_are_sampled_from_pool(self):
+        product = self.products[0]
+        product.similar_products.set(self.products[1:4])
+        response = self.client.get(f'/api/v1/products/product/{product.id}/')
+        self.assertEqual({item['id'] for item in response.data['similar_products']},
+                         {similar.id for similar in self.products[1:4]})
+        product.similar_products.remove(self.products[1])
+        response = self.client.get(f'/api/v1/products/product/{product.id}/')
+        self.assertEqual({item['id'] for item in response.data['similar_products']},
+                         {similar.id for similar in self.products[2:4]})
+
+
+class ProductRecommendationTests(ProductFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = cls.create_catalog(7)
+        cls.first, cls.second, cls.third, cls.fourth, cls.fifth, cls.sixth, cls.lonely = cls.products
+        cls.buyer = cls.create_user('+996700000011')
+        cls.fan = cls.create_user('+996700000012')
+        cls.place_order([cls.first, cls.second])
+        cls.place_order([cls.first, cls.second])
+        cls.place_order([cls.first, cls.third, cls.fourth])
+        cls.place_order([cls.first, cls.sixth], order_status='cancelled')
+        FavoriteProduct.objects.create(user=cls.fan, product=cls.fourth)
+        FavoriteProduct.objects.create(user=cls.fan, product=cls.fifth)
+
+    @classmethod
+    def place_order(cls, products, **kwargs):
+        order = Order.objects.create(user=cls.buyer, **kwargs)
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product_size=product.product_sizes.get(), quantity=1, total_amount=product.price)
+            for product in products
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def neighbours(self, product):
+        return list(product.recommendations.order_by('rank').values_list('recommended_id', flat=True))
+
+    def similar(self, product):
+        response = self.client.get(f'/api/v1/products/product/{product.id}/')
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['similar_products']]
+
+    def test_neighbours_are_ranked_by_co_occurrence(self):
+        run = compute_recommendations()
+        self.assertTrue(run.is_full)
+        # Два общих заказа с вторым, по одному с третьим и четвёртым; отменённый заказ не учитывается
+        self.assertEqual(self.neighbours(self.first), [self.second.id, self.third.id, self.fourth.id])
+        self.assertEqual(self.neighbours(self.fifth), [self.fourth.id])
+        self.assertEqual(self.neighbours(self.sixth), [])
+        self.assertEqual(self.similar(self.first), [self.second.id, self.third.id, self.fourth.id])
+
+    def test_similar_products_fall_back_to_curated_and_category(self):
+        compute_recommendations()
+        self.sixth.similar_products.set([self.second])
+        self.assertEqual(self.similar(self.sixth), [self.second.id])
+        self.assertCountEqual(self.similar(self.lonely), [product.id for product in self.products[:-1]])
+
+    def test_incremental_run_recomputes_only_changed_baskets(self):
+        compute_recommendations()
+        self.similar(self.fifth)
+        self.place_order([self.fifth, self.second])
+        run = compute_recommendations()
+        self.assertFalse(run.is_full)
+        self.assertEqual(run.product_count, 2)
+        self.assertEqual(self.neighbours(self.fifth), [self.second.id, self.fourth.id])
+        self.assertEqual(self.neighbours(self.first), [self.second.id, self.third.id, self.fourth.id])
+        # Кэшированный пул сброшен вместе с пересчётом
+        self.assertEqual(self.similar(self.fifth), [self.second.id, self.fourth.id])
+        self.assertEqual(compute_recommendations().product_count, 0)
+
+
+class ResponseCacheTests(ProductFixturesMixin, APITestCase):
+    url = '/api/v1/products/product/search/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = cls.create_catalog(3)
+
+    def setUp(self):
+        cache.clear()
+        flush_product_views()
+
+    def get(self, url=None, language='ru', **params):
+        response = self.client.get(url or self.url, params, HTTP_ACCEPT_LANGUAGE=language)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_repeated_anonymous_request_is_served_without_queries(self):
+        first = self.get(ordering='-views_count')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as context:
+            second = self.get(ordering='-views_count')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(len(context.captured_queries), 0)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.get(language='en', ordering='-views_count')['X-Cache'], 'MISS')
+        self.assertEqual(response_cache_stats(['ProductSearchView']), {'ProductSearchView': {'hit': 1, 'miss': 2}})
+
+    def test_save_evicts_tagged_responses(self):
+        self.get()
+        product = self.products[0]
+        product.name = 'Кроссовки'
+        product.save()
+        response = self.get()
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn('Кроссовки', [item['name'] for item in response.json()['results']])
+
+        size = ProductSize.objects.filter(product=product).first()
+        size.quantity = 0
+        size.save()
+        self.assertNotIn(product.id, [item['id'] for item in self.get().json()['results']])
+
+    def test_user_dependent_views_bypass_cache_for_authenticated(self):
+        self.client.force_authenticate(self.create_user('+996700000003'))
+        self.get()
+        self.assertNotIn('X-Cache', self.get())
+        self.assertEqual(self.get('/api/v1/products/categories/only/')['X-Cache'], 'MISS')
+
+    def test_cached_detail_still_counts_views(self):
+        url = f'/api/v1/products/product/{self.products[0].id}/'
+        self.get(url)
+        self.assertEqual(self.get(url)['X-Cache'], 'HIT')
+        self.assertEqual(view_counter_stats()['pending_views'], 2)
+
+
+class ProductDetailQueryCountTests(ProductFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product, *cls.others = cls.create_catalog(4)
+        cls.product.similar_products.set(cls.others)
+        cls.color = Color.objects.get()
+        Characteristic.objects.create(product=cls.product, name='Материал', value='Кожа')
+        cls.user = cls.create_user('+996700000004')
+
+    def setUp(self):
+        cache.clear()
+
+    def add_details(self, sizes, reviews):
+        for index in range(sizes):
+            size, _ = Size.objects.get_or_create(name=str(36 + index))
+            ProductSize.objects.create(product=self.product, color=self.color, size=size, quantity=1)
+            ProductImage.objects.create(product=self.product, color=self.color, image=f'product_images/{index}.webp')
+        for index in range(reviews):
+            review = Review.objects.create(product=self.product, user=self.user, rating=5, comment=f'Отзыв {index}')
+            ReviewImage.objects.create(review=review, image=f'review_images/{index}.webp')
+        build_product_documents([self.product.id, *(other.id for other in self.others)])
+
+    def count_queries(self):
+        cache.clear()
+        get_similar_pool(self.product)  # пул похожих живёт в кэше и в бюджет карточки не входит
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/v1/products/product/{self.product.id}/')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.data
+
+    def test_query_count_is_fixed(self):
+        self.add_details(sizes=1, reviews=1)
+        queries, _ = self.count_queries()
+        self.add_details(sizes=5, reviews=15)
+        self.assertEqual(self.count_queries()[0], queries)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.count_queries()[0], queries)
+        # Продукт с флагами пользователя, его документ, похожие продукты и их документы
+        self.assertEqual(queries, 4)
+
+    def test_embedded_reviews_are_capped_and_sizes_show_color_images(self):
+        self.add_details(sizes=2, reviews=DETAIL_REVIEWS_LIMIT + 5)
+        _, data = self.count_queries()
+        self.assertEqual(len(data['reviews']), DETAIL_REVIEWS_LIMIT)
+        self.assertEqual(data['reviews'][0]['comment'], f'Отзыв {DETAIL_REVIEWS_LIMIT + 4}')
+        self.assertEqual(len(data['reviews'][0]['images']), 1)
+        self.assertTrue(data['reviews_url'].endswith(f'/api/v1/products/{self.product.id}/reviews/'))
+        self.assertEqual(len(data['product_sizes'][0]['images']), 2)
+
+        response = self.client.get(data['reviews_url'])
+        self.assertEqual(response.data['reviews']['count'], DETAIL_REVIEWS_LIMIT + 5)
+
+
+class ProductDocumentTests(ProductFixturesMixin, APITestCase):
+    url = '/api/v1/products/product/search/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = cls.create_catalog(3)
+        cls.products[0].name_en = 'Sneakers'
+        cls.products[0].save()
+        cls.user = cls.create_user('+996700000005')
+        FavoriteProduct.objects.create(user=cls.user, product=cls.products[1])
+
+    def setUp(self):
+        cache.clear()
+
+    def fetch(self, url=None, language='ru'):
+        cache.clear()
+        response = self.client.get(url or self.url, HTTP_ACCEPT_LANGUAGE=language)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_documents_give_the_same_responses_as_serializers(self):
+        detail_url = f'/api/v1/products/product/{self.products[0].id}/'
+        self.client.force_authenticate(self.user)
+        expected = [self.fetch(), self.fetch(language='en'), self.fetch(detail_url)]
+        self.assertEqual(build_product_documents([product.id for product in self.products]), 3)
+        self.assertEqual(ProductDocument.objects.count(), 9)
+
+        with CaptureQueriesContext(connection) as context:
+            actual = [self.fetch(), self.fetch(language='en'), self.fetch(detail_url)]
+        self.assertEqual(actual, expected)
+        # Размеры, характеристики и отзывы не читаются — они в документах
+        self.assertFalse([query for query in context.captured_queries
+                          if query['sql'].startswith(('SELECT "product_productsize"', 'SELECT "product_characteristic"',
+                                                      'SELECT "product_review"'))])
+        self.assertIn('Sneakers', [item['name'] for item in actual[1]['results']])
+        self.assertEqual({item['id'] for item in actual[0]['results'] if item['is_favorite']}, {self.products[1].id})
+
+    def test_changes_rebuild_documents_in_background(self):
+        build_product_documents([self.products[0].id])
+        # Фоновый поток заменяем синхронным вызовом, чтобы сборка шла в транзакции теста
+        with mock.patch.object(product_documents._dispatcher, 'submit', side_effect=lambda task: task()), \
+                mock.patch.object(product_documents, 'close_old_connections'), \
+                self.captureOnCommitCallbacks(execute=True):
+            Characteristic.objects.create(product=self.products[0], name='Материал', value='Кожа')
+            self.products[0].tags.first().save()
+        document = ProductDocument.objects.get(product=self.products[0], language='ru')
+        self.assertEqual(document.data['characteristics'], [{'name': 'Материал', 'value': 'Кожа'}])
+        self.assertEqual(ProductDocument.objects.filter(language='ru').count(), 3)
+
+    def test_stale_documents_are_not_served_after_lost_rebuild(self):
+        build_product_documents([product.id for product in self.products])
+        product = self.products[0]
+        detail_url = f'/api/v1/products/product/{product.id}/'
+        # Пересборка из очереди процесса потеряна (перезапуск): пометка осталась в базе
+        with mock.patch.object(product_documents, '_enqueue') as enqueue:
+            with self.captureOnCommitCallbacks(execute=False):
+                product.price = 777
+                product.save()
+            self.assertEqual(ProductDocument.objects.filter(product=product, is_stale=True).count(), 3)
+            self.assertEqual(float(self.fetch(detail_url)['price']), 777)
+            enqueue.assert_called_with({product.id})
+
+        call_command('rebuild_product_documents', stale=True, stdout=StringIO())
+        self.assertFalse(ProductDocument.objects.filter(is_stale=True).exists())
+        self.assertEqual(float(ProductDocument.objects.get(product=product, language='ru').data['price']), 777)
+
+    def test_rebuild_command(self):
+        out = StringIO()
+        call_command('rebuild_product_documents', workers=0, batch_size=2, stdout=out)
+        self.assertIn('3/3', out.getvalue())
+        self.assertEqual(ProductDocument.objects.count(), 9)
+
+
+class CategoryTreeTests(ProductFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Обувь', name_en='Shoes')
+        cls.sneakers = Category.objects.create(name='Кроссовки', parent=cls.shoes, is_promoted=True)
+        cls.running = Category.objects.create(name='Беговые', parent=cls.sneakers)
+        cls.bags = Category.objects.create(name='Сумки')
+        cls.create_catalog(2, category=cls.running)
+        cls.create_catalog(1, category=cls.shoes)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_tree_is_built_with_two_queries_and_cached(self):
+        with CaptureQueriesContext(connection) as context:
+            tree = get_category_tree()
+        self.assertEqual(len(context.captured_queries), 2)
+        with CaptureQueriesContext(connection) as context:
+            get_category_tree()
+        self.assertEqual(len(context.captured_queries), 0)
+
+        shoes = next(node for node in tree if node['id'] == self.shoes.id)
+        self.assertEqual(shoes['product_count'], 3)
+        self.assertEqual(shoes['subcategories'][0]['product_count'], 2)
+        self.assertEqual(shoes['subcategories'][0]['subcategories'][0]['id'], self.running.id)
+        self.assertEqual(get_category_tree('en')[[node['id'] for node in tree].index(self.shoes.id)]['name'], 'Shoes')
+
+    def test_endpoints_use_the_tree(self):
+        data = self.client.get('/api/v1/products/categories/only/').json()
+        self.assertEqual([node['name'] for node in data], ['Обувь', 'Сумки'])
+        self.assertEqual(set(data[0]), {'id', 'name', 'description', 'slug', 'image', 'product_count', 'subcategories'})
+        promoted = self.client.get('/api/v1/products/promoted-categories/').json()
+        self.assertEqual([node['id'] for node in promoted['results']], [self.sneakers.id])
+        self.assertEqual(promoted['results'][0]['subcategories'][0]['id'], self.running.id)
+
+    def test_tree_follows_moves_and_product_changes(self):
+        get_category_tree()
+        self.running.move_to(self.bags)
+        Product.objects.filter(category=self.shoes).get().delete()
+        tree = {node['id']: node for node in get_category_tree()}
+        self.assertEqual(tree[self.shoes.id]['product_count'], 0)
+        self.assertEqual(tree[self.bags.id]['product_count'], 2)
+        self.assertEqual(tree[self.bags.id]['subcategories'][0]['id'], self.running.id)
+
+    def test_product_changes_refresh_cached_counts_and_etag(self):
+        url = '/api/v1/products/categories/only/'
+        response = self.client.get(url)
+        self.assertEqual(response.data[0]['product_count'], 3)
+        product = Product.objects.filter(category=self.shoes).get()
+        with mock.patch('apps.services.product_documents._enqueue'), \
+                mock.patch('apps.services.category_facets._enqueue'), \
+                self.captureOnCommitCallbacks(execute=True):
+            product.is_active = False
+            product.save()
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['product_count'], 2)
+        promoted = self.client.get('/api/v1/products/promoted-categories/').json()
+        self.assertEqual(promoted['results'][0]['product_count'], 2)
+
+    def test_admin_choices_are_indented_in_tree_order(self):
+        labels = [label for _, label in category_choices()]
+        self.assertEqual(labels[:3], ['Обувь', '\u00a0' * 4 + 'Кроссовки', '\u00a0' * 8 + 'Беговые'])
+
+
+class ProductViewCounterTests(ProductFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.first, cls.second = cls.create_catalog(2)
+
+    def setUp(self):
+        flush_product_views()
+
+    def test_detail_requests_are_read_only_and_views_are_flushed_in_batches(self):
+        with CaptureQueriesContext(connection) as context:
+            for _ in range(3):
+                self.client.get(f'/api/v1/products/product/{self.first.id}/')
+            self.client.get(f'/api/v1/products/products/{self.second.slug}/')
+        self.assertFalse([query for query in context.captured_queries if query['sql'].startswith('UPDATE')])
+        self.assertEqual(view_counter_stats()['pending_views'], 4)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(flush_product_views(), 4)
+        self.assertEqual(len([query for query in context.captured_queries if query['sql'].startswith('UPDATE')]), 2)
+
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.views_count, self.second.views_count), (3, 1))
+        self.assertEqual(view_counter_stats()['pending_views'], 0)
+
+    def test_views_of_deleted_products_are_counted_as_dropped(self):
+        dropped = view_counter_stats()['dropped_views']
+        self.client.get(f'/api/v1/products/product/{self.first.id}/')
+        self.client.get(f'/api/v1/products/product/{self.second.id}/')
+        self.second.delete()
+        with self.assertLogs('apps.services.view_counter', 'WARNING'):
+            self.assertEqual(flush_product_views(), 1)
+        self.assertEqual(view_counter_stats()['dropped_views'], dropped + 1)
+
+    def test_failed_flush_is_rolled_back_as_a_whole(self):
+        for product in (self.first, self.first, self.second):
+            self.client.get(f'/api/v1/products/product/{product.id}/')
+        update = QuerySet.update
+        calls = []
+
+        def fail_second_update(queryset, **kwargs):
+            calls.append(kwargs)
+            if len(calls) == 2:
+                raise DatabaseError('connection lost')
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', fail_second_update), \
+                self.assertLogs('apps.services.view_counter', 'ERROR'):
+            self.assertEqual(flush_product_views(), 0)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.views_count, self.second.views_count), (0, 0))
+
+        # Повтор записывает каждый просмотр ровно один раз
+        self.assertEqual(flush_product_views(), 3)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.views_count, self.second.views_count), (2, 1))
+
+    def test_stats_are_exposed_to_staff_only(self):
+        url = '/api/v1/products/view-counter/stats/'
+        user = self.create_user('+996700000013')
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        user.is_staff = True
+        self.client.force_authenticate(user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('dropped_views', response.data)
+
+
+class ProductImagePipelineTests(ProductFixturesMixin, APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def upload(self, width, height, color='red'):
+        output = BytesIO()
+        Image.new('RGB', (width, height), color).save(output, format='JPEG')
+        return SimpleUploadedFile('photo.jpg', output.getvalue(), content_type='image/jpeg')
+
+    def image_callbacks(self, callbacks):
+        return [callback for callback in callbacks if 'schedule_image_processing' in callback.__qualname__]
+
+    def test_save_schedules_processing_only_when_file_may_change(self):
+        product, = self.create_catalog(1)
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.save(update_fields=['name'])
+        self.assertEqual(self.image_callbacks(callbacks), [])
+        with self.captureOnCommitCallbacks() as callbacks:
+            product.photo = self.upload(300, 300)
+            product.save()
+        self.assertEqual(len(self.image_callbacks(callbacks)), 1)
+
+    def test_variants_are_built_once_per_content_and_exposed_as_srcset(self):
+        product, = self.create_catalog(1)
+        product.photo = self.upload(1000, 500)
+        product.save()
+
+        self.assertTrue(process_image_variants(product))
+        product.refresh_from_db()
+        self.assertEqual(len(product.photo_hash), 64)
+        widths = sorted({variant['width'] for variant in product.photo_variants})
+        self.assertEqual(widths, [200, 400, 800])
+        self.assertEqual({variant['format'] for variant in product.photo_variants}, {'webp', *available_formats()})
+        thumbnail = next(variant for variant in product.photo_variants if variant['width'] == 200)
+        self.assertEqual(thumbnail['height'], 100)
+        self.assertFalse(process_image_variants(product))
+
+        response = self.client.get(f'/api/v1/products/product/{product.id}/')
+        self.assertTrue(response.data['photo'].endswith('/800.webp'))
+        srcset = response.data['photo_srcset']
+        self.assertIn('200w', srcset['webp'])
+        self.assertTrue(srcset['sizes']['thumbnail']['webp'].endswith('/200.webp'))
+
+
+class KeysetPaginationTests(ProductFixturesMixin, APITestCase):
+    url = '/api/v1/products/product/search/'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = cls.create_catalog(11)
+        for index, product in enumerate(cls.products):
+            product.views_count = index % 3
+            product.discounted_price = None if index % 4 == 0 else 500 + index % 2
+            product.save()
+
+    def walk(self, **params):
+        response = self.client.get(self.url, {'pagination': 'cursor', 'page_size': 3, **params})
+        pages = [response.data]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).data)
+        return pages
+
+    def expected(self, ordering):
+        return list(Product.objects.order_by(ordering, '-id' if ordering.startswith('-') else 'id')
+                    .values_list('id', flat=True))
+
+    def test_pages_follow_ordering_filter_in_both_directions(self):
+        for ordering in ('-views_count', 'views_count', 'discounted_price', '-discounted_price', 'datetime'):
+            with self.subTest(ordering=ordering):
+                pages = self.walk(ordering=ordering)
+                ids = [item['id'] for page in pages for item in page['results']]
+                self.assertEqual(ids, self.expected(ordering))
+                self.assertIsNone(pages[0]['previous'])
+
+                backwards = [pages[-1]]
+                while backwards[-1]['previous']:
+                    backwards.append(self.client.get(backwards[-1]['previous']).data)
+                self.assertEqual([item['id'] for page in reversed(backwards) for item in page['results']], ids)
+
+    def test_count_is_estimated_unless_requested(self):
+        response = self.client.get(self.url, {'pagination': 'cursor'})
+        self.assertTrue(response.data['count_is_estimate'])
+        self.assertNotIn('page=', response.data['next'] or '')
+        response = self.client.get(self.url, {'pagination': 'cursor', 'with_count': 'true'})
+        self.assertEqual((response.data['count'], response.data['count_is_estimate']), (11, False))
+
+    def test_page_number_mode_is_unchanged(self):
+        response = self.client.get(self.url, {'page': 2, 'page_size': 5})
+        self.assertEqual((response.data['count'], response.data['total_pages']), (11, 3))
+        self.assertNotIn('count_is_estimate', response.data)
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'broken'}).status_code, 404)
+
+
+class CatalogSyncTests(ProductFixturesMixin, APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Обувь', slug='obuv')
+        cls.product, = cls.create_catalog(1, category=cls.category)
+
+    def setUp(self):
+        cache.clear()
+
+    def feed(self, count, start=0, **columns):
+        output = StringIO()
+        writer = csv.DictWriter(output, fieldnames=['name', 'category', 'price', 'tags', 'color', 'size', 'quantity',
+                                                    *columns])
+        writer.writeheader()
+        for index in range(start, start + count):
+            for size in ('41', '42'):
+                writer.writerow({
+                    'name': f'Кеды {index}', 'category': 'obuv', 'price': '1500,00', 'tags': 'Хит|Новинка',
+                    'color': 'Черный', 'size': size, 'quantity': 3, **columns,
+                })
+        return BytesIO(output.getvalue().encode())
+
+    def count_import_queries(self, count, start):
+        with CaptureQueriesContext(connection) as context, self.captureOnCommitCallbacks():
+            stats = import_catalog(self.feed(count, start), 'csv')
+        self.assertEqual(stats['products_created'], count)
+        return len(context.captured_queries)
+
+    def test_query_count_does_not_depend_on_feed_size(self):
+        # Первая загрузка создаёт недостающие справочники (размер 41, тег «Новинка»)
+        self.count_import_queries(1, 0)
+        self.assertEqual(self.count_import_queries(5, 1), self.count_import_queries(20, 6))
+
+        product = Product.objects.get(name='Кеды 3')
+        self.assertEqual(len(product.article), 9)
+        self.assertEqual(product.slug, 'kedy-3')
+        self.assertEqual(sorted(product.tags.values_list('name', flat=True)), ['Новинка', 'Хит'])
+        sizes = product.product_sizes.order_by('size__name')
+        self.assertEqual([(size.size.name, size.quantity, size.price) for size in sizes],
+                         [('41', 3, Decimal('1500.00')), ('42', 3, Decimal('1500.00'))])
+        # Поисковый вектор пересобран одним UPDATE в конце загрузки
+        self.assertFalse(Product.objects.filter(search_vector=None).exists())
+
+    def test_new_categories_are_placed_in_tree_after_import(self):
+        with self.captureOnCommitCallbacks():
+            stats = import_catalog(self.feed(2, category='Сандалии'), 'csv')
+        self.assertEqual(stats['errors'], [])
+        category = Category.objects.get(name='Сандалии')
+        self.assertEqual((category.level, category.rght - category.lft), (0, 1))
+        self.assertEqual(category.products.count(), 2)
+        self.assertEqual([node['name'] for node in get_category_tree()], ['Обувь', 'Сандалии'])
+
+    def test_export_round_trip_updates_only_changed_rows(self):
+        output = BytesIO()
+        self.assertEqual(export_catalog(output, 'jsonl'), 1)
+        row = json.loads(output.getvalue())
+        self.assertEqual((row['article'], row['category'], row['size'], row['tags']),
+                         (self.product.article, 'obuv', '42', 'Хит'))
+
+        with self.captureOnCommitCallbacks():
+            stats = import_catalog(BytesIO(output.getvalue()), 'jsonl')
+        self.assertEqual((stats['products_unchanged'], stats['products_updated'], stats['variants_updated']), (1, 0, 0))
+
+        row.update(quantity='7', price='990', name_en='Sneakers')
+        with self.captureOnCommitCallbacks():
+            stats = import_catalog(BytesIO(json.dumps(row).encode()), 'jsonl')
+        self.assertEqual((stats['products_updated'], stats['variants_updated']), (1, 1))
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.price, self.product.name_en), (Decimal('990.00'), 'Sneakers'))
+        self.assertEqual(self.product.product_sizes.get().quantity, 7)
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        with self.captureOnCommitCallbacks():
+            stats = import_catalog(self.feed(1, price='дорого'), 'csv')
+        self.assertEqual(stats['products_created'], 0)
+        self.assertEqual(stats['errors'], ['строка 2: price: «дорого» — не число'])
@@ -3,10 +3,16 @@ from decimal import Decimal
 from apps.orders.models import PercentCashback
 
 
-def calculate_bonus_points(order_total, delivery_fee, order_source):
+def get_percent_cashback():
     percents = PercentCashback.objects.all().first()
     if not percents:
-        percents = PercentCashback.objects.create(mobile_percent=5, web_percent=3)
+        percents = PercentCashback.objects.create(mobile_percent=5, web_percent=3, min_order_price=0)
+    return percents
+
+
+def calculate_bonus_points(order_total, delivery_fee, order_source, percents=None):
+    # percents можно передать заранее загруженным — например, один раз на запрос истории заказов
+    percents = percents or get_percent_cashback()
 
     BONUS_PERCENTAGE_MOBILE = percents.mobile_percent
     BONUS_PERCENTAGE_WEB = percents.web_percent
@@ -0,0 +1,533 @@
+import csv
+import io
+import json
+import os
+import random
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import translation
+from django.utils.text import slugify
+from unidecode import unidecode
+
+from apps.product.models import Category, Color, Country, Gender, Product, ProductSize, Size, Tag
+from apps.services.category_facets import invalidate_all_category_facets
+from apps.services.category_tree import invalidate_category_tree
+from apps.services.content_versions import bump_content_version
+from apps.services.facet_engine import invalidate_facet_index
+from apps.services.image_pipeline import schedule_image_processing
+from apps.services.listing_projection import refresh_product_listings
+from apps.services.product_documents import schedule_document_rebuild
+from apps.services.product_sampling import invalidate_pools
+from apps.services.product_search import update_search_vectors
+from apps.services.product_suggest import reset_suggest_indexes
+from apps.services.response_cache import invalidate_model
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+LANGUAGES = [language for language, _ in settings.LANGUAGES]
+
+# Одна строка файла — один вариант продукта (цвет и размер); поля продукта повторяются в строках его вариантов
+PRODUCT_COLUMNS = [
+    'article',
+    *(f'name_{language}' for language in LANGUAGES),
+    *(f'description_{language}' for language in LANGUAGES),
+    'category', 'country', 'gender', 'price', 'discounted_price', 'bonus_price', 'is_active', 'tags', 'photo',
+]
+VARIANT_COLUMNS = ['color', 'color_hex', 'size', 'quantity', 'variant_price', 'variant_discounted_price',
+                   'variant_bonus_price']
+COLUMNS = PRODUCT_COLUMNS + VARIANT_COLUMNS
+
+FORMATS = ('csv', 'jsonl', 'xlsx')
+
+# Продуктов в одной транзакции
+BATCH_SIZE = 500
+
+TAG_SEPARATOR = '|'
+TRUE_VALUES = {'1', 'true', 'yes', 'да', '+'}
+
+# Поле продукта -> колонка файла; переводы — по колонкам name_<язык>, description_<язык>
+PRODUCT_FIELDS = {
+    **{f'name_{language}': f'name_{language}' for language in LANGUAGES},
+    **{f'description_{language}': f'description_{language}' for language in LANGUAGES},
+    'category_id': 'category',
+    'country_id': 'country',
+    'gender_id': 'gender',
+    'price': 'price',
+    'discounted_price': 'discounted_price',
+    'bonus_price': 'bonus_price',
+    'is_active': 'is_active',
+    'photo': 'photo',
+}
+LOADED_FIELDS = [field.removesuffix('_id') for field in PRODUCT_FIELDS]
+VARIANT_FIELDS = {
+    'quantity': 'quantity',
+    'price': 'variant_price',
+    'discounted_price': 'variant_discounted_price',
+    'bonus_price': 'variant_bonus_price',
+}
+
+
+class CatalogRowError(ValueError):
+    pass
+
+
+def detect_format(path):
+    fmt = os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt not in FORMATS:
+        raise CatalogRowError(f"Неизвестный формат файла: {path} (поддерживаются {', '.join(FORMATS)})")
+    return fmt
+
+
+def _require_openpyxl():
+    if openpyxl is None:
+        raise CatalogRowError("Для XLSX нужен пакет openpyxl")
+
+
+def read_rows(file, fmt):
+    """Потоково читает файл (открытый в двоичном режиме) и отдаёт пары (номер строки, словарь колонок)."""
+    if fmt == 'xlsx':
+        _require_openpyxl()
+        workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [str(cell).strip() if cell is not None else '' for cell in next(rows, ())]
+            for line, values in enumerate(rows, start=2):
+                yield line, dict(zip(header, values))
+        finally:
+            workbook.close()
+        return
+
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        for line, row in enumerate(csv.DictReader(text), start=2):
+            yield line, row
+    else:
+        for line, raw in enumerate(text, start=1):
+            if raw.strip():
+                try:
+                    yield line, json.loads(raw)
+                except ValueError as error:
+                    raise CatalogRowError(f"строка {line}: некорректный JSON ({error})")
+
+
+def _clean(value):
+    if value is None:
+        return ''
+    return str(value).strip()
+
+
+def _decimal(value, column):
+    try:
+        return Decimal(_clean(value).replace(',', '.').replace(' ', '')).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise CatalogRowError(f"{column}: «{value}» — не число")
+
+
+def _integer(value, column):
+    try:
+        return int(Decimal(_clean(value).replace(',', '.')))
+    except InvalidOperation:
+        raise CatalogRowError(f"{column}: «{value}» — не целое число")
+
+
+def _product_key(row):
+    # Продукт определяется артикулом; строки без артикула — новый продукт, его варианты идут подряд
+    return _clean(row.get('article')) or f"name:{_clean(row.get('name_ru') or row.get('name'))}"
+
+
+def _group_products(rows):
+    """Соседние строки с одним артикулом (или названием) — варианты одного продукта."""
+    key, group = None, []
+    for line, row in rows:
+        # name и description — синонимы колонок языка по умолчанию
+        for field in ('name', 'description'):
+            if field in row and f'{field}_{settings.MODELTRANSLATION_DEFAULT_LANGUAGE}' not in row:
+                row[f'{field}_{settings.MODELTRANSLATION_DEFAULT_LANGUAGE}'] = row.pop(field)
+        row_key = _product_key(row)
+        if group and row_key != key:
+            yield group
+            group = []
+        key = row_key
+        group.append((line, row))
+    if group:
+        yield group
+
+
+def _unique_slug(name, taken):
+    base = slugify(unidecode(name)) or 'product'
+    slug, counter = base, 1
+    while slug in taken:
+        slug = f'{base}-{counter}'
+        counter += 1
+    taken.add(slug)
+    return slug
+
+
+def _unique_article(taken):
+    while True:
+        article = ''.join(random.choices('0123456789', k=9))
+        if article not in taken:
+            taken.add(article)
+            return article
+
+
+class CatalogImporter:
+    """
+    Пакетная загрузка каталога. Справочники, слаги и артикулы читаются один раз в начале, дальше —
+    без запросов на строку: продукты и варианты пишутся bulk_create/bulk_update по batch_size продуктов
+    в одной транзакции. Сигналы при этом не отправляются, поэтому перестроение дерева категорий, поисковых
+    векторов, проекций, документов, изображений и сброс кэшей выполняются один раз в finish().
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.stats = {
+            'rows': 0, 'products_created': 0, 'products_updated': 0, 'products_unchanged': 0,
+            'variants_created': 0, 'variants_updated': 0, 'errors': [],
+        }
+        self.touched_ids = set()
+        self.photo_products = []
+        self.categories_created = False
+
+    def _load_lookups(self):
+        self.slugs = set(Product.objects.exclude(slug=None).values_list('slug', flat=True))
+        self.articles = set(Product.objects.values_list('article', flat=True))
+        self.category_slugs = set(Category.objects.exclude(slug=None).values_list('slug', flat=True))
+        categories = list(Category.objects.order_by('-id').values_list('id', 'slug', 'name'))
+        self.categories = {name.lower(): category_id for category_id, slug, name in categories}
+        # Слаг точнее названия — перекрывает совпадающие названия
+        self.categories.update({slug.lower(): category_id for category_id, slug, name in categories if slug})
+        self.dictionaries = {
+            model: {name.lower(): pk for pk, name in model.objects.order_by('-id').values_list('id', 'name')}
+            for model in (Color, Size, Country, Gender, Tag)
+        }
+
+    def _resolve(self, model, name, **defaults):
+        """id записи справочника по названию; недостающие создаются (редкость, поэтому по одной)."""
+        name = _clean(name)
+        if not name:
+            return None
+        lookup = self.dictionaries[model]
+        if name.lower() not in lookup:
+            lookup[name.lower()] = model.objects.create(name=name, **defaults).pk
+        return lookup[name.lower()]
+
+    def _resolve_category(self, value):
+        value = _clean(value)
+        if not value:
+            return None
+        if value.lower() not in self.categories:
+            # Дерево пересчитывается один раз в finish(), до этого узлы пишутся без обновления lft/rght
+            with Category.objects.disable_mptt_updates():
+                category = Category(name=value, slug=_unique_slug(value, self.category_slugs))
+                category.save()
+            self.categories[value.lower()] = category.pk
+            self.categories_created = True
+        return self.categories[value.lower()]
+
+    def _product_values(self, row):
+        values = {}
+        for field, column in PRODUCT_FIELDS.items():
+            if column not in row:
+                continue
+            raw = row[column]
+            if field == 'category_id':
+                values[field] = self._resolve_category(raw)
+                if values[field] is None:
+                    raise CatalogRowError("не указана категория")
+            elif field == 'country_id':
+                values[field] = self._resolve(Country, raw)
+            elif field == 'gender_id':
+                values[field] = self._resolve(Gender, raw)
+            elif field in ('price', 'bonus_price'):
+                values[field] = _decimal(raw, column) if _clean(raw) else Decimal('0.00')
+            elif field == 'discounted_price':
+                values[field] = _decimal(raw, column) if _clean(raw) else None
+            elif field == 'is_active':
+                values[field] = raw if isinstance(raw, bool) else _clean(raw).lower() in TRUE_VALUES
+            elif field.startswith('description') or field != f'name_{settings.MODELTRANSLATION_DEFAULT_LANGUAGE}':
+                # Пустой перевод хранится как NULL, как при сохранении из админки
+                values[field] = _clean(raw) or None
+            else:
+                values[field] = _clean(raw)
+        return values
+
+    def _variant_values(self, row):
+        color_id = self._resolve(Color, row.get('color'), **(
+            {'hex_code': _clean(row['color_hex'])} if _clean(row.get('color_hex')) else {}
+        ))
+        size_id = self._resolve(Size, row.get('size'))
+        if color_id is None and size_id is None:
+            return None
+        if color_id is None or size_id is None:
+            raise CatalogRowError("у варианта должны быть и цвет, и размер")
+        values = {}
+        for field, column in VARIANT_FIELDS.items():
+            if _clean(row.get(column)):
+                values[field] = _integer(row[column], column) if field == 'quantity' else _decimal(row[column], column)
+        return (color_id, size_id), values
+
+    def _tag_ids(self, row):
+        if 'tags' not in row:
+            return None
+        names = [name.strip() for name in _clean(row['tags']).split(TAG_SEPARATOR)]
+        return {self._resolve(Tag, name) for name in names if name}
+
+    def _parse_group(self, group):
+        first_line, first = group[0]
+        values = self._product_values(first)
+        variants = {}
+        for line, row in group:
+            try:
+                variant = self._variant_values(row)
+            except CatalogRowError as error:
+                raise CatalogRowError(f"строка {line}: {error}")
+            if variant:
+                variants[variant[0]] = variant[1]
+        return _clean(first.get('article')), values, variants, self._tag_ids(first)
+
+    def run(self, rows):
+        """Загружает строки из read_rows(). Возвращает статистику."""
+        # Названия справочников и основные колонки переводимых полей — на языке по умолчанию
+        with translation.override(settings.MODELTRANSLATION_DEFAULT_LANGUAGE):
+            self._load_lookups()
+            batch = []
+            for group in _group_products(rows):
+                self.stats['rows'] += len(group)
+                try:
+                    batch.append(self._parse_group(group))
+                except CatalogRowError as error:
+                    message = str(error)
+                    if not message.startswith('строка'):
+                        message = f"строка {group[0][0]}: {message}"
+                    self.stats['errors'].append(message)
+                    continue
+                if len(batch) >= self.batch_size:
+                    self._write_batch(batch)
+                    batch = []
+            if batch:
+                self._write_batch(batch)
+            self.finish()
+        return self.stats
+
+    def _write_batch(self, batch):
+        with transaction.atomic():
+            articles = [article for article, *_ in batch if article]
+            existing = {}
+            queryset = Product.objects.filter(article__in=articles).order_by('-id').only('article', *LOADED_FIELDS)
+            for product in queryset:
+                existing[product.article] = product
+
+            created, updated, update_fields = [], [], set()
+            products = []
+            for article, values, variants, tag_ids in batch:
+                product = existing.get(article)
+                if product is None:
+                    missing = {'name_ru', 'category_id', 'price'} - values.keys()
+                    if missing or not values['name_ru']:
+                        self.stats['errors'].append(
+                            f"артикул {article or '—'}: для нового продукта нужны name_ru, category и price"
+                        )
+                        continue
+                    product = Product(article=article or _unique_article(self.articles), **values)
+                    product.slug = _unique_slug(values['name_ru'], self.slugs)
+                    self.articles.add(product.article)
+                    created.append(product)
+                    if product.photo:
+                        self.photo_products.append(product)
+                else:
+                    changed = {
+                        field for field, value in values.items()
+                        if (getattr(product, field).name if field == 'photo' else getattr(product, field)) != value
+                    }
+                    for field in changed:
+                        setattr(product, field, values[field])
+                    if 'photo' in changed:
+                        self.photo_products.append(product)
+                    if changed:
+                        updated.append(product)
+                        update_fields |= changed
+                    else:
+                        self.stats['products_unchanged'] += 1
+                products.append((product, variants, tag_ids))
+
+            Product.objects.bulk_create(created)
+            if updated:
+                # Основная колонка переводимого поля хранит значение языка по умолчанию
+                update_fields |= {field.rsplit('_', 1)[0] for field in update_fields
+                                  if field.startswith(('name_', 'description_'))}
+                Product.objects.bulk_update(updated, sorted(update_fields))
+            self.stats['products_created'] += len(created)
+            self.stats['products_updated'] += len(updated)
+
+            self._write_variants(products)
+            self._write_tags(products)
+            self.touched_ids.update(product.pk for product, _, _ in products)
+        if self.progress:
+            self.progress(self.stats)
+
+    def _write_variants(self, products):
+        existing = {
+            (size.product_id, size.color_id, size.size_id): size
+            for size in ProductSize.objects.filter(product__in=[product for product, _, _ in products])
+        }
+        created, updated, update_fields = [], [], set()
+        for product, variants, _ in products:
+            for (color_id, size_id), values in variants.items():
+                variant = existing.get((product.pk, color_id, size_id))
+                if variant is None:
+                    # Как ProductSize.save: не указанные цены наследуются от продукта (он уже в памяти)
+                    created.append(ProductSize(
+                        product=product, color_id=color_id, size_id=size_id,
+                        quantity=values.get('quantity', 0),
+                        price=values.get('price', product.price),
+                        discounted_price=values.get('discounted_price', product.discounted_price),
+                        bonus_price=values.get('bonus_price', product.bonus_price),
+                    ))
+                    continue
+                changed = {field for field, value in values.items() if getattr(variant, field) != value}
+                for field in changed:
+                    setattr(variant, field, values[field])
+                if changed:
+                    updated.append(variant)
+                    update_fields |= changed
+        ProductSize.objects.bulk_create(created)
+        if updated:
+            ProductSize.objects.bulk_update(updated, sorted(update_fields))
+        self.stats['variants_created'] += len(created)
+        self.stats['variants_updated'] += len(updated)
+
+    def _write_tags(self, products):
+        wanted = {product.pk: tag_ids for product, _, tag_ids in products if tag_ids is not None}
+        if not wanted:
+            return
+        through = Product.tags.through
+        current = {}
+        for product_id, tag_id in through.objects.filter(product_id__in=wanted).values_list('product_id', 'tag_id'):
+            current.setdefault(product_id, set()).add(tag_id)
+        through.objects.bulk_create([
+            through(product_id=product_id, tag_id=tag_id)
+            for product_id, tag_ids in wanted.items() for tag_id in tag_ids - current.get(product_id, set())
+        ], ignore_conflicts=True)
+        for product_id, tag_ids in wanted.items():
+            extra = current.get(product_id, set()) - tag_ids
+            if extra:
+                through.objects.filter(product_id=product_id, tag_id__in=extra).delete()
+
+    def finish(self):
+        """То, что при сохранении по одному делали бы сигналы, — один раз на всю загрузку."""
+        if self.categories_created:
+            Category.objects.rebuild()
+        if not self.touched_ids and not self.categories_created:
+            return
+        update_search_vectors(Product.objects.filter(id__in=self.touched_ids))
+        refresh_product_listings(self.touched_ids)
+        schedule_document_rebuild(self.touched_ids)
+        for product in self.photo_products:
+            schedule_image_processing(product)
+        invalidate_all_category_facets()
+        invalidate_facet_index()
+        invalidate_category_tree()
+        invalidate_pools()
+        reset_suggest_indexes()
+        for model in (Product, ProductSize, Tag, Color, Size, Country, Gender, Category):
+            invalidate_model(model)
+        bump_content_version('products')
+        if self.categories_created:
+            bump_content_version('categories')
+
+
+def import_catalog(file, fmt, batch_size=BATCH_SIZE, progress=None):
+    return CatalogImporter(batch_size, progress).run(read_rows(file, fmt))
+
+
+def export_rows(queryset=None, chunk_size=BATCH_SIZE):
+    """
+    Строки выгрузки по одной на вариант. Продукты читаются серверным курсором (iterator) порциями
+    chunk_size, теги и варианты подгружаются на каждую порцию.
+    """
+    queryset = Product.objects.all() if queryset is None else queryset
+    queryset = queryset.select_related('category', 'country', 'gender').prefetch_related(
+        'tags', Prefetch('product_sizes', queryset=ProductSize.objects.select_related('color', 'size').order_by('id')),
+    ).order_by('id')
+    with translation.override(settings.MODELTRANSLATION_DEFAULT_LANGUAGE):
+        for product in queryset.iterator(chunk_size=chunk_size):
+            base = {
+                'article': product.article,
+                **{f'name_{language}': getattr(product, f'name_{language}') or '' for language in LANGUAGES},
+                **{f'description_{language}': getattr(product, f'description_{language}') or ''
+                   for language in LANGUAGES},
+                'category': product.category.slug or product.category.name,
+                'country': product.country.name if product.country else '',
+                'gender': product.gender.name if product.gender else '',
+                'price': str(product.price),
+                'discounted_price': '' if product.discounted_price is None else str(product.discounted_price),
+                'bonus_price': str(product.bonus_price),
+                'is_active': '1' if product.is_active else '0',
+                'tags': TAG_SEPARATOR.join(tag.name for tag in product.tags.all()),
+                'photo': product.photo.name,
+            }
+            variants = product.product_sizes.all()
+            if not variants:
+                yield {**base, **dict.fromkeys(VARIANT_COLUMNS, '')}
+            for variant in variants:
+                yield {
+                    **base,
+                    'color': variant.color.name,
+                    'color_hex': variant.color.hex_code,
+                    'size': variant.size.name,
+                    'quantity': str(variant.quantity),
+                    'variant_price': '' if variant.price is None else str(variant.price),
+                    'variant_discounted_price': '' if variant.discounted_price is None
+                    else str(variant.discounted_price),
+                    'variant_bonus_price': '' if variant.bonus_price is None else str(variant.bonus_price),
+                }
+
+
+class _Echo:
+    def write(self, value):
+        return value
+
+
+def stream_catalog(fmt, queryset=None, chunk_size=BATCH_SIZE):
+    """Выгрузка в CSV или JSONL кусками текста — для файла или StreamingHttpResponse."""
+    rows = export_rows(queryset, chunk_size)
+    if fmt == 'csv':
+        writer = csv.DictWriter(_Echo(), fieldnames=COLUMNS)
+        yield writer.writeheader()
+        for row in rows:
+            yield writer.writerow(row)
+    elif fmt == 'jsonl':
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+    else:
+        raise CatalogRowError(f"Потоковая выгрузка поддерживает только csv и jsonl, не {fmt}")
+
+
+def export_catalog(file, fmt, queryset=None, chunk_size=BATCH_SIZE):
+    """Пишет выгрузку в файл, открытый в двоичном режиме. Возвращает число строк."""
+    count = 0
+    if fmt == 'xlsx':
+        _require_openpyxl()
+        # write_only: строки сразу уходят во временный файл, а не копятся в памяти
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(COLUMNS)
+        for row in export_rows(queryset, chunk_size):
+            sheet.append([row[column] for column in COLUMNS])
+            count += 1
+        workbook.save(file)
+        return count
+
+    for chunk in stream_catalog(fmt, queryset, chunk_size):
+        file.write(chunk.encode())
+        count += 1
+    # В CSV первая строка — заголовок
+    return count - 1 if fmt == 'csv' else count
@@ -0,0 +1,227 @@
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import translation
+from modeltranslation.utils import build_localized_fieldname, get_language
+
+from apps.product.models import Category, CategoryFacetIndex, Product, ProductSize
+from apps.services.rating_stats import rating_bucket
+
+logger = logging.getLogger(__name__)
+
+FACET_KEYS = ('sizes', 'colors', 'countries', 'genders')
+
+# Поля продукта, от которых зависят фильтры; сохранение других полей индекс не сбрасывает
+PRODUCT_FACET_FIELDS = {
+    'is_active', 'category', 'category_id', 'price', 'discounted_price', 'country', 'country_id', 'gender', 'gender_id'
+}
+
+
+def _localized(lookup, language):
+    # values() не подменяет поля связанных моделей на переводы, поэтому выбираем колонку языка явно
+    return f"{lookup.rsplit('__', 1)[0]}__{build_localized_fieldname('name', language)}"
+
+
+class FacetAccumulator:
+    """Собирает фильтры одной категории по мере обхода продуктов её поддерева."""
+
+    def __init__(self):
+        self.product_count = 0
+        self.prices = []
+        self.discounted_prices = []
+        self.counts = {key: defaultdict(int) for key in FACET_KEYS}
+        self.ratings = set()
+        self.rating_buckets = defaultdict(int)
+
+    def add(self, product, sizes, colors):
+        self.product_count += 1
+        self.prices.append(product['price'])
+        if product['discounted_price'] is not None:
+            self.discounted_prices.append(product['discounted_price'])
+        if product['country']:
+            self.counts['countries'][product['country']] += 1
+        if product['gender']:
+            self.counts['genders'][product['gender']] += 1
+        for size in sizes:
+            self.counts['sizes'][size] += 1
+        for color in colors:
+            self.counts['colors'][color] += 1
+        if product['rating_stats__review_count']:
+            rating = product['rating_stats__average_rating']
+            self.ratings.add(rating)
+            self.rating_buckets[str(rating_bucket(rating))] += 1
+
+    def as_dict(self):
+        # Как и раньше: границы по цене со скидкой, если она есть хотя бы у одного продукта
+        prices = self.discounted_prices or self.prices
+        data = {
+            'price_min': float(min(prices)) if prices else None,
+            'price_max': float(max(prices)) if prices else None,
+            'average_ratings': sorted(self.ratings),
+            'rating_buckets': dict(self.rating_buckets),
+            'product_count': self.product_count,
+            'counts': {key: dict(values) for key, values in self.counts.items()},
+        }
+        for key in FACET_KEYS:
+            data[key] = sorted(self.counts[key])
+        return data
+
+
+def build_tree_facets(tree_id):
+    """
+    Строит фильтры для всех категорий дерева tree_id на текущем языке за один проход, тремя запросами
+    на чтение; ничего не записывает. Продукт учитывается в своей категории и во всех её предках.
+    """
+    language = get_language()
+    parents = dict(Category.objects.filter(tree_id=tree_id).values_list('id', 'parent_id'))
+
+    color_name = _localized('color__name', language)
+    country_name = _localized('country__name', language)
+    gender_name = _localized('gender__name', language)
+
+    variants = defaultdict(lambda: (set(), set()))
+    variant_rows = ProductSize.objects.filter(
+        product__is_active=True, product__category__tree_id=tree_id
+    ).values_list('product_id', 'size__name', color_name, 'color__name').distinct()
+    for product_id, size, color, default_color in variant_rows:
+        sizes, colors = variants[product_id]
+        if size:
+            sizes.add(size)
+        if color or default_color:
+            colors.add(color or default_color)
+
+    accumulators = {category_id: FacetAccumulator() for category_id in parents}
+    products = Product.objects.filter(is_active=True, category__tree_id=tree_id).values(
+        'id', 'category_id', 'price', 'discounted_price', 'rating_stats__review_count', 'rating_stats__average_rating',
+        country_name, 'country__name', gender_name, 'gender__name',
+    )
+    for product in products:
+        product['country'] = product[country_name] or product['country__name']
+        product['gender'] = product[gender_name] or product['gender__name']
+        sizes, colors = variants.get(product['id'], ((), ()))
+        category_id = product['category_id']
+        while category_id is not None:
+            accumulators[category_id].add(product, sizes, colors)
+            category_id = parents[category_id]
+
+    return {category_id: accumulator.as_dict() for category_id, accumulator in accumulators.items()}
+
+
+def store_tree_facets(tree_ids):
+    """Пересобирает и записывает индекс фильтров деревьев tree_ids на всех языках. Только для пути записи."""
+    for tree_id in tree_ids:
+        with transaction.atomic():
+            # Блокировка строк дерева: изменение, пометившее их устаревшими, сначала закоммитится и попадёт
+            # в сборку, а следующее дождётся записи и пометит их снова
+            list(CategoryFacetIndex.objects.select_for_update(of=('self',))
+                 .filter(category__tree_id=tree_id).values_list('id', flat=True))
+            for language, _ in settings.LANGUAGES:
+                with translation.override(language):
+                    facets = build_tree_facets(tree_id)
+                CategoryFacetIndex.objects.bulk_create(
+                    [CategoryFacetIndex(category_id=category_id, language=language, data=data)
+                     for category_id, data in facets.items()],
+                    update_conflicts=True,
+                    unique_fields=['category', 'language'],
+                    update_fields=['data', 'is_stale', 'built_at'],
+                )
+
+
+def rebuild_all_category_facets():
+    """Полная пересборка индекса для всех деревьев категорий. Возвращает число деревьев."""
+    tree_ids = sorted(set(Category.objects.values_list('tree_id', flat=True)))
+    store_tree_facets(tree_ids)
+    return len(tree_ids)
+
+
+def rebuild_stale_category_facets():
+    """Пересобирает деревья с устаревшими строками, например оставшиеся после перезапуска процесса."""
+    tree_ids = sorted(set(
+        CategoryFacetIndex.objects.filter(is_stale=True).values_list('category__tree_id', flat=True)
+    ))
+    store_tree_facets(tree_ids)
+    return len(tree_ids)
+
+
+def load_category_facets(categories):
+    """
+    Возвращает {category_id: фильтры} одним запросом. Запрос только читает: для деревьев, индекс которых
+    ещё не пересобран после изменения, фильтры считаются в памяти. Если устаревшие строки остались без
+    пересборки (процесс перезапустился), она ставится в фон.
+    """
+    categories = list(categories)
+    facets = {}
+    stale_ids = set()
+    rows = CategoryFacetIndex.objects.filter(
+        category_id__in=[category.id for category in categories], language=get_language()
+    ).values_list('category_id', 'data', 'is_stale')
+    for category_id, data, is_stale in rows:
+        if is_stale:
+            stale_ids.add(category_id)
+        else:
+            facets[category_id] = data
+    for tree_id in {category.tree_id for category in categories if category.id not in facets}:
+        facets.update(build_tree_facets(tree_id))
+    if stale_ids:
+        _enqueue({category.tree_id for category in categories if category.id in stale_ids})
+    return facets
+
+
+_pending = set()
+_pending_lock = threading.Lock()
+# Один поток: пересборки идут по очереди, изменения, пришедшие во время сборки, попадают в следующую
+_dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='category-facets')
+
+
+def schedule_facet_rebuild(tree_ids):
+    """Ставит пересборку индекса деревьев в фон после коммита транзакции, в которой изменились данные."""
+    tree_ids = {tree_id for tree_id in tree_ids if tree_id is not None}
+    if tree_ids:
+        transaction.on_commit(lambda: _enqueue(tree_ids))
+
+
+def _enqueue(tree_ids):
+    with _pending_lock:
+        scheduled = bool(_pending)
+        _pending.update(tree_ids)
+    if not scheduled:
+        _dispatcher.submit(_rebuild_pending)
+
+
+def _rebuild_pending():
+    with _pending_lock:
+        tree_ids = sorted(_pending)
+        _pending.clear()
+    try:
+        store_tree_facets(tree_ids)
+    except Exception:
+        logger.exception("Не удалось пересобрать индекс фильтров категорий")
+    finally:
+        close_old_connections()
+
+
+def invalidate_category_facets(category_ids):
+    """Помечает устаревшим индекс категорий и всех их предков и ставит пересборку их деревьев в фон."""
+    condition = Q()
+    tree_ids = set()
+    for tree_id, lft, rght in Category.objects.filter(id__in=category_ids).values_list('tree_id', 'lft', 'rght'):
+        condition |= Q(category__tree_id=tree_id, category__lft__lte=lft, category__rght__gte=rght)
+        tree_ids.add(tree_id)
+    if condition:
+        # Пометка в той же транзакции, что и изменение: перезапуск до фоновой пересборки не оставит старых данных
+        CategoryFacetIndex.objects.filter(condition).update(is_stale=True)
+        schedule_facet_rebuild(tree_ids)
+
+
+def invalidate_product_facets(product_ids):
+    invalidate_category_facets(Product.objects.filter(id__in=product_ids).values_list('category_id', flat=True))
+
+
+def invalidate_all_category_facets():
+    CategoryFacetIndex.objects.update(is_stale=True)
+    schedule_facet_rebuild(Category.objects.values_list('tree_id', flat=True).distinct())
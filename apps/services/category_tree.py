@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Count
+from modeltranslation.utils import build_localized_fieldname, get_language
+
+from apps.product.models import Category, Product
+
+# Дерево живёт в кэше; сигналы сбрасывают его при изменении категорий и продуктов, срок — страховка
+TREE_TIMEOUT = 60 * 60
+
+TRANSLATED_FIELDS = ('name', 'description')
+
+# Поля узла в ответах categories/only/ и promoted-categories/ (как у прежнего CategoryOnlySerializer)
+NODE_FIELDS = ('id', 'name', 'description', 'slug', 'image', 'product_count')
+
+
+def _tree_key(language):
+    return f'category_tree:{language}'
+
+
+def _localized(row, field, language):
+    # Как modeltranslation: пустой перевод заменяется значением языка по умолчанию
+    return row[build_localized_fieldname(field, language)] or row[field]
+
+
+def build_category_tree(language):
+    """
+    Всё дерево категорий одним запросом в порядке (tree_id, lft) и количество активных продуктов
+    одним агрегатом. В product_count узла входят продукты всех его потомков.
+    """
+    localized = [build_localized_fieldname(field, language) for field in TRANSLATED_FIELDS]
+    rows = list(
+        Category.objects.order_by('tree_id', 'lft')
+        .values('id', 'parent_id', 'slug', 'image', 'is_promoted', 'order', *TRANSLATED_FIELDS, *localized)
+    )
+    counts = dict(
+        Product.objects.filter(is_active=True).values_list('category_id').annotate(count=Count('id')).order_by()
+    )
+
+    nodes = {}
+    roots = []
+    for row in rows:
+        node = {
+            'id': row['id'],
+            'name': _localized(row, 'name', language),
+            'description': _localized(row, 'description', language),
+            'slug': row['slug'],
+            'image': default_storage.url(row['image']) if row['image'] else None,
+            'is_promoted': row['is_promoted'],
+            'order': row['order'],
+            'parent_id': row['parent_id'],
+            'product_count': counts.get(row['id'], 0),
+            'subcategories': [],
+        }
+        nodes[row['id']] = node
+        siblings = nodes[row['parent_id']]['subcategories'] if row['parent_id'] else roots
+        siblings.append(node)
+
+    # В обратном порядке обхода потомки идут раньше предков — суммы поднимаются за один проход
+    for row in reversed(rows):
+        if row['parent_id']:
+            nodes[row['parent_id']]['product_count'] += nodes[row['id']]['product_count']
+
+    # Соседи — по полю order, как прежде (Meta.ordering), при равенстве — в порядке дерева
+    for siblings in [roots] + [node['subcategories'] for node in nodes.values()]:
+        siblings.sort(key=lambda node: node['order'])
+    return roots
+
+
+def get_category_tree(language=None):
+    """Корни дерева категорий на языке запроса (вложенные словари из кэша, изменять нельзя)."""
+    language = language or get_language()
+    key = _tree_key(language)
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_category_tree(language)
+        cache.set(key, tree, TREE_TIMEOUT)
+    return tree
+
+
+def iter_category_nodes(nodes=None):
+    """Все узлы в порядке обхода дерева."""
+    for node in get_category_tree() if nodes is None else nodes:
+        yield node
+        yield from iter_category_nodes(node['subcategories'])
+
+
+def _invalidate():
+    cache.delete_many([_tree_key(language) for language, _ in settings.LANGUAGES])
+
+
+def invalidate_category_tree():
+    # Сразу и ещё раз после коммита, чтобы параллельный запрос не положил в кэш дерево до коммита
+    _invalidate()
+    transaction.on_commit(_invalidate)
+
+
+def render_category_nodes(nodes, request, fields=NODE_FIELDS, recursive=True):
+    """Копии узлов для ответа: только поля fields, абсолютный адрес изображения и, если нужно, подкатегории."""
+    rendered = []
+    for node in nodes:
+        data = {field: node[field] for field in fields}
+        if data.get('image'):
+            data['image'] = request.build_absolute_uri(data['image'])
+        if recursive:
+            data['subcategories'] = render_category_nodes(node['subcategories'], request, fields)
+        rendered.append(data)
+    return rendered
+
+
+def category_choices():
+    """Варианты для выбора категории в админке: названия с отступом по уровню, в порядке дерева."""
+    def walk(nodes, level):
+        for node in nodes:
+            yield node['id'], ' ' * (level * 4) + node['name']
+            yield from walk(node['subcategories'], level + 1)
+
+    return list(walk(get_category_tree(), 0))
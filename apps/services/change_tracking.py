@@ -0,0 +1,93 @@
+from collections import defaultdict
+
+# Значение поля, которого не было в загруженной строке (only/defer): переход по нему не определить
+UNKNOWN = object()
+
+# {(модель, поле): [(исходное, новое, обработчик)]}
+_transitions = defaultdict(list)
+
+
+def on_transition(model, field, source='*', target='*'):
+    """
+    Подписывает обработчик(instance, old, new) на переход поля: on_transition(Order, 'order_status',
+    target='completed') — «order_status: * -> completed». Вызывается после сохранения, в той же транзакции;
+    при создании объекта old равно None.
+    """
+    def decorator(handler):
+        _transitions[(model, field)].append((source, target, handler))
+        return handler
+    return decorator
+
+
+def _matches(pattern, value):
+    return pattern == '*' or pattern == value
+
+
+class ChangeTrackingMixin:
+    """
+    Запоминает значения полей, с которыми объект загружен из базы (без лишнего запроса — из той же строки),
+    и после сохранения вызывает обработчики on_transition только для реально изменившихся полей.
+    Сохранение, которое пишет только поля из bookkeeping_fields, выполняется одним UPDATE этих колонок
+    без сигналов и обработчиков.
+    """
+    bookkeeping_fields = frozenset()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded()
+        return instance
+
+    def _remember_loaded(self, fields=None):
+        # После сохранения с update_fields в базе только эти поля — остальные помнят загруженное значение
+        deferred = self.get_deferred_fields()
+        loaded = getattr(self, '_loaded_values', None) if fields is not None else None
+        loaded = dict(loaded or {})
+        for field in self._meta.concrete_fields:
+            if field.attname in deferred or (fields is not None and field.name not in fields):
+                continue
+            loaded[field.attname] = getattr(self, field.attname)
+        self._loaded_values = loaded
+
+    def changed_fields(self, fields=None):
+        """{поле: (было, стало)} по сравнению с загруженными значениями; fields ограничивает проверку."""
+        loaded = getattr(self, '_loaded_values', None)
+        deferred = self.get_deferred_fields()
+        changes = {}
+        for field in self._meta.concrete_fields:
+            if field.attname in deferred or (fields is not None and field.name not in fields):
+                continue
+            old = UNKNOWN if loaded is None else loaded.get(field.attname, UNKNOWN)
+            new = getattr(self, field.attname)
+            if old is UNKNOWN or old != new:
+                changes[field.name] = (old, new)
+        return changes
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = {self._meta.get_field(name).name for name in update_fields}
+        creating = self._state.adding
+        changes = {} if creating else self.changed_fields(update_fields)
+        written = update_fields if update_fields is not None else set(changes)
+        if (not creating and not args and not kwargs.get('force_insert') and written
+                and written <= self.bookkeeping_fields):
+            type(self)._base_manager.using(kwargs.get('using') or self._state.db).filter(pk=self.pk).update(
+                **{field: getattr(self, self._meta.get_field(field).attname) for field in written}
+            )
+            self._remember_loaded(written)
+            return
+
+        super().save(*args, **kwargs)
+        if creating:
+            changes = {field.name: (None, getattr(self, field.attname)) for field in self._meta.concrete_fields}
+        self._remember_loaded(update_fields)
+        self._run_transitions(changes)
+
+    def _run_transitions(self, changes):
+        for field, (old, new) in changes.items():
+            if old is UNKNOWN:
+                continue
+            for source, target, handler in _transitions.get((type(self), field), ()):
+                if _matches(source, old) and _matches(target, new):
+                    handler(self, old, new)
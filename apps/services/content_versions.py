@@ -0,0 +1,133 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from modeltranslation.utils import get_language
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from apps.pages.models import ContentVersion
+
+CONTENT_DOMAINS = ('products', 'categories', 'banners', 'stories', 'pages', 'settings')
+
+# Версии читаются из кэша; при кэше в памяти процесса чужие изменения видны не позже чем через столько секунд
+VERSION_CACHE_TIMEOUT = 5
+
+
+def _cache_key(domain):
+    return f'content_version:{domain}'
+
+
+def get_content_versions(domains):
+    """{раздел: (версия, время изменения)}; база читается только для разделов, которых нет в кэше."""
+    cached = cache.get_many([_cache_key(domain) for domain in domains])
+    versions = {domain: cached[_cache_key(domain)] for domain in domains if _cache_key(domain) in cached}
+    missing = [domain for domain in domains if domain not in versions]
+    if missing:
+        rows = list(ContentVersion.objects.filter(domain__in=missing))
+        if len(rows) < len(missing):
+            # Первое обращение к разделу: заводим строку, чтобы у ответа сразу был Last-Modified
+            ContentVersion.objects.bulk_create(
+                [ContentVersion(domain=domain) for domain in missing], ignore_conflicts=True
+            )
+            rows = list(ContentVersion.objects.filter(domain__in=missing))
+        loaded = {row.domain: (row.version, row.updated_at.timestamp()) for row in rows}
+        cache.set_many({_cache_key(domain): value for domain, value in loaded.items()}, VERSION_CACHE_TIMEOUT)
+        versions.update(loaded)
+    return versions
+
+
+def increment_content_version(domain):
+    """Сразу увеличивает версию раздела в базе и возвращает новую (версия, время изменения)."""
+    updated = ContentVersion.objects.filter(domain=domain).update(version=F('version') + 1, updated_at=timezone.now())
+    if not updated:
+        ContentVersion.objects.get_or_create(domain=domain, defaults={'version': 1})
+    row = ContentVersion.objects.get(domain=domain)
+    value = (row.version, row.updated_at.timestamp())
+    cache.set(_cache_key(domain), value, VERSION_CACHE_TIMEOUT)
+    return value
+
+
+def bump_content_version(domain):
+    # Только после коммита: иначе клиент успел бы получить старые данные с новым ETag и закэшировать их
+    transaction.on_commit(lambda: increment_content_version(domain))
+
+
+def content_validators(domains, user_id=None, user_version=None):
+    """
+    ETag и Last-Modified для набора разделов с учётом языка и, если ответ персональный, пользователя
+    и версии его собственных данных (user_version).
+    """
+    versions = get_content_versions(domains)
+    parts = [get_language()] + [f'{domain[0]}{versions[domain][0]}' for domain in domains]
+    if user_id is not None:
+        parts.append(f'u{user_id}')
+    if user_version is not None:
+        parts.append(str(user_version))
+    last_modified = max(timestamp for _, timestamp in versions.values())
+    return quote_etag('-'.join(parts)), int(last_modified)
+
+
+def is_not_modified(request, etag, last_modified):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        return '*' in tags or etag in tags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return bool(last_modified) and if_modified_since is not None and last_modified <= if_modified_since
+
+
+def set_validators(response, etag, last_modified, per_user=False):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'no-cache'
+    vary = [value.strip() for value in response.get('Vary', '').split(',') if value.strip()]
+    for header in ('Accept-Language', 'Authorization') if per_user else ('Accept-Language',):
+        if header not in vary:
+            vary.append(header)
+    response['Vary'] = ', '.join(vary)
+    return response
+
+
+class NotModified(APIException):
+    status_code = status.HTTP_304_NOT_MODIFIED
+
+
+class ContentVersionMixin:
+    """
+    Условный GET для редко меняющегося контента: ETag и Last-Modified строятся из версий разделов
+    content_domains, и совпавший If-None-Match получает 304 до запросов к моделям и сериализатора.
+    Если ответ зависит от пользователя (per_user_content), в ETag входит его id и user_content_version —
+    персональные данные меняются без смены версии раздела.
+    """
+    content_domains = ()
+    per_user_content = False
+
+    def user_content_version(self, request):
+        return None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.content_etag = None
+        if request.method in ('GET', 'HEAD'):
+            user_id = request.user.pk if self.per_user_content and request.user.is_authenticated else None
+            user_version = self.user_content_version(request) if user_id is not None else None
+            self.content_etag, self.content_last_modified = content_validators(
+                self.content_domains, user_id, user_version
+            )
+            if is_not_modified(request, self.content_etag, self.content_last_modified):
+                raise NotModified()
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return Response(status=status.HTTP_304_NOT_MODIFIED)
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'content_etag', None) and response.status_code in (200, 304):
+            set_validators(response, self.content_etag, self.content_last_modified, self.per_user_content)
+        return response
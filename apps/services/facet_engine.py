@@ -0,0 +1,395 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.expressions import RawSQL
+from modeltranslation.utils import build_localized_fieldname, get_language
+
+from apps.product.models import Color, Country, Gender, ProductListing, Size
+from apps.services.category_tree import get_category_tree, iter_category_nodes
+from apps.services.content_versions import get_content_versions, increment_content_version
+
+# Фасет -> (модель справочника, поле записи продукта)
+FACETS = {
+    'sizes': (Size, 'size_ids'),
+    'colors': (Color, 'color_ids'),
+    'genders': (Gender, 'gender_id'),
+    'countries': (Country, 'country_id'),
+}
+
+# Поля проекции, изменение которых меняет индекс (остаток важен только через in_stock)
+FACET_LISTING_FIELDS = ('is_active', 'category_id', 'in_stock', 'effective_price', 'size_ids', 'color_ids')
+
+# Каждые RANGE_BLOCK значений диапазонного индекса хранится готовое объединение всех меньших значений
+RANGE_BLOCK = 1024
+
+# Версия индекса — строка ContentVersion: её видят все процессы, даже если кэш у каждого свой
+VERSION_DOMAIN = 'facet_index'
+
+# Номера установленных битов для каждого значения байта
+BYTE_BITS = [tuple(bit for bit in range(8) if value >> bit & 1) for value in range(256)]
+
+
+def to_bitset(ids):
+    """Множество id как целое число: бит с номером id установлен."""
+    ids = list(ids)
+    if not ids:
+        return 0
+    data = bytearray(max(ids) // 8 + 1)
+    for product_id in ids:
+        data[product_id >> 3] |= 1 << (product_id & 7)
+    return int.from_bytes(data, 'little')
+
+
+def iter_bitset(bitset):
+    """id из битового множества по возрастанию (побайтово, за линейное время)."""
+    data = bitset.to_bytes((bitset.bit_length() + 7) // 8, 'little')
+    for index, byte in enumerate(data):
+        if byte:
+            base = index * 8
+            for bit in BYTE_BITS[byte]:
+                yield base + bit
+
+
+def bitset_filter(queryset, bitset):
+    """Ограничивает queryset продуктами из битового множества одним параметром-массивом."""
+    if not bitset:
+        return queryset.none()
+    return queryset.filter(id__in=RawSQL('SELECT unnest(%s::bigint[])', (list(iter_bitset(bitset)),)))
+
+
+class RangeIndex:
+    """
+    Значения, отсортированные вместе с id, и префиксные битовые множества через каждые RANGE_BLOCK позиций:
+    диапазон [low, high] — это разность двух префиксов, досчитанных не более чем по RANGE_BLOCK элементам.
+    """
+
+    def __init__(self, values):
+        pairs = sorted((value, product_id) for product_id, value in values.items())
+        self.values = [value for value, _ in pairs]
+        self.ids = [product_id for _, product_id in pairs]
+        self.prefixes = [0]
+        for start in range(0, len(self.ids), RANGE_BLOCK):
+            self.prefixes.append(self.prefixes[-1] | to_bitset(self.ids[start:start + RANGE_BLOCK]))
+
+    def prefix(self, position):
+        block, rest = divmod(position, RANGE_BLOCK)
+        start = block * RANGE_BLOCK
+        return self.prefixes[block] | to_bitset(self.ids[start:start + rest])
+
+    def between(self, low=None, high=None):
+        start = 0 if low is None else bisect_left(self.values, low)
+        stop = len(self.values) if high is None else bisect_right(self.values, high)
+        if start >= stop:
+            return 0
+        return self.prefix(stop) & ~self.prefix(start)
+
+
+class FacetIndex:
+    """
+    Битовые множества id активных продуктов: по значению каждого фасета, по категории (без потомков),
+    «в наличии», а также диапазонные индексы цены и рейтинга. Сочетание фильтров — AND множеств
+    разных фасетов и OR значений внутри фасета.
+    """
+
+    def __init__(self, token):
+        self.token = token
+        self.built_at = time.monotonic()
+        self.records = {}
+        self.labels = {}
+        self.reset_bitsets()
+
+    def reset_bitsets(self):
+        self.all = 0
+        self.in_stock = 0
+        self.categories = {}
+        self.values = {facet: {} for facet in FACETS}
+        self._prices = None
+        self._ratings = None
+
+    def _rows(self, product_ids=None):
+        queryset = ProductListing.objects.filter(is_active=True)
+        if product_ids is not None:
+            queryset = queryset.filter(product_id__in=product_ids)
+        return queryset.values_list(
+            'product_id', 'category_id', 'in_stock', 'effective_price', 'size_ids', 'color_ids',
+            'product__gender_id', 'product__country_id', 'product__rating_stats__average_rating',
+        )
+
+    def _record(self, row):
+        product_id, category_id, in_stock, price, size_ids, color_ids, gender_id, country_id, rating = row
+        return {
+            'category_id': category_id, 'in_stock': in_stock, 'price': price, 'rating': rating or 0.0,
+            'size_ids': size_ids, 'color_ids': color_ids,
+            'gender_id': [gender_id] if gender_id else [], 'country_id': [country_id] if country_id else [],
+        }
+
+    def _members(self, records):
+        """Словари «ключ -> список id» для построения множеств одним проходом."""
+        members = {'categories': {}, 'in_stock': [], **{facet: {} for facet in FACETS}}
+        for product_id, record in records.items():
+            members['categories'].setdefault(record['category_id'], []).append(product_id)
+            if record['in_stock']:
+                members['in_stock'].append(product_id)
+            for facet, (_, field) in FACETS.items():
+                for value in record[field]:
+                    members[facet].setdefault(value, []).append(product_id)
+        return members
+
+    def build(self):
+        self.records = {row[0]: self._record(row) for row in self._rows().iterator(chunk_size=5000)}
+        self.reset_bitsets()
+        members = self._members(self.records)
+        self.all = to_bitset(self.records)
+        self.in_stock = to_bitset(members['in_stock'])
+        self.categories = {key: to_bitset(ids) for key, ids in members['categories'].items()}
+        for facet in FACETS:
+            self.values[facet] = {key: to_bitset(ids) for key, ids in members[facet].items()}
+        return self
+
+    def update_products(self, product_ids):
+        """Переиндексирует продукты: снимает их биты и ставит заново по текущим данным."""
+        product_ids = set(product_ids)
+        fresh = {row[0]: self._record(row) for row in self._rows(product_ids)}
+        mask = to_bitset(product_ids)
+        self.all &= ~mask
+        self.in_stock &= ~mask
+        for bitsets in (self.categories, *self.values.values()):
+            for key in list(bitsets):
+                bitsets[key] &= ~mask
+        for product_id in product_ids:
+            self.records.pop(product_id, None)
+
+        self.records.update(fresh)
+        members = self._members(fresh)
+        self.all |= to_bitset(fresh)
+        self.in_stock |= to_bitset(members['in_stock'])
+        for key, ids in members['categories'].items():
+            self.categories[key] = self.categories.get(key, 0) | to_bitset(ids)
+        for facet in FACETS:
+            for key, ids in members[facet].items():
+                self.values[facet][key] = self.values[facet].get(key, 0) | to_bitset(ids)
+        # Диапазонные индексы дешевле перестроить при следующем запросе, чем править сортированные списки
+        self._prices = self._ratings = None
+
+    @property
+    def prices(self):
+        if self._prices is None:
+            self._prices = RangeIndex({product_id: record['price'] for product_id, record in self.records.items()})
+        return self._prices
+
+    @property
+    def ratings(self):
+        if self._ratings is None:
+            self._ratings = RangeIndex({product_id: record['rating'] for product_id, record in self.records.items()})
+        return self._ratings
+
+    def get_labels(self, language):
+        """Названия значений фасетов на языке; пустой перевод заменяется языком по умолчанию."""
+        if language not in self.labels:
+            self.labels[language] = {facet: load_labels(model, language) for facet, (model, _) in FACETS.items()}
+        return self.labels[language]
+
+    def subtree(self, category_ids):
+        """Продукты категорий и всех их потомков."""
+        category_ids = set(category_ids)
+        bitset = 0
+
+        def walk(nodes, inside):
+            nonlocal bitset
+            for node in nodes:
+                selected = inside or node['id'] in category_ids
+                if selected:
+                    bitset |= self.categories.get(node['id'], 0)
+                walk(node['subcategories'], selected)
+
+        walk(get_category_tree(), False)
+        return bitset
+
+    def search(self, selection, with_counts=True):
+        """
+        selection: {'sizes': {id, ...}, 'colors': ..., 'genders': ..., 'countries': ...,
+        'categories': {id, ...}, 'price_min', 'price_max', 'rating_min', 'in_stock'}.
+        Возвращает (множество найденных id, {фасет: {id значения: число продуктов}}). Число для значения
+        фасета считается с учётом всех остальных фильтров, кроме фильтра по самому этому фасету.
+        """
+        base = self.all
+        if selection.get('in_stock'):
+            base &= self.in_stock
+        if selection.get('categories') is not None:
+            base &= self.subtree(selection['categories'])
+        if selection.get('price_min') is not None or selection.get('price_max') is not None:
+            base &= self.prices.between(selection.get('price_min'), selection.get('price_max'))
+        if selection.get('rating_min') is not None:
+            base &= self.ratings.between(selection['rating_min'])
+
+        masks = {}
+        for facet in FACETS:
+            if selection.get(facet) is not None:
+                mask = 0
+                for value in selection[facet]:
+                    mask |= self.values[facet].get(value, 0)
+                masks[facet] = mask
+
+        matched = base
+        for mask in masks.values():
+            matched &= mask
+        if not with_counts:
+            return matched, {}
+
+        counts = {}
+        for facet in FACETS:
+            scope = base
+            for other, mask in masks.items():
+                if other != facet:
+                    scope &= mask
+            counts[facet] = {
+                value: count for value, bitset in self.values[facet].items()
+                if (count := (scope & bitset).bit_count())
+            }
+        return matched, counts
+
+
+_index = None
+_lock = threading.RLock()
+
+
+def _current_token():
+    # (версия, время изменения) из кэша версий: изменения других процессов видны не позже чем через
+    # VERSION_CACHE_TIMEOUT секунд, и не раньше их коммита
+    return get_content_versions((VERSION_DOMAIN,))[VERSION_DOMAIN]
+
+
+def get_facet_index():
+    """Индекс этого процесса; если версия в базе сменилась (изменение в другом процессе), он строится заново."""
+    global _index
+    token = _current_token()
+    with _lock:
+        if _index is None or _index.token != token:
+            _index = FacetIndex(token).build()
+        return _index
+
+
+def _bump():
+    return increment_content_version(VERSION_DOMAIN)
+
+
+def _apply_changes(product_ids):
+    global _index
+    token = _bump()
+    with _lock:
+        # Версия выросла ровно на единицу — других изменений после построения индекса не было, и его можно
+        # поправить на месте; иначе его перестроит следующий запрос
+        if _index is not None and _index.token[0] == token[0] - 1:
+            _index.update_products(product_ids)
+            _index.token = token
+
+
+def facet_products_changed(product_ids):
+    """
+    После коммита меняет версию индекса (другие процессы перестроят свой при следующем запросе)
+    и переиндексирует продукты в индексе этого процесса.
+    """
+    product_ids = {product_id for product_id in product_ids if product_id is not None}
+    if not product_ids:
+        return
+    transaction.on_commit(lambda: _apply_changes(product_ids))
+
+
+def invalidate_facet_index():
+    """Полная перестройка во всех процессах — после массовых изменений без сигналов."""
+    transaction.on_commit(_bump)
+
+
+# Параметр фильтра -> фасет. Правила сопоставления названий ниже общие для индекса и SQL-варианта
+# ProductFilter, чтобы use_facet_engine не менял выдачу
+FILTER_FACETS = {'size': 'sizes', 'color': 'colors', 'gender': 'genders', 'country': 'countries'}
+
+
+def load_labels(model, language):
+    """{id: название} справочника на языке; пустой перевод заменяется языком по умолчанию, как в modeltranslation."""
+    localized = build_localized_fieldname('name', language)
+    fields = ['id', 'name'] + ([localized] if model is not Size else [])
+    return {row['id']: row.get(localized) or row['name'] for row in model.objects.values(*fields)}
+
+
+def _match_labels(labels, values, contains=False):
+    values = [value.lower() for value in values]
+    return {
+        value_id for value_id, label in labels.items()
+        if any((value in label.lower()) if contains else value == label.lower() for value in values)
+    }
+
+
+def match_filter_values(param, value, labels):
+    """
+    id значений фасета для параметра фильтра без учёта регистра: size/color/gender — точные названия
+    через запятую, country — подстрока названия.
+    """
+    if param == 'country':
+        return _match_labels(labels, [value], contains=True)
+    return _match_labels(labels, [item.strip() for item in value.split(',')])
+
+
+def leaf_category_ids(name, language=None):
+    """Конечные категории с точно таким названием на языке запроса."""
+    return {
+        node['id'] for node in iter_category_nodes(get_category_tree(language))
+        if node['name'] == name and not node['subcategories']
+    }
+
+
+def parse_selection(params, language=None):
+    """
+    Выбор из параметров ProductFilter: size/color/gender — списки через запятую, country — подстрока
+    названия, category — название конечной категории, price_min/price_max/rating_min. Названия
+    сравниваются на языке запроса.
+    """
+    language = language or get_language()
+    labels = get_facet_index().get_labels(language)
+    selection = {}
+    for param, facet in FILTER_FACETS.items():
+        if params.get(param):
+            selection[facet] = match_filter_values(param, params[param], labels[facet])
+    if params.get('category'):
+        selection['categories'] = leaf_category_ids(params['category'], language)
+    for param in ('price_min', 'price_max'):
+        if params.get(param) not in (None, ''):
+            selection[param] = Decimal(str(params[param]))
+    if params.get('rating_min') not in (None, ''):
+        selection['rating_min'] = min(float(value) for value in str(params['rating_min']).split(','))
+    if 'in_stock' in params:
+        selection['in_stock'] = params['in_stock']
+    return selection
+
+
+def facet_search(selection, language=None):
+    """Найденные id и счётчики значений фасетов с названиями на языке запроса («M (12)»)."""
+    index = get_facet_index()
+    with _lock:
+        matched, counts = index.search(selection)
+    labels = index.get_labels(language or get_language())
+    facets = {}
+    for facet, values in counts.items():
+        facets[facet] = sorted((
+            {'id': value_id, 'name': labels[facet].get(value_id, ''), 'count': count,
+             'label': f"{labels[facet].get(value_id, '')} ({count})",
+             'selected': value_id in (selection.get(facet) or ())}
+            for value_id, count in values.items()
+        ), key=lambda item: item['name'])
+    return matched, facets
+
+
+def match_products(selection):
+    index = get_facet_index()
+    with _lock:
+        return index.search(selection, with_counts=False)[0]
+
+
+def reset_facet_index():
+    global _index
+    with _lock:
+        _index = None
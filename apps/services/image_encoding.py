@@ -0,0 +1,49 @@
+# Кодирование вариантов изображений. Модуль не импортирует Django: функции выполняются
+# в дочерних процессах пула, которым не нужна настройка проекта.
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+try:
+    import pillow_avif  # noqa: F401 — регистрирует кодек AVIF в Pillow
+except ImportError:
+    pillow_avif = None
+
+# Ширины вариантов: миниатюра, список, карточка и увеличение
+VARIANT_WIDTHS = {'thumbnail': 200, 'list': 400, 'detail': 800, 'zoom': 1600}
+
+FORMAT_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 85, 'method': 4},
+    'avif': {'format': 'AVIF', 'quality': 60},
+}
+
+
+def available_formats():
+    # Pillow регистрирует кодеры лениво, до init() в Image.SAVE есть только подключённые плагины
+    Image.init()
+    return [name for name, options in FORMAT_OPTIONS.items() if options['format'] in Image.SAVE]
+
+
+def variant_widths(original_width):
+    """Ширины без увеличения исходника; если он уже миниатюры, остаётся один вариант исходной ширины."""
+    widths = {name: width for name, width in VARIANT_WIDTHS.items() if width <= original_width}
+    return widths or {'thumbnail': original_width}
+
+
+def read_size(source):
+    with Image.open(BytesIO(source)) as image:
+        return ImageOps.exif_transpose(image).size
+
+
+def encode_variant(source, width, image_format):
+    """Возвращает (байты, ширина, высота) варианта заданной ширины в формате webp/avif."""
+    with Image.open(BytesIO(source)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+        height = max(1, round(image.height * width / image.width))
+        if width != image.width:
+            image = image.resize((width, height), Image.LANCZOS)
+        output = BytesIO()
+        image.save(output, **FORMAT_OPTIONS[image_format])
+        return output.getvalue(), width, height
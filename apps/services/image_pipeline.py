@@ -0,0 +1,145 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.dispatch import Signal
+
+from apps.product.models import Product, ProductImage
+from apps.services.image_encoding import (
+    VARIANT_WIDTHS,
+    available_formats,
+    encode_variant,
+    read_size,
+    variant_widths,
+)
+
+logger = logging.getLogger(__name__)
+
+# Модель -> (поле файла, поле хэша, поле вариантов)
+IMAGE_FIELDS = {
+    Product: ('photo', 'photo_hash', 'photo_variants'),
+    ProductImage: ('image', 'image_hash', 'image_variants'),
+}
+
+IMAGE_WORKERS = min(4, os.cpu_count() or 1)
+
+# Отправляется, когда у объекта записаны новые варианты (sender — модель, instance — объект)
+variants_ready = Signal()
+
+_process_pool = None
+# Один поток-диспетчер: задачи изображений выполняются по очереди, кодирование каждой — параллельно в пуле
+_dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-pipeline')
+
+
+def get_process_pool():
+    global _process_pool
+    if _process_pool is None:
+        # spawn: дочерние процессы не наследуют потоки и соединения с базой веб-процесса
+        _process_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _process_pool
+
+
+def schedule_image_processing(instance):
+    """Ставит обработку изображения в фон после коммита транзакции, в которой сохранён объект."""
+    model, pk = type(instance), instance.pk
+    transaction.on_commit(lambda: _dispatcher.submit(_process_in_background, model, pk))
+
+
+def _process_in_background(model, pk):
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is not None:
+            process_image_variants(instance)
+    except Exception:
+        logger.exception("Не удалось обработать изображение %s #%s", model.__name__, pk)
+    finally:
+        close_old_connections()
+
+
+def process_image_variants(instance, force=False):
+    """
+    Строит варианты изображения всех ширин в webp и avif. Если хэш содержимого не изменился,
+    ничего не делает. Файлы вариантов адресуются хэшем, поэтому одинаковые картинки не дублируются.
+    """
+    file_field, hash_field, variants_field = IMAGE_FIELDS[type(instance)]
+    file = getattr(instance, file_field)
+    if not file:
+        return False
+
+    with file.open('rb'):
+        source = file.read()
+    digest = hashlib.sha256(source).hexdigest()
+    if not force and digest == getattr(instance, hash_field) and getattr(instance, variants_field):
+        return False
+
+    width, _ = read_size(source)
+    widths = variant_widths(width)
+    pool = get_process_pool()
+    futures = {
+        (name, image_format): pool.submit(encode_variant, source, variant_width, image_format)
+        for name, variant_width in widths.items()
+        for image_format in available_formats()
+    }
+
+    storage = file.storage
+    directory = f"{file.field.upload_to.rstrip('/')}/variants/{digest[:2]}/{digest}"
+    variants = []
+    for (name, image_format), future in futures.items():
+        data, variant_width, variant_height = future.result()
+        path = f'{directory}/{variant_width}.{image_format}'
+        if not storage.exists(path):
+            path = storage.save(path, ContentFile(data))
+        variants.append({
+            'name': name, 'format': image_format, 'width': variant_width, 'height': variant_height, 'path': path,
+        })
+
+    # Файл мог смениться, пока шло кодирование, — тогда результат устарел и записывать его нельзя
+    updated = type(instance).objects.filter(pk=instance.pk, **{file_field: file.name}).update(
+        **{hash_field: digest, variants_field: variants}
+    )
+    setattr(instance, hash_field, digest)
+    setattr(instance, variants_field, variants)
+    if updated:
+        variants_ready.send(sender=type(instance), instance=instance)
+    return bool(updated)
+
+
+def _absolute_url(storage, path, request):
+    url = storage.url(path)
+    return request.build_absolute_uri(url) if request else url
+
+
+def image_srcset(file, variants, request=None):
+    """
+    Варианты для клиента: строки srcset по форматам и адреса по названиям ширин,
+    чтобы список мог загрузить миниатюру 200px вместо картинки 800px.
+    """
+    if not variants:
+        return None
+    srcset = {}
+    sizes = {}
+    for variant in sorted(variants, key=lambda item: item['width']):
+        url = _absolute_url(file.storage, variant['path'], request)
+        srcset.setdefault(variant['format'], []).append(f"{url} {variant['width']}w")
+        size = sizes.setdefault(variant['name'], {'width': variant['width'], 'height': variant['height']})
+        size[variant['format']] = url
+    return {**{image_format: ', '.join(items) for image_format, items in srcset.items()}, 'sizes': sizes}
+
+
+def preferred_image_url(file, variants, request=None, name='detail', image_format='webp'):
+    """Адрес варианта нужной ширины; ближайший меньший, если такого нет, и исходный файл, пока вариантов нет."""
+    if not file:
+        return None
+    order = list(VARIANT_WIDTHS)
+    candidates = [
+        variant for variant in variants or []
+        if variant['format'] == image_format and order.index(variant['name']) <= order.index(name)
+    ]
+    if candidates:
+        best = max(candidates, key=lambda variant: variant['width'])
+        return _absolute_url(file.storage, best['path'], request)
+    return _absolute_url(file.storage, file.name, request)
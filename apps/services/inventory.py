@@ -0,0 +1,70 @@
+from django.db import connection, transaction
+
+from apps.product.models import ProductSize
+from apps.services.category_facets import invalidate_product_facets
+from apps.services.content_versions import bump_content_version
+from apps.services.facet_engine import FACET_LISTING_FIELDS, facet_products_changed
+from apps.services.listing_projection import refresh_product_listings
+from apps.services.product_documents import schedule_document_rebuild
+from apps.services.response_cache import invalidate_model
+
+# Один оператор на весь заказ: строки вариантов блокируются в порядке id (параллельные заказы с общими
+# вариантами не взаимоблокируются), остаток уменьшается только там, где его хватает. После ожидания
+# блокировки PostgreSQL перепроверяет условие на свежей версии строки, поэтому продать больше остатка нельзя.
+RESERVE_SQL = """
+    WITH requested AS (
+        SELECT variant.id, requested.quantity
+        FROM {product_size} variant
+        JOIN unnest(%(ids)s::bigint[], %(quantities)s::integer[]) AS requested(id, quantity)
+            ON requested.id = variant.id
+        ORDER BY variant.id
+        FOR UPDATE OF variant
+    )
+    UPDATE {product_size} variant
+    SET quantity = variant.quantity - requested.quantity
+    FROM requested
+    WHERE variant.id = requested.id AND variant.quantity >= requested.quantity
+    RETURNING variant.id, variant.quantity
+"""
+
+
+class InsufficientStock(Exception):
+    def __init__(self, shortages):
+        # {id варианта: сколько есть сейчас}
+        self.shortages = shortages
+        super().__init__(f"Недостаточно остатка для вариантов {sorted(shortages)}")
+
+
+def reserve_stock(quantities):
+    """
+    Списывает остатки {id варианта: количество} одним UPDATE и возвращает {id: новый остаток}.
+    Если хотя бы одной позиции не хватает, ничего не списывается и поднимается InsufficientStock
+    с текущими остатками нехватающих вариантов. Сигналы ProductSize не отправляются.
+    """
+    quantities = {product_size_id: quantity for product_size_id, quantity in quantities.items() if quantity}
+    if not quantities:
+        return {}
+    params = {'ids': list(quantities), 'quantities': list(quantities.values())}
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                RESERVE_SQL.format(product_size=connection.ops.quote_name(ProductSize._meta.db_table)), params
+            )
+            reserved = dict(cursor.fetchall())
+        if len(reserved) < len(quantities):
+            # Строки ещё заблокированы этой транзакцией — остатки точные; выход из atomic откатит списание
+            missing = [product_size_id for product_size_id in quantities if product_size_id not in reserved]
+            shortages = dict.fromkeys(missing, 0)
+            shortages.update(ProductSize.objects.filter(id__in=missing).values_list('id', 'quantity'))
+            raise InsufficientStock(shortages)
+    return reserved
+
+
+def stock_changed(product_ids):
+    """То, что при сохранении вариантов по одному делали бы сигналы ProductSize, — один раз на заказ."""
+    product_ids = list(product_ids)
+    facet_products_changed(refresh_product_listings(product_ids, watch_fields=FACET_LISTING_FIELDS))
+    invalidate_product_facets(product_ids)
+    schedule_document_rebuild(product_ids)
+    invalidate_model(ProductSize)
+    bump_content_version('products')
@@ -0,0 +1,107 @@
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import transaction
+from django.db.models import Count, DecimalField, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce, NullIf
+
+from apps.product.models import Product, ProductListing, ProductSize
+
+# Поля продукта, от которых зависит проекция
+LISTING_FIELDS = {'is_active', 'category', 'category_id', 'price', 'discounted_price'}
+
+PROJECTION_FIELDS = ['is_active', 'category', 'effective_price', 'min_variant_price', 'max_variant_price',
+                     'variant_count', 'stock_quantity', 'in_stock', 'size_ids', 'color_ids']
+
+
+def effective_price(price, discounted_price):
+    # Как при оформлении заказа: нулевая скидочная цена не считается скидкой
+    return discounted_price or price
+
+
+def _variant_price():
+    return Coalesce(NullIf('discounted_price', Value(0, output_field=DecimalField())), 'price')
+
+
+def _listing_rows(product_ids, product_model, size_model, listing_model):
+    # Размеры и цвета — всех вариантов, как в прежнем фильтре по product_sizes; наличие — отдельно, в in_stock
+    in_stock = Q(quantity__gt=0)
+    variants = {
+        row['product_id']: row
+        for row in size_model.objects.filter(product_id__in=product_ids).order_by().values('product_id').annotate(
+            variant_count=Count('id'),
+            min_variant_price=Min(_variant_price()),
+            max_variant_price=Max(_variant_price()),
+            stock_quantity=Sum('quantity', filter=in_stock, default=0),
+            size_ids=ArrayAgg('size_id', distinct=True, ordering='size_id', default=Value([])),
+            color_ids=ArrayAgg('color_id', distinct=True, ordering='color_id', default=Value([])),
+        )
+    }
+    rows = []
+    products = product_model.objects.filter(id__in=product_ids).values(
+        'id', 'is_active', 'category_id', 'price', 'discounted_price',
+    )
+    for product in products:
+        row = variants.get(product['id'], {})
+        stock_quantity = row.get('stock_quantity', 0)
+        rows.append(listing_model(
+            product_id=product['id'],
+            is_active=product['is_active'],
+            category_id=product['category_id'],
+            effective_price=effective_price(product['price'], product['discounted_price']),
+            min_variant_price=row.get('min_variant_price'),
+            max_variant_price=row.get('max_variant_price'),
+            variant_count=row.get('variant_count', 0),
+            stock_quantity=stock_quantity,
+            in_stock=stock_quantity > 0,
+            size_ids=row.get('size_ids', []),
+            color_ids=row.get('color_ids', []),
+        ))
+    return rows
+
+
+def refresh_product_listings(product_ids, product_model=Product, size_model=ProductSize,
+                             listing_model=ProductListing, watch_fields=()):
+    """
+    Пересчитывает проекции указанных продуктов: один агрегат по вариантам, одна выборка продуктов
+    и одна вставка с обновлением. Нужно вызывать после bulk-операций, которые не отправляют сигналы.
+    Возвращает id продуктов, у которых изменилось хотя бы одно из watch_fields (или появилась проекция).
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return set()
+    with transaction.atomic():
+        previous = {}
+        if watch_fields:
+            previous = {
+                row[0]: row[1:]
+                for row in listing_model.objects.filter(product_id__in=product_ids).values_list('product_id', *watch_fields)
+            }
+        rows = _listing_rows(product_ids, product_model, size_model, listing_model)
+        listing_model.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=PROJECTION_FIELDS,
+            batch_size=1000,
+        )
+    if not watch_fields:
+        return set()
+    return {
+        row.product_id for row in rows
+        if previous.get(row.product_id) != tuple(getattr(row, field) for field in watch_fields)
+    }
+
+
+def rebuild_product_listings(batch_size=1000, product_model=Product, size_model=ProductSize,
+                             listing_model=ProductListing):
+    """Полностью пересобирает проекции пачками по batch_size продуктов. Возвращает число продуктов."""
+    total = 0
+    last_id = 0
+    while True:
+        product_ids = list(
+            product_model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not product_ids:
+            return total
+        refresh_product_listings(product_ids, product_model, size_model, listing_model)
+        total += len(product_ids)
+        last_id = product_ids[-1]
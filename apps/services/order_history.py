@@ -0,0 +1,21 @@
+from django.db.models import Prefetch
+
+from apps.orders.models import OrderItem
+from apps.product.models import ProductImage
+
+
+def apply_order_history_plan(queryset):
+    """
+    План запроса для истории заказов (OrderListSerializer): адрес, склад и пользователь подтягиваются join'ом,
+    позиции с вариантом, продуктом, размером и цветом — одним prefetch, фото продуктов — ещё одним.
+    Число запросов не зависит ни от количества заказов на странице, ни от позиций в них.
+    """
+    return queryset.select_related('user', 'user_address', 'warehouse').prefetch_related(
+        Prefetch(
+            'order_items',
+            queryset=OrderItem.objects.select_related(
+                'product_size__product', 'product_size__size', 'product_size__color'
+            ).order_by('id'),
+        ),
+        Prefetch('order_items__product_size__product__product_images', queryset=ProductImage.objects.order_by('id')),
+    )
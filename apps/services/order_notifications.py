@@ -0,0 +1,122 @@
+from datetime import datetime
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import send_mail
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.html import strip_tags
+
+from apps.orders.models import Order
+from apps.services.firebase_notification import send_firebase_notification
+from apps.services.outbox import enqueue, register_handler
+from apps.services.send_telegram_message import send_telegram_message
+
+# Побочные эффекты заказа. enqueue_* вызываются в транзакции заказа и только пишут outbox (веб-сокет без
+# общего слоя каналов — исключение), обработчики выполняет воркер run_outbox_worker; данные заказа они
+# читают сами — в outbox лежат только id.
+
+READABLE_STATUSES = {
+    'pending': 'В ожидании',
+    'in_progress': 'В процессе',
+    'delivery': 'Доставка',
+    'completed': 'Завершено',
+    'cancelled': 'Отменено',
+}
+
+
+def get_readable_order_status(status):
+    return READABLE_STATUSES.get(status, 'Неизвестный статус')
+
+
+def enqueue_status_push(order):
+    enqueue('push', {'order_id': order.id, 'order_status': order.order_status})
+
+
+def has_shared_channel_layer():
+    # InMemoryChannelLayer живёт в памяти одного процесса: из воркера сообщение до daphne не дойдёт
+    return not isinstance(get_channel_layer(), InMemoryChannelLayer)
+
+
+def enqueue_new_order_notifications(order):
+    if has_shared_channel_layer():
+        enqueue('websocket', {'order_id': order.id})
+    else:
+        # Без REDIS_URL админку уведомляет процесс, создавший заказ, — после коммита, как раньше
+        order_id = order.id
+        transaction.on_commit(lambda: _send_new_order(order_id))
+    if settings.TELEGRAM_BOT_TOKEN and settings.TELEGRAM_CHAT_ID:
+        enqueue('telegram', {'order_id': order.id})
+
+
+def enqueue_confirmation_email(order, email):
+    enqueue('email', {'order_id': order.id, 'email': email})
+
+
+@register_handler('push')
+def send_status_push(payload):
+    order = Order.objects.select_related('user').filter(id=payload['order_id']).first()
+    if order is None or not order.user or not order.user.fcm_token:
+        return
+    # Статус из сообщения, а не текущий: каждое изменение статуса — своё уведомление
+    readable_status = get_readable_order_status(payload['order_status'])
+    send_firebase_notification(
+        order.user.fcm_token,
+        "Изменение статуса заказа",
+        f"Статус вашего заказа {order.id} изменен на {payload['order_status']}",
+        data={
+            "order_id": str(order.id),
+            "status": str(readable_status),
+            "date": str(datetime.now().strftime("%d/%m/%Y, %H:%M:%S")),
+            "type": "notificationPage",
+        },
+    )
+
+
+def _send_new_order(order_id):
+    async_to_sync(get_channel_layer().group_send)(
+        "orders_notifications", {
+            "type": "send_notification",
+            "message": f"Новый заказ №: {order_id}"
+        }
+    )
+
+
+@register_handler('websocket')
+def broadcast_new_order(payload):
+    # Из процесса воркера сообщение дойдёт до админки только через общий слой каналов (Redis); со слоем
+    # в памяти оно молча потерялось бы, поэтому не отмечается выполненным, а уходит в повтор
+    if not has_shared_channel_layer():
+        raise ImproperlyConfigured("Веб-сокет из воркера outbox требует общий слой каналов: задайте REDIS_URL")
+    _send_new_order(payload['order_id'])
+
+
+@register_handler('email')
+def send_confirmation_email(payload):
+    order = Order.objects.only('id', 'total_amount').filter(id=payload['order_id']).first()
+    if order is None:
+        return
+    html_message = render_to_string('order_confirmation_email.html', {'order': order})
+    send_mail(
+        subject='Ваш заказ успешно создан',
+        message=strip_tags(html_message),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipient_list=[payload['email']],
+        fail_silently=False,
+        html_message=html_message
+    )
+
+
+@register_handler('telegram')
+def send_new_order_to_telegram(payload):
+    order = Order.objects.select_related('user').filter(id=payload['order_id']).first()
+    if order is None:
+        return
+    phone_number = order.user.phone_number if order.user else 'Номер не указан'
+    send_telegram_message(
+        settings.TELEGRAM_BOT_TOKEN,
+        settings.TELEGRAM_CHAT_ID,
+        f"Новый заказ #{order.id}\nНомер: {phone_number}\nОбщая сумма: {order.total_amount} сом",
+    )
@@ -0,0 +1,119 @@
+from collections import Counter
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from rest_framework import serializers
+
+from apps.authentication.models import User
+from apps.orders.models import Order, OrderItem, PromoCode, variant_unit_price
+from apps.product.models import ProductSize
+from apps.services.inventory import InsufficientStock, reserve_stock, stock_changed
+
+
+def load_variants(product_size_ids):
+    """Варианты корзины с продуктом, размером, цветом и фото продукта: два запроса на любую корзину."""
+    return ProductSize.objects.select_related('product', 'size', 'color').prefetch_related(
+        'product__product_images'
+    ).in_bulk(set(product_size_ids))
+
+
+class OrderAssembler:
+    """
+    Сборка заказа из корзины: все варианты загружаются одним запросом, цены, промокод и бонусы считаются
+    в памяти, остатки списываются одним условным UPDATE, позиции пишутся одним bulk_create, а заказ
+    сохраняется один раз — сигналы заказа срабатывают один раз на заказ, а не на каждую позицию.
+    """
+
+    def __init__(self, user, items, promo_code=None):
+        # items — [{'product_size_id', 'quantity', 'is_bonus'}] из OrderSerializer
+        self.user = user
+        self.items = items
+        self.promo_code = promo_code
+
+    def resolve_promo_code(self):
+        if not self.promo_code:
+            return None
+        promo_code = PromoCode.objects.filter(code=self.promo_code).first()
+        if not promo_code or not promo_code.is_valid():
+            raise serializers.ValidationError({"promo_code": "Промокод недействителен или его срок истек."})
+        return promo_code
+
+    def build_items(self, variants):
+        order_items = []
+        for item in self.items:
+            product_size = variants.get(item['product_size_id'])
+            if product_size is None:
+                raise serializers.ValidationError(
+                    {"products": f"ProductSize with id {item['product_size_id']} does not exist."}
+                )
+            is_bonus = item.get('is_bonus', False)
+            order_items.append(OrderItem(
+                product_size=product_size,
+                size_id=product_size.size_id,
+                size_name=product_size.size.name,
+                color_id=product_size.color_id,
+                color_name=product_size.color.name,
+                quantity=item['quantity'],
+                total_amount=variant_unit_price(product_size, is_bonus) * item['quantity'],
+                is_bonus=is_bonus,
+                is_ordered=True,
+            ))
+        return order_items
+
+    def reserve(self, variants, order_items):
+        # Одна и та же позиция может прийти несколькими строками — списывается сумма
+        requested = Counter()
+        for order_item in order_items:
+            requested[order_item.product_size_id] += order_item.quantity
+        try:
+            reserved = reserve_stock(requested)
+        except InsufficientStock as error:
+            names = ', '.join(variants[product_size_id].product.name for product_size_id in error.shortages)
+            raise serializers.ValidationError({"error": f"Недостаточно товара на складе для {names}."})
+        for product_size_id, quantity in reserved.items():
+            variants[product_size_id].quantity = quantity
+        return {variants[product_size_id].product_id for product_size_id in reserved}
+
+    def withdraw_bonus(self, amount):
+        # Проверка и списание одним UPDATE, без сохранения всего пользователя и его сигналов
+        if not amount:
+            return
+        if self.user is None or not User.objects.filter(pk=self.user.pk, bonus__gte=amount).update(
+            bonus=F('bonus') - amount
+        ):
+            raise serializers.ValidationError({"error": "Недостаточно бонусов для оплаты."})
+        self.user.refresh_from_db(fields=['bonus'])
+
+    def assemble(self, **order_fields):
+        variants = load_variants(item['product_size_id'] for item in self.items)
+        order_items = self.build_items(variants)
+        promo_code = self.resolve_promo_code()
+
+        subtotal = sum((order_item.total_amount for order_item in order_items), Decimal(0))
+        bonus_amount = sum(
+            (order_item.total_amount for order_item in order_items if order_item.is_bonus), Decimal(0)
+        )
+        order = Order(user=self.user, promo_code=promo_code, total_bonus_amount=int(bonus_amount) or None,
+                      **order_fields)
+        order.apply_totals(subtotal, bonus_amount)
+        # Остатки и бонусы списываются первыми: при нехватке транзакция откатывается до записи заказа
+        with transaction.atomic():
+            product_ids = self.reserve(variants, order_items)
+            self.withdraw_bonus(bonus_amount)
+            order.save()
+            for order_item in order_items:
+                order_item.order = order
+            OrderItem.objects.bulk_create(order_items)
+            stock_changed(product_ids)
+
+        # Позиции уже в памяти вместе с вариантами — ответ сериализуется без повторной загрузки
+        queryset = order.order_items.all()
+        queryset._result_cache = order_items
+        queryset._prefetch_done = True
+        order._prefetched_objects_cache = {'order_items': queryset}
+        return order
+
+
+def assemble_order(user, items, promo_code=None, **order_fields):
+    return OrderAssembler(user, items, promo_code).assemble(**order_fields)
@@ -0,0 +1,114 @@
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from apps.orders.models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# Обработчики по темам: {'push': функция(payload)}; регистрирует их register_handler
+HANDLERS = {}
+
+MAX_ATTEMPTS = 8
+
+# Сколько взятая строка принадлежит воркеру: если он упал, после этого её возьмёт другой
+LEASE = timedelta(minutes=5)
+
+# Экспоненциальная задержка повторов: 10 с, 20 с, 40 с ... но не больше часа, со случайным разбросом
+BACKOFF_BASE = 10
+BACKOFF_MAX = 3600
+
+
+def register_handler(topic):
+    """Декоратор: функция(payload) выполняет сообщения темы topic. Исключение — повтор с задержкой."""
+    def decorator(handler):
+        HANDLERS[topic] = handler
+        return handler
+    return decorator
+
+
+def enqueue(topic, payload, delay=None):
+    """Пишет сообщение в outbox в текущей транзакции: откат заказа откатывает и его побочные эффекты."""
+    available_at = timezone.now() + delay if delay else timezone.now()
+    return OutboxMessage.objects.create(topic=topic, payload=payload, available_at=available_at)
+
+
+def backoff(attempts):
+    delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claim_messages(limit, lease=LEASE):
+    """
+    Забирает до limit готовых сообщений: строки, которые держит другой воркер, пропускаются (SKIP LOCKED),
+    а взятые сдвигаются на время аренды — блокировка не держится, пока выполняются обработчики.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        messages = list(
+            OutboxMessage.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', available_at__lte=now)
+            .order_by('available_at', 'id')[:limit]
+        )
+        if messages:
+            for message in messages:
+                message.attempts += 1
+                message.available_at = now + lease
+            OutboxMessage.objects.bulk_update(messages, ['attempts', 'available_at'])
+    return messages
+
+
+def _run(message):
+    try:
+        handler = HANDLERS.get(message.topic)
+        if handler is None:
+            raise LookupError(f"Нет обработчика для темы {message.topic}")
+        handler(message.payload)
+        return None
+    except Exception as error:
+        logger.warning("Outbox %s #%s: попытка %s не удалась: %r", message.topic, message.id, message.attempts, error)
+        return repr(error)
+
+
+def _run_in_thread(message):
+    # У потока пула своё соединение; пул живёт одну пачку, поэтому соединение закрывается сразу
+    try:
+        return _run(message)
+    finally:
+        connection.close()
+
+
+def dispatch(messages, concurrency=1, max_attempts=MAX_ATTEMPTS):
+    """Выполняет взятые сообщения параллельно и записывает итог: выполнено, повтор позже или ошибка."""
+    if concurrency > 1 and len(messages) > 1:
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='outbox') as executor:
+            errors = list(executor.map(_run_in_thread, messages))
+    else:
+        errors = [_run(message) for message in messages]
+
+    now = timezone.now()
+    for message, error in zip(messages, errors):
+        if error is None:
+            message.status = 'done'
+            message.processed_at = now
+            message.last_error = ''
+        elif message.attempts >= max_attempts:
+            message.status = 'failed'
+            message.last_error = error
+        else:
+            message.available_at = now + backoff(message.attempts)
+            message.last_error = error
+    OutboxMessage.objects.bulk_update(messages, ['status', 'processed_at', 'available_at', 'last_error'])
+    return sum(error is None for error in errors)
+
+
+def process_outbox(batch_size=50, concurrency=1, max_attempts=MAX_ATTEMPTS):
+    """Один проход воркера; возвращает (взято, выполнено)."""
+    messages = claim_messages(batch_size)
+    if not messages:
+        return 0, 0
+    return len(messages), dispatch(messages, concurrency, max_attempts)
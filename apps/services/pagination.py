@@ -1,5 +1,16 @@
+import json
+import math
+from base64 import b64decode, b64encode
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection
+from django.db.models import F, OrderBy, Q
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class CustomPagination(PageNumberPagination):
@@ -15,3 +26,167 @@ class CustomPagination(PageNumberPagination):
             'previous': self.get_previous_link(),
             'results': data,
         })
+
+
+class KeysetPagination(CustomPagination):
+    """
+    Постраничный вывод с курсором по запросу клиента (?pagination=cursor или ?cursor=...). Страница выбирается
+    условием WHERE по (поле сортировки, id) вместо OFFSET, поэтому глубина страницы не влияет на время.
+    Без этих параметров работает как CustomPagination.
+
+    count в режиме курсора — оценка планировщика PostgreSQL (count_is_estimate=true); точное значение
+    возвращается по ?with_count=true. Сортировка берётся из запроса (в том числе после OrderingFilter),
+    учитывается первое поле, id добавляется для однозначности.
+    """
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    with_count_query_param = 'with_count'
+
+    def is_cursor_mode(self, request):
+        return (self.cursor_query_param in request.query_params
+                or request.query_params.get(self.mode_query_param) == 'cursor')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_mode = self.is_cursor_mode(request)
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending, self.nulls_first = self.get_ordering(queryset)
+        self.nullable = self.is_nullable(queryset.model, self.field)
+        cursor = self.decode_cursor(request)
+        self.backwards = cursor is not None and cursor['d'] == 'prev'
+        self.base_queryset = queryset
+
+        descending = self.descending != self.backwards
+        nulls_first = self.nulls_first != self.backwards
+        queryset = queryset.order_by(*self.order_by(descending, nulls_first))
+        if cursor is not None:
+            queryset = queryset.filter(self.after(cursor['v'], cursor['id'], descending, nulls_first))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.backwards:
+            rows.reverse()
+        self.has_next = has_more if not self.backwards else True
+        self.has_previous = has_more if self.backwards else cursor is not None
+        self.rows = rows
+        return rows
+
+    def get_ordering(self, queryset):
+        order_by = queryset.query.order_by or queryset.model._meta.ordering or ['-id']
+        term = order_by[0]
+        if isinstance(term, str):
+            field = term.lstrip('-')
+            descending = term.startswith('-')
+            nulls_first = None
+        elif isinstance(term, OrderBy) and isinstance(term.expression, F):
+            field = term.expression.name
+            descending = term.descending
+            nulls_first = term.nulls_first or (None if not term.nulls_last else False)
+        else:
+            field, descending, nulls_first = 'id', True, None
+        if field == 'pk':
+            field = 'id'
+        if '__' in field:
+            # Значение поля связанной модели недоступно на строке как атрибут — листаем по id
+            field, descending, nulls_first = 'id', descending, None
+        # Как в PostgreSQL по умолчанию: NULL больше любого значения
+        return field, descending, descending if nulls_first is None else nulls_first
+
+    def is_nullable(self, model, field):
+        try:
+            return model._meta.get_field(field).null
+        except FieldDoesNotExist:
+            # Аннотация: не знаем заранее, может ли она быть NULL
+            return True
+
+    def order_by(self, descending, nulls_first):
+        if self.field == 'id':
+            return [F('id').desc() if descending else F('id').asc()]
+        nulls = {'nulls_first': True} if nulls_first else {'nulls_last': True}
+        primary = F(self.field).desc(**nulls) if descending else F(self.field).asc(**nulls)
+        return [primary, F('id').desc() if descending else F('id').asc()]
+
+    def after(self, value, last_id, descending, nulls_first):
+        """Условие «строго после позиции (value, last_id)» в заданном порядке."""
+        id_after = Q(id__lt=last_id) if descending else Q(id__gt=last_id)
+        if self.field == 'id':
+            return id_after
+        if value is None:
+            condition = Q(**{f'{self.field}__isnull': True}) & id_after
+            if nulls_first:
+                condition |= Q(**{f'{self.field}__isnull': False})
+            return condition
+        lookup = 'lt' if descending else 'gt'
+        # Лишнее на вид условие lte/gte даёт планировщику границу для чтения индекса (поле, id) с позиции курсора
+        condition = Q(**{f'{self.field}__{lookup}e': value}) & (
+            Q(**{f'{self.field}__{lookup}': value}) | (Q(**{self.field: value}) & id_after)
+        )
+        if self.nullable and not nulls_first:
+            condition |= Q(**{f'{self.field}__isnull': True})
+        return condition
+
+    def encode_value(self, value):
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return value
+
+    def encode_cursor(self, row, direction):
+        position = {'v': self.encode_value(getattr(row, self.field)), 'id': row.id, 'd': direction}
+        token = b64encode(json.dumps(position).encode()).decode()
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            cursor = json.loads(b64decode(token.encode()).decode())
+            if cursor['d'] not in ('next', 'prev') or not isinstance(cursor['id'], int):
+                raise ValueError
+            return cursor
+        except (ValueError, KeyError, TypeError):
+            raise NotFound("Неверный курсор")
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if not self.has_next or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[-1], 'next')
+
+    def get_previous_link(self):
+        if not self.cursor_mode:
+            return super().get_previous_link()
+        if not self.has_previous or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[0], 'prev')
+
+    def get_count(self):
+        """Точный COUNT только по запросу клиента, иначе — оценка планировщика без обхода строк."""
+        queryset = self.base_queryset.order_by()
+        if self.request.query_params.get(self.with_count_query_param) in ('1', 'true'):
+            return queryset.count(), False
+        if connection.vendor != 'postgresql':
+            return None, True
+        plan = json.loads(queryset.explain(format='json'))
+        return int(plan[0]['Plan']['Plan Rows']), True
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        count, estimated = self.get_count()
+        return Response({
+            'count': count,
+            'count_is_estimate': estimated,
+            'total_pages': math.ceil(count / self.page_size) if count is not None else None,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
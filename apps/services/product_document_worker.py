@@ -0,0 +1,18 @@
+# Задачи пула процессов для полной пересборки документов продуктов. Модуль импортируется дочерним процессом
+# до настройки Django, поэтому всё, что зависит от приложений, импортируется внутри функций.
+
+
+def init_worker():
+    import django
+    django.setup()
+
+
+def build_chunk(product_ids):
+    from django.db import close_old_connections
+
+    from apps.services.product_documents import build_product_documents
+
+    try:
+        return build_product_documents(product_ids)
+    finally:
+        close_old_connections()
@@ -0,0 +1,236 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import urljoin
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import close_old_connections, transaction
+from django.http import HttpRequest
+from django.utils import translation
+from modeltranslation.utils import get_language
+from rest_framework.response import Response
+
+from apps.product.api.serializers import (
+    ProductDetailSerializer,
+    ProductDocumentSerializer,
+    ProductSerializer,
+    ProductSimpleSerializer,
+)
+from apps.product.models import Product, ProductDocument
+from apps.services.product_document_worker import build_chunk, init_worker
+from apps.services.product_listing import apply_detail_plan, apply_listing_plan
+from apps.services.product_sampling import hydrate, similar_ids
+from apps.services.response_cache import invalidate_tags, model_tag
+
+logger = logging.getLogger(__name__)
+
+# Поля, которые накладываются на документ из аннотаций плана списка для текущего пользователя
+USER_FIELDS = ('is_favorite', 'is_ordered')
+
+# Адреса в документах строятся от этого условного хоста и подменяются на хост запроса при выдаче
+DOCUMENT_ORIGIN = 'http://product-document.invalid'
+
+BATCH_SIZE = 200
+
+_pending = set()
+_pending_lock = threading.Lock()
+# Один поток: пересборки идут по очереди, изменения, пришедшие во время сборки, попадают в следующую
+_dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='product-documents')
+
+
+class _DocumentRequest(HttpRequest):
+    """Запрос-заглушка для сериализаторов: абсолютные адреса без проверки хоста."""
+
+    def __init__(self):
+        super().__init__()
+        self.user = AnonymousUser()
+
+    def build_absolute_uri(self, location=None):
+        return urljoin(f'{DOCUMENT_ORIGIN}/', location or '/')
+
+
+def build_product_documents(product_ids):
+    """Собирает документы продуктов на всех языках и записывает их пачкой. Возвращает число продуктов."""
+    with transaction.atomic():
+        # Блокировка документов: изменение, пометившее их устаревшими, сначала закоммитится и попадёт в сборку,
+        # а следующее дождётся записи и пометит их снова
+        list(ProductDocument.objects.select_for_update().filter(product_id__in=product_ids)
+             .order_by('id').values_list('id', flat=True))
+        products = list(apply_detail_plan(Product.objects.filter(id__in=product_ids)))
+        if not products:
+            return 0
+        context = {'request': _DocumentRequest()}
+        documents = []
+        for language, _ in settings.LANGUAGES:
+            with translation.override(language):
+                data = ProductDocumentSerializer(products, many=True, context=context).data
+            documents += [
+                ProductDocument(product_id=product.id, language=language, data=item)
+                for product, item in zip(products, data)
+            ]
+        ProductDocument.objects.bulk_create(
+            documents, update_conflicts=True, unique_fields=['product', 'language'],
+            update_fields=['data', 'is_stale', 'built_at'],
+        )
+    # bulk_create не шлёт сигналов — сбрасываем закэшированные ответы, собранные из прежних документов
+    invalidate_tags([model_tag(ProductDocument)])
+    return len(products)
+
+
+def schedule_document_rebuild(product_ids):
+    """
+    Помечает документы устаревшими в транзакции, в которой изменились данные, и ставит их пересборку
+    в фон после коммита. Если процесс перезапустится раньше, пометка останется: такие документы
+    не отдаются, а пересобираются при следующем чтении или командой rebuild_product_documents --stale.
+    """
+    product_ids = {product_id for product_id in product_ids if product_id is not None}
+    if product_ids:
+        ProductDocument.objects.filter(product_id__in=product_ids, is_stale=False).update(is_stale=True)
+        transaction.on_commit(lambda: _enqueue(product_ids))
+
+
+def _enqueue(product_ids):
+    with _pending_lock:
+        scheduled = bool(_pending)
+        _pending.update(product_ids)
+    if not scheduled:
+        _dispatcher.submit(_rebuild_pending)
+
+
+def _rebuild_pending():
+    with _pending_lock:
+        product_ids = sorted(_pending)
+        _pending.clear()
+    try:
+        for start in range(0, len(product_ids), BATCH_SIZE):
+            build_product_documents(product_ids[start:start + BATCH_SIZE])
+    except Exception:
+        logger.exception("Не удалось пересобрать документы продуктов")
+    finally:
+        close_old_connections()
+
+
+def rebuild_stale_product_documents(batch_size=BATCH_SIZE):
+    """Пересобирает помеченные документы, например оставшиеся после перезапуска. Возвращает число продуктов."""
+    product_ids = sorted(set(ProductDocument.objects.filter(is_stale=True).values_list('product_id', flat=True)))
+    return sum(
+        build_product_documents(product_ids[start:start + batch_size])
+        for start in range(0, len(product_ids), batch_size)
+    )
+
+
+def rebuild_all_product_documents(workers=None, batch_size=BATCH_SIZE, progress=None):
+    """
+    Полная пересборка: id продуктов делятся на пачки, пачки собираются в пуле процессов.
+    При workers=0 всё выполняется в текущем процессе.
+    """
+    product_ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+    chunks = [product_ids[start:start + batch_size] for start in range(0, len(product_ids), batch_size)]
+
+    def collect(counts):
+        built = 0
+        for count in counts:
+            built += count
+            if progress:
+                progress(built, len(product_ids))
+        return built
+
+    if workers == 0:
+        return collect(map(build_product_documents, chunks))
+
+    workers = workers or min(4, os.cpu_count() or 1)
+    # spawn: дочерние процессы настраивают Django заново и открывают свои соединения с базой
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker) as pool:
+        built = collect(pool.map(build_chunk, chunks))
+    # Сброс тегов в дочерних процессах не виден кэшу в памяти этого процесса
+    invalidate_tags([model_tag(ProductDocument)])
+    return built
+
+
+def _absolutize(value, origin):
+    if isinstance(value, str):
+        return value.replace(DOCUMENT_ORIGIN, origin) if DOCUMENT_ORIGIN in value else value
+    if isinstance(value, dict):
+        return {key: _absolutize(item, origin) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_absolutize(item, origin) for item in value]
+    return value
+
+
+def _load_documents(product_ids):
+    # Устаревший документ — как отсутствующий: продукт сериализуется обычным способом, а документ
+    # ставится в пересборку, если её потерял перезапуск
+    documents = {}
+    stale_ids = set()
+    rows = ProductDocument.objects.filter(product_id__in=product_ids, language=get_language()).values_list(
+        'product_id', 'data', 'is_stale'
+    )
+    for product_id, data, is_stale in rows:
+        if is_stale:
+            stale_ids.add(product_id)
+        else:
+            documents[product_id] = data
+    if stale_ids:
+        _enqueue(stale_ids)
+    return documents
+
+
+def _project(product, document, fields, origin):
+    return {
+        field: getattr(product, field, False) if field in USER_FIELDS else _absolutize(document[field], origin)
+        for field in fields
+    }
+
+
+def render_products(products, request, serializer_class=ProductSerializer):
+    """
+    Данные продуктов в формате serializer_class из документов на языке запроса, флаги пользователя —
+    из аннотаций apply_listing_plan. Продукты без документа сериализуются обычным способом.
+    """
+    fields = serializer_class.Meta.fields
+    origin = request.build_absolute_uri('/').rstrip('/')
+    documents = _load_documents([product.id for product in products])
+    missing = [product.id for product in products if product.id not in documents]
+    fallback = {}
+    if missing:
+        queryset = apply_listing_plan(Product.objects.filter(id__in=missing), request.user)
+        fallback = {
+            item['id']: item
+            for item in serializer_class(queryset, many=True, context={'request': request}).data
+        }
+    return [
+        _project(product, documents[product.id], fields, origin) if product.id in documents
+        else fallback[product.id]
+        for product in products
+    ]
+
+
+def render_product_detail(product, request):
+    """Карточка продукта из документа; product загружен планом списка (флаги пользователя)."""
+    documents = _load_documents([product.id])
+    if product.id not in documents:
+        product = apply_detail_plan(Product.objects.filter(pk=product.pk), request.user).get()
+        return ProductDetailSerializer(product, context={'request': request}).data
+
+    fields = [field for field in ProductDetailSerializer.Meta.fields if field != 'similar_products']
+    data = _project(product, documents[product.id], fields, request.build_absolute_uri('/').rstrip('/'))
+    queryset = apply_listing_plan(Product.objects.all(), request.user).prefetch_related(None)
+    similar = hydrate(queryset, similar_ids(product))
+    data['similar_products'] = render_products(similar, request, ProductSimpleSerializer)
+    return data
+
+
+class ProductDocumentListMixin:
+    """list() для списков продуктов: страница queryset'а собирается из документов, без сериализатора."""
+
+    def list(self, request, *args, **kwargs):
+        # Теги и остальное уже есть в документах — prefetch плана списка не нужен
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(render_products(page, request))
+        return Response(render_products(list(queryset), request))
@@ -0,0 +1,50 @@
+from django.db.models import BooleanField, Exists, F, OuterRef, Prefetch, Value
+from django.db.models.functions import Coalesce
+
+from apps.orders.models import OrderItem
+from apps.product.models import FavoriteProduct, ProductImage, ProductSize, Review
+
+# Сколько последних отзывов встраивается в карточку; остальные — постранично через ProductReviewsView
+DETAIL_REVIEWS_LIMIT = 10
+
+
+def apply_listing_plan(queryset, user=None):
+    """
+    План запроса для списков продуктов: итоговая цена берётся из ProductListing, рейтинг и количество
+    отзывов — из ProductRatingStats, избранное и факт покупки считаются подзапросами, категория и страна
+    подтягиваются join'ом, теги — одним prefetch. Сериализаторы читают эти аннотации вместо запросов на каждую строку.
+    """
+    if user is not None and user.is_authenticated:
+        is_favorite = Exists(FavoriteProduct.objects.filter(user=user, product=OuterRef('pk')))
+        is_ordered = Exists(OrderItem.objects.filter(
+            product_size__product=OuterRef('pk'), order__user=user, is_ordered=True
+        ))
+    else:
+        is_favorite = Value(False, output_field=BooleanField())
+        is_ordered = Value(False, output_field=BooleanField())
+
+    return queryset.select_related('category', 'country').prefetch_related('tags').annotate(
+        effective_price=F('listing__effective_price'),
+        review_count=Coalesce(F('rating_stats__commented_review_count'), Value(0)),
+        average_rating=Coalesce(F('rating_stats__average_rating'), Value(0.0)),
+        is_favorite=is_favorite,
+        is_ordered=is_ordered,
+    )
+
+
+def reviews_queryset():
+    return Review.objects.select_related('user').prefetch_related('images')
+
+
+def apply_detail_plan(queryset, user=None):
+    """
+    План запроса для карточки продукта поверх плана списка: связи один-к-одному подтягиваются join'ом,
+    размеры, изображения, характеристики и последние DETAIL_REVIEWS_LIMIT отзывов — по одному prefetch
+    на связь. Число запросов не зависит от количества размеров и отзывов.
+    """
+    return apply_listing_plan(queryset, user).select_related('gender', 'size_chart').prefetch_related(
+        Prefetch('product_sizes', queryset=ProductSize.objects.select_related('color', 'size').order_by('id')),
+        Prefetch('product_images', queryset=ProductImage.objects.order_by('id')),
+        'product_characteristics',
+        Prefetch('product_reviews', queryset=reviews_queryset()[:DETAIL_REVIEWS_LIMIT], to_attr='latest_reviews'),
+    )
@@ -0,0 +1,137 @@
+import random
+
+from django.core.cache import cache
+
+from apps.product.models import Product, ProductRecommendation
+
+# Пулы id живут в кэше; сигналы сбрасывают их при изменении продуктов, срок — страховка от пропущенных сигналов
+POOL_TIMEOUT = 600
+
+POOL_FILTERS = {
+    'popular': {'is_popular': True, 'is_active': True},
+    'new': {'is_new': True, 'is_active': True},
+}
+
+# Поля продукта, от которых зависит попадание в пулы popular/new
+POOL_FIELDS = {'is_popular', 'is_new', 'is_active'}
+
+MAX_SEED = 2 ** 31 - 1
+
+# Похожих товаров в карточке
+SIMILAR_LIMIT = 10
+
+
+def _pool_key(name):
+    return f'product_pool:{name}'
+
+
+def _similar_key(product_id):
+    return f'product_pool:similar:{product_id}'
+
+
+def get_pool(name):
+    """Отсортированный кортеж id продуктов пула popular/new."""
+    key = _pool_key(name)
+    pool = cache.get(key)
+    if pool is None:
+        pool = tuple(Product.objects.filter(**POOL_FILTERS[name]).order_by('id').values_list('id', flat=True))
+        cache.set(key, pool, POOL_TIMEOUT)
+    return pool
+
+
+def _load_similar_pool(product):
+    recommended = tuple(
+        ProductRecommendation.objects.filter(product=product, rank__lte=SIMILAR_LIMIT)
+        .order_by('rank').values_list('recommended_id', flat=True)
+    )
+    if recommended:
+        return True, recommended
+    curated = tuple(product.similar_products.order_by('id').values_list('id', flat=True))
+    if curated:
+        return False, curated
+    # Новинки той же категории — в постоянном порядке, чтобы ответ карточки не менялся от запроса к запросу
+    return True, tuple(
+        Product.objects.filter(category_id=product.category_id, is_active=True).exclude(pk=product.pk)
+        .order_by('-id').values_list('id', flat=True)[:SIMILAR_LIMIT]
+    )
+
+
+def get_similar_pool(product):
+    """
+    (упорядочен ли, id) похожих продуктов: рассчитанные по заказам и избранному соседи в порядке оценки,
+    если их нет — подобранные вручную, иначе последние добавленные активные продукты той же категории.
+    """
+    key = _similar_key(product.pk)
+    pool = cache.get(key)
+    if pool is None:
+        pool = _load_similar_pool(product)
+        cache.set(key, pool, POOL_TIMEOUT)
+    return pool
+
+
+def similar_ids(product, limit=SIMILAR_LIMIT):
+    """Id похожих продуктов для карточки: лучшие рассчитанные соседи или случайная выборка из пула."""
+    ranked, pool = get_similar_pool(product)
+    return list(pool[:limit]) if ranked else sample_ids(pool, 0, limit)
+
+
+def invalidate_pools():
+    cache.delete_many([_pool_key(name) for name in POOL_FILTERS])
+
+
+def invalidate_similar_pools(product_ids):
+    cache.delete_many([_similar_key(product_id) for product_id in product_ids])
+
+
+def sample_ids(pool, start, stop, seed=None):
+    """
+    Элементы start..stop случайной перестановки пула. Частичный Фишер-Йетс с заменами в словаре
+    работает за O(stop) и не копирует пул; при одном seed префикс перестановки не зависит от stop,
+    поэтому страницы одной выдачи не пересекаются.
+    """
+    rng = random.Random(seed)
+    size = len(pool)
+    stop = min(stop, size)
+    swapped = {}
+    result = []
+    for index in range(stop):
+        other = rng.randrange(index, size)
+        value = swapped.get(other, other)
+        swapped[other] = swapped.get(index, index)
+        if index >= start:
+            result.append(pool[value])
+    return result
+
+
+def hydrate(queryset, ids):
+    """Продукты по списку id одним запросом в порядке списка."""
+    products = {product.id: product for product in queryset.filter(id__in=ids)}
+    return [products[product_id] for product_id in ids if product_id in products]
+
+
+def new_seed():
+    return random.randint(0, MAX_SEED)
+
+
+class RandomSample:
+    """
+    Ленивая последовательность для пагинатора: длина — размер пула, срез выбирает id из
+    перестановки по seed и загружает только их.
+    """
+
+    def __init__(self, queryset, pool, seed):
+        self.queryset = queryset
+        self.pool = pool
+        self.seed = seed
+
+    def __len__(self):
+        return len(self.pool)
+
+    def count(self):
+        return len(self.pool)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, _ = item.indices(len(self.pool))
+            return hydrate(self.queryset, sample_ids(self.pool, start, stop, self.seed))
+        return self[item:item + 1][0]
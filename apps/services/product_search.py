@@ -0,0 +1,102 @@
+import re
+
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import F, OuterRef, Q, Subquery, TextField, Value
+from django.db.models.functions import Coalesce, Concat, Greatest
+
+from apps.product.models import Characteristic, Product
+
+# Конфигурации полнотекстового поиска PostgreSQL для языков сайта; для кыргызского словаря нет
+SEARCH_CONFIGS = {'ru': 'russian', 'en': 'english', 'ky': 'simple'}
+
+# Поля продукта, при изменении которых нужно пересобрать поисковый вектор
+SEARCH_FIELDS = {'name', 'description', 'article', *(
+    f'{field}_{language}' for field in ('name', 'description') for language, _ in settings.LANGUAGES
+)}
+
+ARTICLE_RE = re.compile(r'\d{1,9}')
+TERM_RE = re.compile(r'\w+')
+
+
+def search_enabled():
+    return connection.vendor == 'postgresql'
+
+
+def _characteristics_text(language, characteristic_model=Characteristic):
+    texts = (
+        characteristic_model.objects.filter(product=OuterRef('pk'))
+        .order_by()
+        .values('product')
+        .annotate(text=StringAgg(
+            Concat(f'name_{language}', Value(' '), f'value_{language}', output_field=TextField()), ' '
+        ))
+        .values('text')
+    )
+    return Coalesce(Subquery(texts), Value(''), output_field=TextField())
+
+
+def search_vector_expression(characteristic_model=Characteristic):
+    """Вектор из названий (A), характеристик (B) и описаний (C) на всех языках плюс артикул."""
+    vector = SearchVector('article', config='simple', weight='A')
+    for language, _ in settings.LANGUAGES:
+        config = SEARCH_CONFIGS.get(language, 'simple')
+        vector += SearchVector(f'name_{language}', config=config, weight='A')
+        vector += SearchVector(_characteristics_text(language, characteristic_model), config=config, weight='B')
+        vector += SearchVector(f'description_{language}', config=config, weight='C')
+    return vector
+
+
+def update_search_vectors(queryset=None, characteristic_model=Characteristic):
+    """Пересобирает search_vector одним UPDATE для переданных продуктов (по умолчанию — для всех)."""
+    if not search_enabled():
+        return 0
+    queryset = Product.objects.all() if queryset is None else queryset
+    return queryset.update(search_vector=search_vector_expression(characteristic_model))
+
+
+def _prefix_query(terms):
+    # Каждое слово ищется по префиксу, чтобы поиск работал по мере набора
+    raw = ' & '.join(f'{term}:*' for term in terms)
+    query = None
+    for config in dict.fromkeys(SEARCH_CONFIGS.values()):
+        part = SearchQuery(raw, config=config, search_type='raw')
+        query = part if query is None else query | part
+    return query
+
+
+def search_products(queryset, text):
+    """
+    Фильтрует и ранжирует продукты по строке поиска. Номер артикула ищется по индексу напрямую,
+    остальной текст — по полнотекстовому вектору с префиксами и по триграммам названий для опечаток.
+    Вне PostgreSQL используется прежний поиск icontains.
+    """
+    text = text.strip()
+    if not text:
+        return queryset
+
+    if ARTICLE_RE.fullmatch(text):
+        return queryset.filter(article__startswith=text)
+
+    name_fields = [f'name_{language}' for language, _ in settings.LANGUAGES]
+    if not search_enabled():
+        condition = Q(article__icontains=text)
+        for field in name_fields:
+            condition |= Q(**{f'{field}__icontains': text})
+        return queryset.filter(condition)
+
+    terms = TERM_RE.findall(text.lower())
+    if not terms:
+        return queryset.none()
+
+    query = _prefix_query(terms)
+    condition = Q(search_vector=query)
+    for field in name_fields:
+        condition |= Q(**{f'{field}__trigram_word_similar': text})
+
+    similarity = Greatest(*(TrigramWordSimilarity(text, field) for field in name_fields))
+    return queryset.filter(condition).annotate(
+        search_rank=Greatest(SearchRank(F('search_vector'), query), similarity),
+    ).order_by('-search_rank', 'id')
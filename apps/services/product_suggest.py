@@ -0,0 +1,299 @@
+import logging
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+from modeltranslation.utils import build_localized_fieldname, get_language
+
+from apps.product.models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+SUGGEST_KINDS = ('products', 'categories', 'articles')
+
+# Сколько подсказок хранится в каждом узле префиксного дерева — это и верхняя граница limit
+MAX_SUGGESTIONS = 20
+
+# Префикс длиннее этого не индексируется: для подсказок хватает начала слова
+MAX_KEY_LENGTH = 32
+
+# Популярные продукты поднимаются выше, как будто у них на столько больше просмотров
+POPULAR_BONUS = 1000
+
+# Сигналы обновляют индекс только в своём процессе, остальные воркеры перестраивают его по истечении срока —
+# в фоне, а до замены отвечает прежний индекс
+INDEX_TTL = 300
+
+WORD_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    return (text or '').lower().replace('ё', 'е')
+
+
+def index_keys(text):
+    """Ключи для поиска по началу любого слова: «беговые кроссовки» находится и по «бег», и по «крос»."""
+    text = normalize(text)
+    return {text[match.start():match.start() + MAX_KEY_LENGTH] for match in WORD_RE.finditer(text)}
+
+
+class TrieNode:
+    __slots__ = ('children', 'entries', 'top')
+
+    def __init__(self):
+        self.children = {}
+        self.entries = set()
+        self.top = []
+
+
+class SuggestTrie:
+    """
+    Префиксное дерево, в каждом узле которого заранее отобраны лучшие MAX_SUGGESTIONS записей поддерева,
+    поэтому поиск — это только проход по символам префикса.
+    """
+
+    def __init__(self):
+        self.root = TrieNode()
+        self.items = {}
+        self.keys = {}
+
+    def rank(self, entry_id):
+        item = self.items[entry_id]
+        return -item['score'], item['label'], entry_id
+
+    def path(self, key, create=False):
+        nodes = [self.root]
+        for char in key:
+            node = nodes[-1].children.get(char)
+            if node is None:
+                if not create:
+                    return None
+                node = nodes[-1].children[char] = TrieNode()
+            nodes.append(node)
+        return nodes
+
+    def add(self, entry_id, item, keys):
+        self.items[entry_id] = item
+        self.keys[entry_id] = keys
+        for key in keys:
+            nodes = self.path(key, create=True)
+            nodes[-1].entries.add(entry_id)
+            for node in nodes:
+                if entry_id not in node.top:
+                    node.top.append(entry_id)
+                    node.top.sort(key=self.rank)
+                    del node.top[MAX_SUGGESTIONS:]
+
+    def remove(self, entry_id):
+        keys = self.keys.pop(entry_id, None)
+        if keys is None:
+            return
+        affected = {}
+        for key in keys:
+            nodes = self.path(key)
+            nodes[-1].entries.discard(entry_id)
+            for depth, node in enumerate(nodes):
+                affected[id(node)] = (depth, node)
+
+        # Пересчитываем снизу вверх: топ узла собирается из его записей и уже пересчитанных топов детей
+        for depth, node in sorted(affected.values(), key=lambda pair: -pair[0]):
+            if entry_id in node.top:
+                candidates = set(node.entries)
+                for child in node.children.values():
+                    candidates.update(child.top)
+                candidates.discard(entry_id)
+                node.top = sorted(candidates, key=self.rank)[:MAX_SUGGESTIONS]
+        del self.items[entry_id]
+
+    def search(self, prefix, limit):
+        nodes = self.path(normalize(prefix)[:MAX_KEY_LENGTH])
+        if nodes is None:
+            return []
+        return [self.items[entry_id] for entry_id in nodes[-1].top[:limit]]
+
+
+def _localized_name(row, language):
+    return row[build_localized_fieldname('name', language)] or row['name']
+
+
+def _product_score(product):
+    return product.views_count + (POPULAR_BONUS if product.is_popular else 0)
+
+
+class SuggestIndex:
+    """Подсказки для одного языка: отдельные деревья для продуктов, категорий и артикулов."""
+
+    def __init__(self, language):
+        self.language = language
+        self.tries = {kind: SuggestTrie() for kind in SUGGEST_KINDS}
+        self.built_at = time.monotonic()
+
+    def build(self):
+        name_field = build_localized_fieldname('name', self.language)
+        products = Product.objects.filter(is_active=True).only(
+            'id', 'slug', 'article', 'views_count', 'is_popular', 'name', name_field
+        )
+        for product in products.iterator(chunk_size=2000):
+            self.add_product(product)
+
+        categories = Category.objects.annotate(
+            score=Coalesce(Sum('products__views_count'), 0)
+        ).values('id', 'slug', 'score', 'name', name_field)
+        for category in categories:
+            self.add_category(category)
+        return self
+
+    def add_product(self, product):
+        name = getattr(product, build_localized_fieldname('name', self.language)) or product.name
+        score = _product_score(product)
+        item = {'id': product.id, 'name': name, 'slug': product.slug}
+        self.tries['products'].add(product.id, {**item, 'label': normalize(name), 'score': score}, index_keys(name))
+        if product.article:
+            self.tries['articles'].add(
+                product.id, {**item, 'article': product.article, 'label': product.article, 'score': score},
+                {product.article[:MAX_KEY_LENGTH]},
+            )
+
+    def remove_product(self, product_id):
+        self.tries['products'].remove(product_id)
+        self.tries['articles'].remove(product_id)
+
+    def add_category(self, row):
+        name = _localized_name(row, self.language)
+        item = {'id': row['id'], 'name': name, 'slug': row['slug'], 'label': normalize(name), 'score': row['score']}
+        self.tries['categories'].add(row['id'], item, index_keys(name))
+
+    def remove_category(self, category_id):
+        self.tries['categories'].remove(category_id)
+
+    def search(self, prefix, limit):
+        return {
+            kind: [
+                {key: value for key, value in item.items() if key not in ('label', 'score')}
+                for item in trie.search(prefix, limit)
+            ]
+            for kind, trie in self.tries.items()
+        }
+
+
+_indexes = {}
+# Короткая блокировка поиска и правок готовых индексов; сборка идёт без неё
+_lock = threading.RLock()
+# Первая сборка индекса языка — синхронно, но одна на процесс
+_build_lock = threading.Lock()
+# Языки, индекс которых сейчас собирается: правки, пришедшие во время сборки, -> применяются к новому индексу
+_building = {}
+_refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='product-suggest')
+
+
+def _build(language):
+    index = SuggestIndex(language).build()
+    with _lock:
+        # Сборка читала базу до этих изменений — повторяем их на новом индексе перед заменой
+        for change in _building.pop(language, ()):
+            change(index)
+        _indexes[language] = index
+    return index
+
+
+def _refresh(language):
+    try:
+        _build(language)
+    except Exception:
+        with _lock:
+            _building.pop(language, None)
+            index = _indexes.get(language)
+            if index is not None:
+                # Следующая попытка — через INDEX_TTL, а пока отвечает прежний индекс
+                index.built_at = time.monotonic()
+        logger.exception("Не удалось перестроить индекс подсказок (%s)", language)
+    finally:
+        close_old_connections()
+
+
+def get_suggest_index(language=None):
+    language = language or get_language()
+    index = _indexes.get(language)
+    if index is None:
+        with _build_lock:
+            index = _indexes.get(language)
+            if index is None:
+                with _lock:
+                    _building[language] = []
+                index = _build(language)
+    elif time.monotonic() - index.built_at > INDEX_TTL:
+        with _lock:
+            refresh = language not in _building
+            if refresh:
+                _building[language] = []
+        if refresh:
+            _refresher.submit(_refresh, language)
+    return index
+
+
+def _apply(change):
+    # Под _lock: правка готовых индексов и запись для тех, что сейчас собираются
+    for index in _indexes.values():
+        change(index)
+    for changes in _building.values():
+        changes.append(change)
+
+
+def suggest(prefix, limit=10, language=None):
+    limit = max(1, min(limit, MAX_SUGGESTIONS))
+    prefix = prefix.strip()
+    if not prefix:
+        return {kind: [] for kind in SUGGEST_KINDS}
+    index = get_suggest_index(language)
+    with _lock:
+        return index.search(prefix, limit)
+
+
+def update_product_suggestions(product):
+    """Переиндексирует продукт во всех уже построенных индексах этого процесса."""
+    def change(index):
+        index.remove_product(product.pk)
+        if product.is_active:
+            index.add_product(product)
+
+    with _lock:
+        _apply(change)
+
+
+def remove_product_suggestions(product_id):
+    with _lock:
+        _apply(lambda index: index.remove_product(product_id))
+
+
+def update_category_suggestions(category_ids):
+    if not _indexes and not _building:
+        return
+    categories = list(Category.objects.filter(id__in=category_ids).annotate(
+        score=Coalesce(Sum('products__views_count'), 0)
+    ).values('id', 'slug', 'score', 'name', *(
+        build_localized_fieldname('name', language) for language, _ in settings.LANGUAGES
+    )))
+
+    def change(index):
+        for category in categories:
+            index.remove_category(category['id'])
+            index.add_category(category)
+
+    with _lock:
+        _apply(change)
+
+
+def remove_category_suggestions(category_id):
+    with _lock:
+        _apply(lambda index: index.remove_category(category_id))
+
+
+def reset_suggest_indexes():
+    with _lock:
+        _indexes.clear()
+        _building.clear()
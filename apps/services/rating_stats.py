@@ -0,0 +1,118 @@
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+
+from apps.product.models import Product, ProductRatingStats, Review
+
+RATING_BUCKETS = (1, 2, 3, 4, 5)
+STATS_FIELDS = ['review_count', 'commented_review_count', 'rating_sum', 'average_rating',
+                *(f'rating_{bucket}' for bucket in RATING_BUCKETS)]
+
+
+def rating_bucket(rating):
+    """Номер столбца гистограммы (1–5) для оценки, округление вверх с половины."""
+    return min(max(int(rating + 0.5), 1), 5)
+
+
+def _bucket_filter(bucket):
+    if bucket == 1:
+        return Q(rating__lt=1.5)
+    if bucket == 5:
+        return Q(rating__gte=4.5)
+    return Q(rating__gte=bucket - 0.5, rating__lt=bucket + 0.5)
+
+
+def _is_commented(review):
+    # Так же, как exclude(comment=''): NULL считается комментарием
+    return review.comment != ''
+
+
+def _stats_rows(product_ids, review_model=Review, stats_model=ProductRatingStats):
+    aggregates = {
+        row['product_id']: row
+        for row in review_model.objects.filter(product_id__in=product_ids).order_by().values('product_id').annotate(
+            review_count=Count('id'),
+            commented_review_count=Count('id', filter=~Q(comment='')),
+            rating_sum=Sum('rating'),
+            **{f'rating_{bucket}': Count('id', filter=_bucket_filter(bucket)) for bucket in RATING_BUCKETS},
+        )
+    }
+    rows = []
+    for product_id in product_ids:
+        row = aggregates.get(product_id, {})
+        review_count = row.get('review_count', 0)
+        rating_sum = row.get('rating_sum') or 0.0
+        rows.append(stats_model(
+            product_id=product_id,
+            review_count=review_count,
+            commented_review_count=row.get('commented_review_count', 0),
+            rating_sum=rating_sum,
+            average_rating=rating_sum / review_count if review_count else 0.0,
+            **{f'rating_{bucket}': row.get(f'rating_{bucket}', 0) for bucket in RATING_BUCKETS},
+        ))
+    return rows
+
+
+def refresh_rating_stats(product_ids, review_model=Review, stats_model=ProductRatingStats):
+    """
+    Пересчитывает статистику указанных продуктов одним групповым запросом.
+    Нужно вызывать после bulk_create/update отзывов, которые не отправляют сигналы.
+    Модели передаются явно из миграций (исторические версии).
+    """
+    product_ids = list(product_ids)
+    if not product_ids:
+        return
+    with transaction.atomic():
+        stats_model.objects.bulk_create(
+            _stats_rows(product_ids, review_model, stats_model),
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=STATS_FIELDS,
+        )
+
+
+def rebuild_rating_stats(batch_size=1000, product_model=Product, review_model=Review,
+                         stats_model=ProductRatingStats):
+    """Полностью пересобирает таблицу статистики пачками по batch_size продуктов. Возвращает число продуктов."""
+    total = 0
+    last_id = 0
+    while True:
+        product_ids = list(
+            product_model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not product_ids:
+            return total
+        refresh_rating_stats(product_ids, review_model, stats_model)
+        total += len(product_ids)
+        last_id = product_ids[-1]
+
+
+def register_review(review):
+    """Инкрементально учитывает новый отзыв."""
+    bucket = f'rating_{rating_bucket(review.rating)}'
+    with transaction.atomic():
+        updated = ProductRatingStats.objects.filter(product_id=review.product_id).update(
+            review_count=F('review_count') + 1,
+            commented_review_count=F('commented_review_count') + int(_is_commented(review)),
+            rating_sum=F('rating_sum') + review.rating,
+            average_rating=(F('rating_sum') + review.rating) / (F('review_count') + 1.0),
+            **{bucket: F(bucket) + 1},
+        )
+        if not updated:
+            # Строки ещё нет — считаем по таблице отзывов, новый отзыв уже в ней
+            refresh_rating_stats([review.product_id])
+
+
+def unregister_review(review):
+    """Инкрементально убирает удалённый отзыв из статистики."""
+    bucket = f'rating_{rating_bucket(review.rating)}'
+    ProductRatingStats.objects.filter(product_id=review.product_id, review_count__gt=0).update(
+        review_count=F('review_count') - 1,
+        commented_review_count=F('commented_review_count') - int(_is_commented(review)),
+        rating_sum=F('rating_sum') - review.rating,
+        average_rating=Case(
+            When(review_count__lte=1, then=Value(0.0)),
+            default=(F('rating_sum') - review.rating) / (F('review_count') - 1.0),
+            output_field=FloatField(),
+        ),
+        **{bucket: F(bucket) - 1},
+    )
@@ -0,0 +1,147 @@
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from apps.orders.models import Order, OrderItem
+from apps.product.models import FavoriteProduct, Product, ProductRecommendation, ProductSize, RecommendationRun
+from apps.services.product_sampling import invalidate_similar_pools
+from apps.services.response_cache import invalidate_model
+
+# Сколько соседей хранится на продукт
+TOP_K = 20
+
+# Вклад одной корзины: совместная покупка весит больше, чем общий список избранного
+ORDER_WEIGHT = 1.0
+FAVORITE_WEIGHT = 0.5
+
+# Корзины крупнее этого (оптовые заказы, избранное «всего подряд») дают квадратичное число пар и почти не несут сигнала
+MAX_BASKET_SIZE = 50
+
+# Корзины: заказ (id заказа) и список избранного пользователя (минус id пользователя, чтобы не пересечься с заказами).
+# В корзине продукт учитывается один раз, сколько бы его вариантов ни было куплено.
+ITEMS_SQL = """
+    SELECT DISTINCT item.order_id AS basket, variant.product_id, %(order_weight)s::float8 AS weight
+    FROM {order_item} item
+    JOIN {order} ON {order}.id = item.order_id
+    JOIN {product_size} variant ON variant.id = item.product_size_id
+    WHERE {order}.order_status <> 'cancelled'
+    UNION ALL
+    SELECT DISTINCT -favorite.user_id, favorite.product_id, %(favorite_weight)s::float8
+    FROM {favorite} favorite
+"""
+
+# Матрица совместной встречаемости строится одним агрегатом по самосоединению корзин; оценка — косинус
+# между векторами корзин двух продуктов: together / sqrt(вес A * вес B). Для каждого продукта остаются
+# TOP_K лучших активных соседей.
+COMPUTE_SQL = """
+    WITH items AS ({items}),
+    baskets AS (
+        SELECT basket FROM items GROUP BY basket HAVING count(*) BETWEEN 2 AND %(max_basket_size)s
+    ),
+    weights AS (
+        SELECT product_id, sum(weight) AS total FROM items GROUP BY product_id
+    ),
+    pairs AS (
+        SELECT a.product_id, b.product_id AS recommended_id, sum(a.weight) AS together
+        FROM items a
+        JOIN baskets ON baskets.basket = a.basket
+        JOIN items b ON b.basket = a.basket AND b.product_id <> a.product_id
+        {selected}
+        GROUP BY a.product_id, b.product_id
+    ),
+    ranked AS (
+        SELECT pairs.product_id, pairs.recommended_id,
+               pairs.together / sqrt(source.total * target.total) AS score,
+               row_number() OVER (
+                   PARTITION BY pairs.product_id
+                   ORDER BY pairs.together / sqrt(source.total * target.total) DESC, pairs.recommended_id
+               ) AS rank
+        FROM pairs
+        JOIN weights source ON source.product_id = pairs.product_id
+        JOIN weights target ON target.product_id = pairs.recommended_id
+        JOIN {product} recommended ON recommended.id = pairs.recommended_id AND recommended.is_active
+    )
+    INSERT INTO {recommendation} (product_id, recommended_id, score, rank)
+    SELECT product_id, recommended_id, score, rank FROM ranked WHERE rank <= %(top_k)s
+"""
+
+# При инкрементальном пересчёте пары строятся только для выбранных продуктов (хэш-соединение, а не ANY по массиву)
+SELECTED_SQL = "JOIN unnest(%(product_ids)s::integer[]) AS selected(id) ON selected.id = a.product_id"
+
+# Продукты из корзин, в которые что-то добавилось после прошлого запуска: только у них меняются пары
+AFFECTED_SQL = """
+    SELECT DISTINCT variant.product_id
+    FROM {order_item} item
+    JOIN {product_size} variant ON variant.id = item.product_size_id
+    WHERE item.order_id IN (SELECT order_id FROM {order_item} WHERE id > %(last_order_item_id)s)
+    UNION
+    SELECT product_id FROM {favorite}
+    WHERE user_id IN (SELECT user_id FROM {favorite} WHERE id > %(last_favorite_id)s)
+"""
+
+
+def _tables():
+    return {
+        'order': connection.ops.quote_name(Order._meta.db_table),
+        'order_item': connection.ops.quote_name(OrderItem._meta.db_table),
+        'product_size': connection.ops.quote_name(ProductSize._meta.db_table),
+        'favorite': connection.ops.quote_name(FavoriteProduct._meta.db_table),
+        'product': connection.ops.quote_name(Product._meta.db_table),
+        'recommendation': connection.ops.quote_name(ProductRecommendation._meta.db_table),
+    }
+
+
+def _affected_products(last_run):
+    params = {'last_order_item_id': last_run.last_order_item_id, 'last_favorite_id': last_run.last_favorite_id}
+    with connection.cursor() as cursor:
+        cursor.execute(AFFECTED_SQL.format(**_tables()), params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def compute_recommendations(full=False, top_k=TOP_K, max_basket_size=MAX_BASKET_SIZE):
+    """
+    Пересчитывает соседей продуктов по истории заказов и избранному и возвращает RecommendationRun.
+    Без full пересчитываются только продукты из корзин, изменившихся после прошлого запуска
+    (новые позиции заказов и избранное); удаление из избранного и отмена заказа видны только
+    при полном пересчёте, поэтому его стоит запускать реже, например раз в неделю.
+    """
+    last_run = RecommendationRun.objects.filter(finished_at__isnull=False).order_by('-id').first()
+    full = full or last_run is None
+    # Границы берутся до расчёта: позиции, добавленные во время него, попадут и в следующий запуск
+    run = RecommendationRun.objects.create(
+        is_full=full,
+        last_order_item_id=OrderItem.objects.aggregate(last=Max('id'))['last'] or 0,
+        last_favorite_id=FavoriteProduct.objects.aggregate(last=Max('id'))['last'] or 0,
+    )
+    product_ids = None if full else _affected_products(last_run)
+
+    tables = _tables()
+    params = {
+        'order_weight': ORDER_WEIGHT,
+        'favorite_weight': FAVORITE_WEIGHT,
+        'max_basket_size': max_basket_size,
+        'product_ids': product_ids,
+        'top_k': top_k,
+    }
+    touched = set()
+    if product_ids != []:
+        with transaction.atomic():
+            recommendations = ProductRecommendation.objects.all()
+            if product_ids is not None:
+                recommendations = recommendations.filter(product_id__in=product_ids)
+            touched.update(recommendations.values_list('product_id', flat=True).distinct())
+            recommendations.delete()
+            with connection.cursor() as cursor:
+                selected = '' if product_ids is None else SELECTED_SQL
+                cursor.execute(
+                    COMPUTE_SQL.format(items=ITEMS_SQL.format(**tables), selected=selected, **tables), params,
+                )
+            touched.update(recommendations.values_list('product_id', flat=True).distinct())
+            invalidate_model(ProductRecommendation)
+    # Пулы похожих в кэше: у этих продуктов соседи появились, изменились или пропали
+    invalidate_similar_pools(touched)
+
+    run.finished_at = timezone.now()
+    run.product_count = len(touched)
+    run.save(update_fields=['finished_at', 'product_count'])
+    return run
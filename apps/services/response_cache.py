@@ -0,0 +1,145 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from modeltranslation.utils import get_language
+from rest_framework.exceptions import APIException
+
+# Срок жизни ответа по умолчанию; вьюха может задать свой через cache_timeout
+RESPONSE_CACHE_TIMEOUT = 300
+
+# Версии тегов живут дольше любых ответов, чтобы сброс тега не потерялся раньше зависимых записей
+TAG_TIMEOUT = 7 * 24 * 60 * 60
+
+STATS_KEY = 'response_cache:stats:{view}:{result}'
+
+
+def model_tag(model):
+    return model._meta.label_lower
+
+
+def _tag_key(tag):
+    return f'response_cache:tag:{tag}'
+
+
+def _entry_key(request, view_name):
+    # Ключ не зависит от порядка параметров запроса; язык — тот, что выбрал LanguageMiddleware,
+    # формат — выбранный рендерер (JSON или browsable API)
+    query = urlencode(sorted((key, value) for key, values in request.GET.lists() for value in values))
+    digest = hashlib.md5(f'{request.path}?{query}'.encode()).hexdigest()
+    return f'response_cache:entry:{view_name}:{get_language()}:{request.accepted_renderer.format}:{digest}'
+
+
+def _tag_versions(tags):
+    versions = cache.get_many([_tag_key(tag) for tag in tags])
+    return tuple(versions.get(_tag_key(tag), 0) for tag in tags)
+
+
+def invalidate_tags(tags):
+    """Сбрасывает все ответы с этими тегами: у тега новая версия, и сохранённые с прежней не совпадут."""
+    # Версия — время сброса, а не счётчик: если ключ тега вытеснят из кэша, старые номера не повторятся
+    version = time.time_ns()
+    cache.set_many({_tag_key(tag): version for tag in tags}, TAG_TIMEOUT)
+
+
+def invalidate_model(model):
+    # Сразу — чтобы этот же запрос не получил старый ответ, и ещё раз после коммита: иначе параллельный
+    # запрос, прочитавший базу до коммита, успел бы снова закэшировать старые данные
+    tags = [model_tag(model)]
+    invalidate_tags(tags)
+    transaction.on_commit(lambda: invalidate_tags(tags))
+
+
+def _count(view_name, result):
+    key = STATS_KEY.format(view=view_name, result=result)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def response_cache_stats(view_names):
+    """{вьюха: {'hit': n, 'miss': n}} по счётчикам в кэше."""
+    keys = {
+        (view_name, result): STATS_KEY.format(view=view_name, result=result)
+        for view_name in view_names for result in ('hit', 'miss')
+    }
+    values = cache.get_many(keys.values())
+    stats = {}
+    for (view_name, result), key in keys.items():
+        stats.setdefault(view_name, {})[result] = values.get(key, 0)
+    return stats
+
+
+class CachedResponse(APIException):
+    def __init__(self, response):
+        super().__init__()
+        self.response = response
+
+
+class ResponseCacheMixin:
+    """
+    Кэш готовых ответов GET. Запись помечается тегами моделей из cache_models и перестаёт совпадать,
+    когда любая из них сохраняется или удаляется. Если ответ зависит от пользователя (user_dependent),
+    кэшируются только анонимные запросы, авторизованные всегда считаются заново.
+    """
+    cache_models = ()
+    cache_timeout = RESPONSE_CACHE_TIMEOUT
+    user_dependent = False
+
+    def get_cache_tags(self):
+        return sorted(model_tag(model) for model in self.cache_models)
+
+    def response_cacheable(self, request):
+        return request.method == 'GET' and not (self.user_dependent and request.user.is_authenticated)
+
+    def response_cache_hit(self, request, meta):
+        """Вызывается при ответе из кэша — для побочных эффектов вьюхи (например, учёта просмотров)."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.response_cache_key = None
+        self.response_cache_meta = None
+        if not self.response_cacheable(request):
+            return
+        view_name = type(self).__name__
+        tags = self.get_cache_tags()
+        key = _entry_key(request, view_name)
+        entry = cache.get(key)
+        self.response_cache_versions = _tag_versions(tags)
+        if entry is not None and entry['versions'] == self.response_cache_versions:
+            _count(view_name, 'hit')
+            self.response_cache_hit(request, entry['meta'])
+            response = HttpResponse(entry['content'], status=entry['status'], content_type=entry['content_type'])
+            response['X-Cache'] = 'HIT'
+            raise CachedResponse(response)
+        _count(view_name, 'miss')
+        self.response_cache_key = key
+
+    def handle_exception(self, exc):
+        if isinstance(exc, CachedResponse):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        key = getattr(self, 'response_cache_key', None)
+        if key and response.status_code == 200 and hasattr(response, 'add_post_render_callback'):
+            versions, meta, timeout = self.response_cache_versions, self.response_cache_meta, self.cache_timeout
+            response['X-Cache'] = 'MISS'
+
+            def store(rendered):
+                cache.set(key, {
+                    'versions': versions,
+                    'meta': meta,
+                    'content': rendered.content,
+                    'status': rendered.status_code,
+                    'content_type': rendered['Content-Type'],
+                }, timeout)
+
+            response.add_post_render_callback(store)
+        return response
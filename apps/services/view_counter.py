@@ -0,0 +1,132 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+from apps.product.models import Product
+
+logger = logging.getLogger(__name__)
+
+# Не дольше этого просмотры копятся в памяти процесса до записи в базу
+FLUSH_INTERVAL = 10
+
+# При таком числе продуктов с накопленными просмотрами буфер сбрасывается сразу
+MAX_PENDING_PRODUCTS = 1000
+
+
+class ViewCounterBuffer:
+    """
+    Буфер просмотров продуктов. Запрос только увеличивает счётчик в памяти, а накопленные значения
+    записываются пачками: один UPDATE views_count = views_count + n на каждое различное n.
+    Остаток записывается при штатной остановке процесса; при SIGKILL теряется не больше просмотров,
+    чем накоплено за FLUSH_INTERVAL. Состояние буфера видно в /api/v1/products/view-counter/stats/.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, max_pending=MAX_PENDING_PRODUCTS):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.pending = Counter()
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.flushed_views = 0
+        self.flush_count = 0
+        self.failed_flushes = 0
+        # Просмотры удалённых продуктов: UPDATE их не находит, и они отбрасываются
+        self.dropped_views = 0
+        self.worker = None
+
+    def record(self, product_id, count=1):
+        with self.lock:
+            self.pending[product_id] += count
+            overflow = len(self.pending) >= self.max_pending
+        self.start_worker()
+        if overflow:
+            self.flush()
+
+    def start_worker(self):
+        if self.worker is None:
+            with self.lock:
+                if self.worker is None:
+                    self.worker = threading.Thread(target=self.run, name='view-counter-flush', daemon=True)
+                    self.worker.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+            # Поток живёт дольше любого запроса — соединение закрываем сами
+            close_old_connections()
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, Counter()
+                self.last_flush = time.monotonic()
+            if not pending:
+                return 0
+
+            by_increment = defaultdict(list)
+            for product_id, count in pending.items():
+                by_increment[count].append(product_id)
+            dropped = 0
+            try:
+                # Все UPDATE одной транзакцией: иначе после сбоя на середине уже записанные пачки вернулись бы
+                # в буфер и были бы посчитаны дважды
+                with transaction.atomic():
+                    for count, product_ids in by_increment.items():
+                        updated = Product.objects.filter(id__in=product_ids).update(
+                            views_count=F('views_count') + count
+                        )
+                        dropped += (len(product_ids) - updated) * count
+            except Exception:
+                # Возвращаем просмотры в буфер, чтобы не потерять их до следующей попытки
+                with self.lock:
+                    self.pending.update(pending)
+                    self.failed_flushes += 1
+                logger.exception("Не удалось записать просмотры продуктов, в буфере %s продуктов", len(pending))
+                return 0
+
+            views = sum(pending.values()) - dropped
+            with self.lock:
+                self.flushed_views += views
+                self.dropped_views += dropped
+                self.flush_count += 1
+            logger.info("Записано %s просмотров из буфера на %s продуктов", views, len(pending))
+            if dropped:
+                logger.warning("Отброшено %s просмотров удалённых продуктов", dropped)
+            return views
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pending_products': len(self.pending),
+                'pending_views': sum(self.pending.values()),
+                'flushed_views': self.flushed_views,
+                'flush_count': self.flush_count,
+                'failed_flushes': self.failed_flushes,
+                'dropped_views': self.dropped_views,
+                'seconds_since_flush': round(time.monotonic() - self.last_flush, 3),
+            }
+
+
+view_counter = ViewCounterBuffer()
+
+# Остаток буфера записывается при штатной остановке процесса
+atexit.register(view_counter.flush)
+
+
+def record_product_view(product_id):
+    view_counter.record(product_id)
+
+
+def flush_product_views():
+    return view_counter.flush()
+
+
+def view_counter_stats():
+    return view_counter.stats()
@@ -38,6 +38,7 @@ PROJECT_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.humanize',
+    'django.contrib.postgres',
     'daphne',
     'django.contrib.staticfiles',
     'django.contrib.sites',
@@ -114,13 +115,28 @@ DATABASES = {
 WSGI_APPLICATION = 'config.wsgi.application'
 ASGI_APPLICATION = 'config.asgi.application'
 
+# Кэш в памяти процесса; с REDIS_URL — общий для всех процессов
+REDIS_URL = config('REDIS_URL', default='')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+# Уведомления в веб-сокет шлёт воркер outbox из своего процесса: до daphne они дойдут только через общий
+# слой каналов — с REDIS_URL. Без него слой в памяти, и уведомление отправляет процесс, создавший заказ
 CHANNEL_LAYERS = {
     'default': {
+        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'CONFIG': {'hosts': [REDIS_URL]},
+    } if REDIS_URL else {
         'BACKEND': 'channels.layers.InMemoryChannelLayer',
     },
-    'CONFIG': {
-        'hosts': [('127.0.0.1', 6379)],
-    },
 }
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -224,3 +240,7 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL')
+
+# Чат, куда воркер outbox отправляет новые заказы; без токена сообщения в Telegram не ставятся
+TELEGRAM_BOT_TOKEN = config('TELEGRAM_BOT_TOKEN', default='')
+TELEGRAM_CHAT_ID = config('TELEGRAM_CHAT_ID', default='')